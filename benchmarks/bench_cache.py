@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""Count Gitiles requests of a cold and a warm run with the on-disk cache
+
+Usage: python -m benchmarks.bench_cache [--repos N] [--base N] [--ahead1 N] [--ahead2 N] [--new N] [--latency MS]
+
+The next day runs add --new commits on top of manifest2 and rerun on a copy
+of the warm cache, with and without the local commit graph.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import unittest.mock
+
+from benchmarks.bench_range import generate
+from benchmarks.server import Server
+from diffmanifests.proto.proto import Label
+from diffmanifests.querier.querier import Querier
+
+
+def grow(graphs, data, count):
+    # One more day of commits on top of every manifest2 head
+    for item in data[Label.UPDATE_REPO].values():
+        graph = graphs[item[1]['name']]
+        head = item[1]['commit']
+        epoch = graph.commits[head]['_epoch']
+        for index in range(count):
+            sha = head[:16] + '%024x' % (0xffff00 + index)
+            graph.add(sha, [head], epoch + (index + 1) * 60)
+            head = sha
+        graph.refs['refs/heads/' + item[1]['branch']] = head
+        item[1]['commit'] = head
+
+
+def run(server, data, name, cache, local=True):
+    config = {
+        'gerrit': {'url': server.url()},
+        'gitiles': {'url': server.url(), 'retry': 0}
+    }
+    if cache is not None:
+        config['cache'] = {'dir': cache}
+    querier = Querier(config)
+    server.reset()
+    start = time.perf_counter()
+    if local is True:
+        buf = querier.run(data)
+    else:
+        with unittest.mock.patch.object(querier, '_graph', return_value=None):
+            buf = querier.run(data)
+    elapsed = time.perf_counter() - start
+    querier.gitiles.close()
+    stats = dict(server.stats)
+    print('%-8s records %5d  gitiles log %5d  commit %5d  %.2fs' % (
+        name, len(buf), stats.get('log', 0), stats.get('commit', 0), elapsed))
+    return buf
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the on-disk commit cache')
+    parser.add_argument('--ahead1', default=30, type=int)
+    parser.add_argument('--ahead2', default=50, type=int)
+    parser.add_argument('--base', default=400, type=int)
+    parser.add_argument('--latency', default=5, type=float)
+    parser.add_argument('--new', default=10, type=int)
+    parser.add_argument('--repos', default=10, type=int)
+    arg = parser.parse_args()
+
+    graphs, data = generate(arg.repos, arg.base, arg.ahead1, arg.ahead2)
+    with tempfile.TemporaryDirectory() as path, \
+            unittest.mock.patch('diffmanifests.querier.querier.Logger'), \
+            Server(latency=arg.latency / 1000.0, graphs=graphs) as server:
+        buf1 = run(server, data, 'nocache', None)
+        run(server, data, 'cold', path)
+        buf2 = run(server, data, 'warm', path)
+        print('identical records: %s' % (sorted(buf1, key=str) == sorted(buf2, key=str)))
+        grow(graphs, data, arg.new)
+        shutil.copytree(path, os.path.join(path, 'range'))
+        buf1 = run(server, data, 'range', os.path.join(path, 'range'), False)
+        buf2 = run(server, data, 'graph', path)
+        print('identical records: %s' % (sorted(buf1, key=str) == sorted(buf2, key=str)))
+
+
+if __name__ == '__main__':
+    main()
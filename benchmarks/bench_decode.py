@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""Compare decoding of Gitiles and Gerrit replies before and after the shared decoder
+
+Usage: python -m benchmarks.bench_decode [--rounds N] [--payload FILE ...]
+
+The old path decodes the body to str, replaces the XSSI prefix anywhere in
+it and parses the copy. The new one parses the bytes after the prefix, with
+orjson when it is installed and the stdlib otherwise. Replies saved with
+e.g. curl -o FILE 'https://host/repo/+log/master?n=1600&format=JSON' can be
+given with --payload; the default payloads are the sizes of a log page of
+50 and of 1600 entries, a merge commit with 2000 changed files and a Gerrit
+query of 50 changes.
+"""
+
+import argparse
+import json
+import os
+import time
+import unittest.mock
+
+from benchmarks.server import commit
+from diffmanifests.decoder import decoder
+
+PREFIX = b")]}'\n"
+
+
+def message(index):
+    return ('Fix the build of module %d\n\n' % index) + 'Explain the change in a few lines of text.\n' * 8 + \
+        '\nBug: %d\nTest: m -j\nChange-Id: I%040x\n' % (index, index)
+
+
+def log(size):
+    items = []
+    for index in range(size):
+        item = commit('%040x' % index, parents=['%040x' % (index + 1)])
+        item['message'] = message(index)
+        del item['tree_diff']
+        items.append(item)
+    return PREFIX + json.dumps({'log': items, 'next': '%040x' % size}, indent=2).encode()
+
+
+def merge(files):
+    item = commit('%040x' % 0, parents=['%040x' % 1, '%040x' % 2])
+    item['message'] = message(0)
+    item['tree_diff'] = [{
+        'type': 'modify',
+        'old_id': '%040x' % index,
+        'old_mode': 33188,
+        'old_path': 'frameworks/base/core/java/android/file%d.java' % index,
+        'new_id': '%040x' % (index + 1),
+        'new_mode': 33188,
+        'new_path': 'frameworks/base/core/java/android/file%d.java' % index
+    } for index in range(files)]
+    return PREFIX + json.dumps(item, indent=2).encode()
+
+
+def changes(size):
+    items = [{
+        '_number': index,
+        'project': 'platform/frameworks/base',
+        'branch': 'master',
+        'topic': 'bench',
+        'hashtags': ['bench'],
+        'subject': message(index).splitlines()[0],
+        'status': 'MERGED',
+        'current_revision': '%040x' % index,
+        'revisions': {'%040x' % index: {'_number': 1, 'ref': 'refs/changes/%02d/%d/1' % (index % 100, index)}}
+    } for index in range(size)]
+    return PREFIX + json.dumps(items).encode()
+
+
+def old(data):
+    # requests decodes .text from the bytes first
+    return json.loads(data.decode('utf-8').replace(")]}'", ''))
+
+
+def measure(data, call, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        call(data)
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark decoding of JSON replies')
+    parser.add_argument('--payload', default=[], nargs='*')
+    parser.add_argument('--rounds', default=20, type=int)
+    arg = parser.parse_args()
+
+    if len(arg.payload) != 0:
+        payloads = []
+        for name in arg.payload:
+            with open(name, 'rb') as f:
+                payloads.append((os.path.basename(name), f.read()))
+    else:
+        payloads = [('log 50', log(50)), ('log 1600', log(1600)), ('merge 2000', merge(2000)),
+                    ('query 50', changes(50))]
+
+    print('%-12s %10s %10s %10s %10s' % ('payload', 'bytes', 'old ms', 'stdlib ms', 'orjson ms'))
+    for name, data in payloads:
+        assert decoder.decode(data) == old(data)
+        with unittest.mock.patch.object(decoder, 'orjson', None):
+            stdlib = measure(data, decoder.decode, arg.rounds)
+        fast = measure(data, decoder.decode, arg.rounds) if decoder.orjson is not None else float('nan')
+        print('%-12s %10d %10.3f %10.3f %10.3f' % (name, len(data), measure(data, old, arg.rounds), stdlib, fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Measure Differ.run scaling on synthetic manifests
+
+Usage: python -m benchmarks.bench_differ [--sizes 1000,10000,...] [--churn 0.1]
+"""
+
+import argparse
+import random
+import time
+
+from diffmanifests.differ.differ import Differ
+
+
+def generate(projects, churn, seed=0):
+    rand = random.Random(seed)
+
+    def _project(index, revision):
+        return {
+            '@name': 'platform/project%d' % index,
+            '@path': 'project/%d' % index,
+            '@revision': '%040x' % revision
+        }
+
+    project1 = [_project(index, index) for index in range(projects)]
+    project2 = []
+    for index in range(projects):
+        val = rand.random()
+        if val < churn / 3:
+            continue
+        if val < churn:
+            project2.append(_project(index, index + projects))
+        else:
+            project2.append(_project(index, index))
+    for index in range(int(projects * churn / 3)):
+        project2.append(_project(projects + index, projects + index))
+
+    def _manifest(project):
+        return {
+            'manifest': {
+                'default': {'@revision': 'master', '@remote': 'aosp'},
+                'project': project,
+                'remote': {'@name': 'aosp', '@fetch': '..'}
+            }
+        }
+
+    return _manifest(project1), _manifest(project2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Differ.run scaling')
+    parser.add_argument('--churn', default=0.1, type=float)
+    parser.add_argument('--repeat', default=3, type=int)
+    parser.add_argument('--sizes', default='1000,10000,50000,100000,200000')
+    arg = parser.parse_args()
+
+    differ = Differ()
+    for size in [int(item) for item in arg.sizes.split(',')]:
+        data1, data2 = generate(size, arg.churn)
+        elapsed = []
+        for _ in range(arg.repeat):
+            start = time.perf_counter()
+            differ.run(data1, data2)
+            elapsed.append(time.perf_counter() - start)
+        best = min(elapsed)
+        print('%7d projects  %8.4fs  %6.3f us/project' % (size, best, best / size * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""Compare the serial, threaded and async query engines
+
+Usage: python -m benchmarks.bench_engine [--repos N] [--ahead2 N] [--workers N] [--inflight N] [--latency MS]
+
+Each engine runs the whole query phase against the local fake server, which
+delays every Gitiles and Gerrit response by --latency.
+"""
+
+import argparse
+import time
+import unittest.mock
+
+from benchmarks.bench_range import generate
+from benchmarks.server import Server
+from diffmanifests.querier.querier import AsyncQuerier, Querier
+
+
+def run(server, data, name, querier):
+    server.reset()
+    start = time.perf_counter()
+    buf = querier.run(data)
+    elapsed = time.perf_counter() - start
+    stats = dict(server.stats)
+    print('%-8s records %5d  requests %5d  connections %4d  %.2fs' % (
+        name, len(buf), stats.get('requests', 0), stats.get('connections', 0), elapsed))
+    return buf
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark query engines')
+    parser.add_argument('--ahead1', default=5, type=int)
+    parser.add_argument('--ahead2', default=20, type=int)
+    parser.add_argument('--base', default=50, type=int)
+    parser.add_argument('--inflight', default=100, type=int)
+    parser.add_argument('--latency', default=50, type=float)
+    parser.add_argument('--repos', default=200, type=int)
+    parser.add_argument('--workers', default=16, type=int)
+    arg = parser.parse_args()
+
+    graphs, data = generate(arg.repos, arg.base, arg.ahead1, arg.ahead2)
+    with unittest.mock.patch('diffmanifests.querier.querier.Logger'), \
+            Server(latency=arg.latency / 1000.0, graphs=graphs) as server:
+        def config(workers):
+            return {
+                'gerrit': {'url': server.url()},
+                'gitiles': {'url': server.url(), 'retry': 0, 'pool_maxsize': max(workers, 10)},
+                'querier': {'inflight': arg.inflight, 'inflight_per_host': arg.inflight, 'workers': workers}
+            }
+        buf1 = run(server, data, 'serial', Querier(config(1)))
+        buf2 = run(server, data, 'threaded', Querier(config(arg.workers)))
+        buf3 = run(server, data, 'async', AsyncQuerier(config(1)))
+    print('identical records: %s' % (buf1 == buf2 == buf3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+"""Count requests sent when workers ask for the same commits at once
+
+Usage: python -m benchmarks.bench_flight [--workers N] [--commits N] [--latency S]
+
+Every worker looks up the same --commits commits, as workers do for shared
+parents or one project checked out at two paths. The run-scoped memo is
+turned off, so only requests in flight at the same moment can be shared.
+"""
+
+import argparse
+import concurrent.futures
+import time
+
+from benchmarks.server import Server
+from diffmanifests.gitiles.gitiles import Gitiles
+from diffmanifests.metrics.metrics import Metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark coalescing of identical requests')
+    parser.add_argument('--commits', default=200, type=int)
+    parser.add_argument('--latency', default=0.02, type=float)
+    parser.add_argument('--workers', default=8, type=int)
+    arg = parser.parse_args()
+
+    with Server(arg.latency) as server:
+        gitiles = Gitiles({'gitiles': {'memo': 0, 'pool_maxsize': arg.workers, 'url': server.url(), 'retry': 1}})
+        Metrics.enable()
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=arg.workers) as executor:
+            for _ in executor.map(lambda _: [gitiles.commit('platform/build', '%040x' % index)
+                                             for index in range(arg.commits)], range(arg.workers)):
+                pass
+        elapsed = time.perf_counter() - start
+        Metrics.disable()
+        gitiles.close()
+        print('lookups %5d  requests %5d  coalesced %5d  %.2fs' % (
+            arg.workers * arg.commits, server.stats.get('requests', 0),
+            Metrics.dump()['counters'].get('coalesced', 0), elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""Count Gerrit requests of per commit, batched and Change-Id change lookups
+
+Usage: python -m benchmarks.bench_gerrit [--repos N] [--ahead2 N] [--batch N] [--latency MS] [--handshake MS]
+                                        [--imports PERCENT]
+
+single and batched look every commit up with commit: queries, as with
+querier.commit_fallback. change looks commits up by their Change-Id
+trailers and skips the --imports percent of commits that have none, as
+upstream imports and merges do. Connections counts those accepted for
+Gitiles and Gerrit together.
+"""
+
+import argparse
+import time
+import unittest.mock
+
+from benchmarks.bench_range import generate
+from benchmarks.server import Server
+from diffmanifests.proto.proto import Commit
+from diffmanifests.querier.querier import Querier
+
+
+def run(server, data, name, batch):
+    config = {
+        'gerrit': {'url': server.url()},
+        'gitiles': {'url': server.url(), 'retry': 0},
+        'querier': {'batch': batch, 'commit_fallback': name != 'change'}
+    }
+    querier = Querier(config)
+    server.reset()
+    start = time.perf_counter()
+    if name == 'single':
+        # Resolve every record while it is built, as before batching
+        with unittest.mock.patch.object(querier, '_resolve'):
+            buf = querier._fetch(data, list(data.keys())[0])
+    else:
+        buf = querier.run(data)
+    elapsed = time.perf_counter() - start
+    stats = dict(server.stats)
+    print('%-7s records %5d  with change %5d  gerrit %5d  connections %5d  %.2fs' % (
+        name, len(buf), len([item for item in buf if item[Commit.CHANGE] != '']), stats.get('changes', 0),
+        stats.get('connections', 0), elapsed))
+    return buf
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark batched Gerrit lookups')
+    parser.add_argument('--ahead1', default=30, type=int)
+    parser.add_argument('--ahead2', default=250, type=int)
+    parser.add_argument('--base', default=400, type=int)
+    parser.add_argument('--batch', default=50, type=int)
+    parser.add_argument('--handshake', default=0, type=float)
+    parser.add_argument('--imports', default=30, type=int)
+    parser.add_argument('--latency', default=5, type=float)
+    parser.add_argument('--repos', default=10, type=int)
+    arg = parser.parse_args()
+
+    graphs, data = generate(arg.repos, arg.base, arg.ahead1, arg.ahead2)
+    for graph in graphs.values():
+        for index, item in enumerate(sorted(graph.commits.values(), key=lambda item: item['commit'])):
+            if index % 100 < arg.imports:
+                item['message'] = item['message'].split('\nChange-Id: ')[0]
+    with unittest.mock.patch('diffmanifests.querier.querier.Logger'), \
+            Server(latency=arg.latency / 1000.0, handshake=arg.handshake / 1000.0, graphs=graphs) as server:
+        buf1 = run(server, data, 'single', arg.batch)
+        buf2 = run(server, data, 'batched', arg.batch)
+        buf3 = run(server, data, 'change', arg.batch)
+    print('identical records: %s' % (sorted(buf1, key=str) == sorted(buf2, key=str) == sorted(buf3, key=str)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""Measure Gitiles request latency against a local stand-in server
+
+Usage: python -m benchmarks.bench_gitiles [--requests N] [--latency S] [--handshake S]
+
+The baseline replays the previous client behaviour, which built and closed a
+new session (and therefore a new connection) for every call.
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from benchmarks.server import Server
+from diffmanifests.gitiles.gitiles import Gitiles
+
+
+def baseline(url, repo, sha):
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(max_retries=1))
+    session.mount('https://', HTTPAdapter(max_retries=1))
+    response = session.get(url=url + '/%s/+/%s?format=JSON' % (repo, sha), timeout=None)
+    session.close()
+    return json.loads(response.text.replace(")]}'", ''))
+
+
+def measure(func, count):
+    buf = []
+    for index in range(count):
+        start = time.perf_counter()
+        func('platform/build', '%040x' % index)
+        buf.append(time.perf_counter() - start)
+    return buf
+
+
+def report(name, buf, connections):
+    buf = sorted(buf)
+    print('%-8s mean %.3fms  p50 %.3fms  p95 %.3fms  connections %d' % (
+        name,
+        statistics.mean(buf) * 1000,
+        buf[len(buf) // 2] * 1000,
+        buf[int(len(buf) * 0.95)] * 1000,
+        connections))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Gitiles client latency')
+    parser.add_argument('--handshake', default=0.0, type=float)
+    parser.add_argument('--latency', default=0.0, type=float)
+    parser.add_argument('--requests', default=2000, type=int)
+    arg = parser.parse_args()
+
+    with Server(arg.latency, arg.handshake) as server:
+        buf = measure(lambda repo, sha: baseline(server.url(), repo, sha), arg.requests)
+        report('before', buf, server.stats.get('connections', 0))
+
+    with Server(arg.latency, arg.handshake) as server:
+        gitiles = Gitiles({'gitiles': {'url': server.url(), 'retry': 1}})
+        buf = measure(gitiles.commit, arg.requests)
+        gitiles.close()
+        report('after', buf, server.stats.get('connections', 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""Compare bytes and time of full commit JSON and header-only commit fetches
+
+Usage: python -m benchmarks.bench_header [--requests N] [--files N] [--latency S]
+
+Every full commit lists --files changed files in its tree_diff, as large
+merges do, while the header fetch asks for a one entry log instead.
+"""
+
+import argparse
+import time
+
+from benchmarks.server import Server
+from diffmanifests.gitiles.gitiles import Gitiles
+from diffmanifests.metrics.metrics import Metrics
+
+
+def measure(name, server, count, tree):
+    gitiles = Gitiles({'gitiles': {'memo': 0, 'url': server.url(), 'retry': 1}})
+    Metrics.enable()
+    start = time.perf_counter()
+    for index in range(count):
+        gitiles.commit('platform/build', '%040x' % index, tree=tree)
+    elapsed = time.perf_counter() - start
+    Metrics.disable()
+    gitiles.close()
+    data = Metrics.dump()['endpoints'][0]
+    print('%-6s endpoint %-6s  bytes/commit %8d  %.3fms/commit' % (
+        name, data['endpoint'], data['bytes'] // data['count'], elapsed * 1000 / count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark header-only commit fetches')
+    parser.add_argument('--files', default=2000, type=int)
+    parser.add_argument('--latency', default=0.0, type=float)
+    parser.add_argument('--requests', default=500, type=int)
+    arg = parser.parse_args()
+
+    with Server(arg.latency, tree_size=arg.files) as server:
+        measure('full', server, arg.requests, True)
+        measure('header', server, arg.requests, False)
+
+
+if __name__ == '__main__':
+    main()
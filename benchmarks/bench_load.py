@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""Compare manifest loading paths
+
+Usage: python -m benchmarks.bench_load [--projects N] [--repeat N]
+
+Every path runs in a fresh interpreter so that peak RSS is not polluted by
+the previous one.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import generator
+
+
+def generate(name, projects):
+    project, _, _ = generator.generate(projects, 0.0, base=1)
+    generator.write(name, project)
+
+
+def child(path, name):
+    # Import both paths up front so that only the load itself is measured
+    import xmltodict
+    from diffmanifests.main import load
+
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if path == 'xmltodict':
+        with open(name, 'r') as f:
+            data = json.loads(json.dumps(xmltodict.parse(f.read())))
+    else:
+        data = load(name)
+    elapsed = time.perf_counter() - start
+    assert len(data['manifest']['project']) != 0
+    print(json.dumps({
+        'path': path,
+        'wall': elapsed,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+    }))
+
+
+def run(path, name):
+    out = subprocess.check_output([sys.executable, '-m', 'benchmarks.bench_load', '--child', path, name])
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark manifest loading')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument('--projects', default=12000, type=int)
+    parser.add_argument('--repeat', default=3, type=int)
+    arg = parser.parse_args()
+
+    if arg.child is not None:
+        child(*arg.child)
+        return
+
+    fd, name = tempfile.mkstemp(suffix='.xml')
+    os.close(fd)
+    try:
+        generate(name, arg.projects)
+        print('manifest: %d projects, %.1f MiB' % (arg.projects, os.path.getsize(name) / 1024 / 1024))
+        for path in ['xmltodict', 'iterparse']:
+            buf = [run(path, name) for _ in range(arg.repeat)]
+            print('%-10s wall %.3fs  peak rss +%.1f MiB' % (
+                path, min(item['wall'] for item in buf), min(item['rss'] for item in buf) / 1024))
+    finally:
+        os.remove(name)
+
+
+if __name__ == '__main__':
+    main()
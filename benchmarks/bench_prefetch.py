@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+"""Compare log walks with and without fetching the next pages ahead
+
+Usage: python -m benchmarks.bench_prefetch [--repos N] [--base N] [--ahead1 N] [--ahead2 N] [--latency MS]
+
+Both the range logs and the history walk are timed, with the local commit
+graph and the Gerrit lookups left out, for --prefetch 0 (one page at a
+time) and the given depth.
+"""
+
+import argparse
+import time
+import unittest.mock
+
+from benchmarks.bench_range import generate
+from benchmarks.server import Server
+from diffmanifests.querier.querier import Querier
+
+
+def run(server, data, strategy, prefetch):
+    config = {
+        'gerrit': {'url': server.url()},
+        'gitiles': {'url': server.url(), 'retry': 0},
+        'querier': {'prefetch': prefetch}
+    }
+    querier = Querier(config)
+    server.reset()
+    start = time.perf_counter()
+    with unittest.mock.patch.object(querier, '_graph', return_value=None), \
+            unittest.mock.patch.object(querier, '_resolve'):
+        if strategy == 'range':
+            buf = querier.run(data)
+        else:
+            with unittest.mock.patch.object(querier.gitiles, 'range', return_value=None):
+                buf = querier.run(data)
+    elapsed = time.perf_counter() - start
+    querier.gitiles.close()
+    print('%-6s prefetch %d  records %5d  gitiles log %5d  %.2fs' % (
+        strategy, prefetch, len(buf), server.stats.get('log', 0), elapsed))
+    return buf
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fetching log pages ahead')
+    parser.add_argument('--ahead1', default=300, type=int)
+    parser.add_argument('--ahead2', default=1000, type=int)
+    parser.add_argument('--base', default=400, type=int)
+    parser.add_argument('--latency', default=20, type=float)
+    parser.add_argument('--prefetch', default=1, type=int)
+    parser.add_argument('--repos', default=5, type=int)
+    arg = parser.parse_args()
+
+    graphs, data = generate(arg.repos, arg.base, arg.ahead1, arg.ahead2)
+    with unittest.mock.patch('diffmanifests.querier.querier.Logger'), \
+            Server(latency=arg.latency / 1000.0, graphs=graphs) as server:
+        buf = []
+        for strategy in ['walk', 'range']:
+            buf.append(run(server, data, strategy, 0))
+            buf.append(run(server, data, strategy, arg.prefetch))
+    print('identical records: %s' % all(sorted(item, key=str) == sorted(buf[0], key=str) for item in buf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""Measure xlsx output time and memory
+
+Usage: python -m benchmarks.bench_printer [--rows N [N ...]]
+
+Every size runs in a fresh interpreter so that peak RSS is not polluted by
+the previous one. RSS is measured after the records are generated.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from diffmanifests.printer.printer import Printer
+from diffmanifests.proto.proto import Commit, Label
+
+
+def generate(rows):
+    return [{
+        Commit.AUTHOR: 'Bench <bench@example.com>',
+        Commit.BRANCH: 'master',
+        Commit.CHANGE: 'https://android-review.googlesource.com/%d' % index,
+        Commit.COMMIT: '%040x' % index,
+        Commit.COMMITTER: 'Bench <bench@example.com>',
+        Commit.DATE: 'Tue Feb 18 23:29:44 2020 -0800',
+        Commit.DIFF: Label.ADD_COMMIT.upper(),
+        Commit.HASHTAGS: [],
+        Commit.MESSAGE: 'Bench commit %d\x01\n\nBug: %d\nTest: build' % (index, index),
+        Commit.REPO: 'platform/project%d' % (index % 500),
+        Commit.TOPIC: 'topic%d' % (index % 50),
+        Commit.URL: 'https://android.googlesource.com/platform/build/+/%040x' % index
+    } for index in range(rows)]
+
+
+def child(rows, name):
+    data = generate(rows)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    Printer().run(data, name)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'rows': rows,
+        'wall': elapsed,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base,
+        'size': os.path.getsize(name)
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark xlsx output')
+    parser.add_argument('--child', nargs=2)
+    parser.add_argument('--rows', default=[10000, 50000, 100000], nargs='+', type=int)
+    arg = parser.parse_args()
+
+    if arg.child is not None:
+        child(int(arg.child[0]), arg.child[1])
+        return
+
+    with tempfile.TemporaryDirectory() as path:
+        for rows in arg.rows:
+            name = os.path.join(path, 'output%d.xlsx' % rows)
+            out = subprocess.check_output([sys.executable, '-m', 'benchmarks.bench_printer', '--child', str(rows), name])
+            data = json.loads(out)
+            print('rows %7d  %7.2fs  rss +%7.1f MiB  file %6.1f MiB' % (
+                data['rows'], data['wall'], data['rss'] / 1024.0, data['size'] / 1024.0 / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""Count Gitiles requests of the range log and history walk strategies
+
+Usage: python -m benchmarks.bench_range [--repos N] [--base N] [--ahead1 N] [--ahead2 N] [--page N] [--page-max N]
+
+Each repo has a shared history of --base commits with --ahead1 commits on
+top for manifest1 and --ahead2 commits on top for manifest2. Each strategy
+runs with the server page size and with pages growing from --page to
+--page-max.
+"""
+
+import argparse
+import time
+import unittest.mock
+
+from benchmarks.server import Graph, Server
+from diffmanifests.proto.proto import Label
+from diffmanifests.querier.querier import Querier
+
+
+def generate(repos, base, ahead1, ahead2):
+    graphs = {}
+    data = {}
+    for index in range(repos):
+        repo = 'platform/repo%d' % index
+        graph = Graph()
+        epoch = 1700000000
+        parent = []
+        for item in range(base):
+            sha = '%08x%032x' % (index, item)
+            graph.add(sha, parent, epoch)
+            parent = [sha]
+            epoch += 60
+        heads = []
+        for branch, ahead in [(1, ahead1), (2, ahead2)]:
+            head = parent
+            for item in range(ahead):
+                sha = '%08x%08x%024x' % (index, branch, item)
+                graph.add(sha, head, epoch + branch * 7 + item * 60)
+                head = [sha]
+            graph.refs['refs/heads/branch%d' % branch] = head[0]
+            heads.append(head[0])
+        graphs[repo] = graph
+        data[repo] = [
+            {'name': repo, 'branch': 'branch1', 'commit': heads[0]},
+            {'name': repo, 'branch': 'branch2', 'commit': heads[1]}
+        ]
+    return graphs, {Label.UPDATE_REPO: data}
+
+
+def run(server, data, strategy, page=0, page_max=0):
+    config = {
+        'gerrit': {'url': server.url()},
+        'gitiles': {'url': server.url(), 'page': page, 'page_max': page_max, 'retry': 0}
+    }
+    querier = Querier(config)
+    server.reset()
+    start = time.perf_counter()
+    # Leave the local commit graph out, it is measured by benchmarks.bench_cache
+    with unittest.mock.patch.object(querier, '_graph', return_value=None):
+        if strategy == 'range':
+            buf = querier.run(data)
+        else:
+            with unittest.mock.patch.object(querier.gitiles, 'range', return_value=None):
+                buf = querier.run(data)
+    elapsed = time.perf_counter() - start
+    stats = dict(server.stats)
+    print('%-6s %-9s records %5d  gitiles log %5d  commit %5d  other %5d  %.2fs' % (
+        strategy, '%d-%d' % (page, page_max) if page != 0 else 'default', len(buf), stats.get('log', 0), stats.get('commit', 0), stats.get('other', 0), elapsed))
+    return buf
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark range log vs history walk')
+    parser.add_argument('--ahead1', default=30, type=int)
+    parser.add_argument('--ahead2', default=250, type=int)
+    parser.add_argument('--base', default=400, type=int)
+    parser.add_argument('--page', default=50, type=int)
+    parser.add_argument('--page-max', default=1600, type=int)
+    parser.add_argument('--repos', default=10, type=int)
+    arg = parser.parse_args()
+
+    graphs, data = generate(arg.repos, arg.base, arg.ahead1, arg.ahead2)
+    with unittest.mock.patch('diffmanifests.querier.querier.Logger'), \
+            Server(graphs=graphs, page_max=max(arg.page_max, 100)) as server:
+        buf = []
+        for strategy in ['walk', 'range']:
+            buf.append(run(server, data, strategy))
+            if arg.page != 0:
+                buf.append(run(server, data, strategy, arg.page, arg.page_max))
+    print('identical records: %s' % all(sorted(item, key=str) == sorted(buf[0], key=str) for item in buf))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""Synthetic manifest pairs with matching commit graphs
+
+generate() returns two manifests of --projects projects where --churn of
+them are added, removed or updated in the second one, along with the
+commit graph of every project so that benchmarks.server can answer every
+query the manifests lead to. Updated projects have commits on both sides
+of their merge base, so both ADD and REMOVE records are produced.
+"""
+
+import random
+
+from benchmarks.server import Graph
+
+
+def generate(projects, churn, base=20, ahead=10, seed=0):
+    rand = random.Random(seed)
+    graphs = {}
+    project1 = []
+    project2 = []
+
+    def _graph(index):
+        name = 'platform/project%d' % index
+        graph = Graph()
+        epoch = 1700000000 + index
+        parent = []
+        for item in range(base):
+            sha = '%08x%032x' % (index, item)
+            graph.add(sha, parent, epoch)
+            parent = [sha]
+            epoch += 60
+        graphs[name] = graph
+        return name, graph, parent[0], epoch
+
+    def _branch(index, graph, head, epoch, branch, count):
+        for item in range(count):
+            sha = '%08x%08x%024x' % (index, branch, item)
+            graph.add(sha, [head], epoch + branch * 7 + item * 60)
+            head = sha
+        graph.refs['refs/heads/branch%d' % branch] = head
+        return head
+
+    def _project(index, name, revision):
+        return {'name': name, 'path': 'project/%d' % index, 'revision': revision}
+
+    for index in range(projects):
+        name, graph, head, epoch = _graph(index)
+        val = rand.random()
+        if val < churn / 3:
+            project1.append(_project(index, name, head))
+        elif val < churn:
+            head1 = _branch(index, graph, head, epoch, 1, rand.randint(0, ahead // 2))
+            head2 = _branch(index, graph, head, epoch, 2, rand.randint(1, ahead))
+            project1.append(_project(index, name, head1))
+            project2.append(_project(index, name, head2))
+        else:
+            project1.append(_project(index, name, head))
+            project2.append(_project(index, name, head))
+    for index in range(projects, projects + int(projects * churn / 3)):
+        name, graph, head, _ = _graph(index)
+        project2.append(_project(index, name, head))
+
+    return project1, project2, graphs
+
+
+def write(name, project):
+    with open(name, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<manifest>\n')
+        f.write('  <remote name="aosp" fetch=".." review="https://android-review.googlesource.com/" />\n')
+        f.write('  <default revision="master" remote="aosp" sync-j="4" />\n')
+        for item in project:
+            f.write('  <project name="%s" path="%s" groups="pdk" revision="%s" upstream="master">\n'
+                    % (item['name'], item['path'], item['revision']))
+            f.write('    <copyfile src="core/root.mk" dest="%s/Makefile" />\n' % item['path'])
+            f.write('    <linkfile src="envsetup.sh" dest="%s/envsetup.sh" />\n' % item['path'])
+            f.write('  </project>\n')
+        f.write('</manifest>\n')
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""Run benchmark scenarios end to end and write the results as JSON
+
+Usage: python -m benchmarks.run [--scenario NAME ...] [--engine sync|async] [--workers N]
+                                [--output FILE] [--compare FILE]
+
+Every scenario generates a manifest pair, serves its commit graphs from
+benchmarks.server and runs load, Differ.run, Querier.run and Printer.run
+in turn. Each stage reports wall time, server requests and peak traced
+memory. The peak is taken in a second run of the stage under tracemalloc
+so that tracing does not inflate the wall time. Results carry the git
+commit so that files from different commits can be compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import unittest.mock
+
+from benchmarks import generator
+from benchmarks.server import Server
+from diffmanifests.differ.differ import Differ
+from diffmanifests.main import load
+from diffmanifests.printer.printer import Printer
+from diffmanifests.querier.querier import AsyncQuerier, Querier
+
+SCENARIOS = {
+    'small': {'projects': 200, 'churn': 0.2, 'latency': 5, 'page_size': 100},
+    'medium': {'projects': 1000, 'churn': 0.1, 'latency': 10, 'page_size': 100},
+    'large': {'projects': 5000, 'churn': 0.05, 'latency': 10, 'page_size': 100},
+    'paged': {'projects': 200, 'churn': 0.5, 'latency': 10, 'page_size': 5}
+}
+
+
+def measure(server, func, memory):
+    server.reset()
+    start = time.perf_counter()
+    ret = func()
+    wall = time.perf_counter() - start
+    stats = dict(server.stats)
+    peak = None
+    if memory is True:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return ret, {'wall': wall, 'peak': peak, 'requests': stats}
+
+
+def scenario(name, setting, arg):
+    project1, project2, graphs = generator.generate(setting['projects'], setting['churn'])
+    buf = {'setting': setting, 'stages': {}}
+    with tempfile.TemporaryDirectory() as path, \
+            Server(latency=setting['latency'] / 1000.0, graphs=graphs, page_size=setting['page_size']) as server:
+        manifest1 = os.path.join(path, 'manifest1.xml')
+        manifest2 = os.path.join(path, 'manifest2.xml')
+        output = os.path.join(path, 'output.xlsx')
+        generator.write(manifest1, project1)
+        generator.write(manifest2, project2)
+        config = {
+            'gerrit': {'url': server.url()},
+            'gitiles': {'url': server.url(), 'retry': 0, 'pool_maxsize': max(arg.workers, 10)},
+            'querier': {'workers': arg.workers}
+        }
+
+        def _query():
+            querier = AsyncQuerier(config) if arg.engine == 'async' else Querier(config)
+            return querier.run(data)
+
+        data, buf['stages']['load'] = measure(server, lambda: (load(manifest1), load(manifest2)), arg.memory)
+        data, buf['stages']['differ'] = measure(server, lambda: Differ(config).run(*data), arg.memory)
+        data, buf['stages']['querier'] = measure(server, _query, arg.memory)
+        _, buf['stages']['printer'] = measure(server, lambda: Printer(config).run(data, output), arg.memory)
+        buf['records'] = len(data)
+
+    print('%-8s records %6d' % (name, buf['records']))
+    for stage, val in buf['stages'].items():
+        print('  %-8s %8.3fs  peak %8.1f MiB  requests %5d' % (
+            stage, val['wall'], (val['peak'] or 0) / 1024.0 / 1024.0, val['requests'].get('requests', 0)))
+    return buf
+
+
+def compare(name, buf):
+    with open(name, 'r') as f:
+        base = json.load(f)
+    print('compared with %s' % (base.get('commit', '')[:12] or name))
+    for scenario, val in buf['scenarios'].items():
+        for stage, item in val['stages'].items():
+            old = base.get('scenarios', {}).get(scenario, {}).get('stages', {}).get(stage, None)
+            if old is None or old['wall'] == 0:
+                continue
+            print('  %-8s %-8s %8.3fs -> %8.3fs  x%.2f  requests %5d -> %5d' % (
+                scenario, stage, old['wall'], item['wall'], item['wall'] / old['wall'],
+                old['requests'].get('requests', 0), item['requests'].get('requests', 0)))
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run benchmark scenarios')
+    parser.add_argument('--compare', default='')
+    parser.add_argument('--engine', choices=['async', 'sync'], default='sync')
+    parser.add_argument('--no-memory', action='store_false', dest='memory')
+    parser.add_argument('--output', default='')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS.keys()), default=[], nargs='+')
+    parser.add_argument('--workers', default=1, type=int)
+    arg = parser.parse_args()
+
+    buf = {
+        'commit': revision(),
+        'engine': arg.engine,
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'workers': arg.workers,
+        'scenarios': {}
+    }
+    with unittest.mock.patch('diffmanifests.querier.querier.Logger'):
+        for name in arg.scenario if len(arg.scenario) != 0 else ['small', 'medium', 'paged']:
+            buf['scenarios'][name] = scenario(name, SCENARIOS[name], arg)
+
+    if len(arg.output) != 0:
+        with open(arg.output, 'w') as f:
+            json.dump(buf, f, indent=2)
+    if len(arg.compare) != 0:
+        compare(arg.compare, buf)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""Local stand-in for a Gitiles and Gerrit server
+
+The server answers commit and log requests from an in-memory commit graph
+after an optional delay, and counts requests and accepted connections so
+clients can be compared without touching the network. A per-connection
+delay stands in for the TCP and TLS handshakes of a remote host. Unknown
+repos are answered with canned JSON so plain latency tests need no graph.
+Every commit of a graph with a Change-Id trailer, as Graph.add() writes,
+has one merged Gerrit change that can be found with commit: or change:
+queries joined by OR.
+"""
+
+import heapq
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+CHANGES_SIZE = 100
+PAGE_SIZE = 100
+
+
+def commit(sha, epoch=1704110400, parents=None):
+    stamp = time.strftime('%a %b %d %H:%M:%S %Y +0000', time.gmtime(epoch))
+    return {
+        'commit': sha,
+        'tree': '0' * 40,
+        'parents': parents if parents is not None else [],
+        'author': {'name': 'Bench', 'email': 'bench@example.com', 'time': stamp},
+        'committer': {'name': 'Bench', 'email': 'bench@example.com', 'time': stamp},
+        'message': 'Bench commit %s\n' % sha[:8],
+        'tree_diff': []
+    }
+
+
+class Graph(object):
+    """Commit graph of one repo with branch heads"""
+
+    def __init__(self):
+        self.commits = {}
+        self.refs = {}
+
+    def add(self, sha, parents, epoch):
+        self.commits[sha] = commit(sha, epoch, parents)
+        self.commits[sha]['_epoch'] = epoch
+        self.commits[sha]['message'] += '\nChange-Id: I%s\n' % sha
+
+    def resolve(self, rev):
+        for name in [rev, 'refs/heads/' + rev, 'refs/tags/' + rev]:
+            if name in self.refs:
+                return self.refs[name]
+        if rev in self.commits:
+            return rev
+        for sha in self.commits:
+            if len(rev) >= 7 and sha.startswith(rev):
+                return sha
+        return None
+
+    def walk(self, heads, hidden=()):
+        # Newest first, like git log, hiding everything reachable from hidden
+        excluded = set()
+        stack = list(hidden)
+        while len(stack) != 0:
+            sha = stack.pop()
+            if sha in excluded:
+                continue
+            excluded.add(sha)
+            stack.extend(self.commits[sha]['parents'])
+        queue = [(-self.commits[sha]['_epoch'], sha) for sha in heads if sha not in excluded]
+        heapq.heapify(queue)
+        seen = set(sha for _, sha in queue)
+        while len(queue) != 0:
+            _, sha = heapq.heappop(queue)
+            yield sha
+            for item in self.commits[sha]['parents']:
+                if item not in seen and item not in excluded:
+                    seen.add(item)
+                    heapq.heappush(queue, (-self.commits[item]['_epoch'], item))
+
+    def log(self, rev, start=None, size=PAGE_SIZE):
+        if '..' in rev:
+            rev1, rev2 = rev.split('..', 1)
+            hidden = self.resolve(rev1)
+            head = self.resolve(rev2)
+            if hidden is None or head is None:
+                return None
+            walk = self.walk([head], [hidden])
+        else:
+            head = self.resolve(rev)
+            if head is None:
+                return None
+            walk = self.walk([head])
+        buf = []
+        found = start is None
+        for sha in walk:
+            if not found:
+                if sha != start:
+                    continue
+                found = True
+            if len(buf) == size:
+                return {'log': buf, 'next': sha}
+            buf.append({key: val for key, val in self.commits[sha].items() if key not in ('_epoch', 'tree_diff')})
+        if not found:
+            return None
+        return {'log': buf}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    disable_nagle_algorithm = True
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+        if self.server.handshake > 0:
+            time.sleep(self.server.handshake)
+
+    def _reply(self, status, body=None):
+        buf = b'' if body is None else (")]}'\n" + json.dumps(body)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(buf)))
+        self.end_headers()
+        self.wfile.write(buf)
+
+    def do_GET(self):
+        self.server.count('requests')
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        path = urllib.parse.unquote(url.path)
+        if '/+log/' in path:
+            self.server.count('log')
+            repo, rev = path.split('/+log/', 1)
+            graph = self.server.graphs.get(repo.strip('/'), None)
+            if graph is None:
+                self._reply(200, {'log': [commit('%040x' % 0)]})
+                return
+            start = query.get('s', [None])[0]
+            size = min(int(query.get('n', [self.server.page_size])[0]), self.server.page_max)
+            body = graph.log(rev.strip('/'), start, size)
+            self._reply(404) if body is None else self._reply(200, body)
+        elif path.rstrip('/').endswith('/changes'):
+            self.server.count('changes')
+            search = query.get('q', [''])[0]
+            start = int(query.get('start', ['0'])[0])
+            size = int(query.get('n', [self.server.changes_size])[0])
+            buf = []
+            for item in search.split(' OR '):
+                item = item.strip()
+                if item.startswith('change:'):
+                    item = self.server.ids.get(item[len('change:'):], '')
+                change = self.server.changes.get(item.replace('commit:', '', 1), None)
+                if change is not None:
+                    buf.append(dict(change))
+            body = buf[start:start+size]
+            if start + size < len(buf):
+                body[-1]['_more_changes'] = True
+            self._reply(200, body)
+        elif path.rstrip('/').endswith('/+refs'):
+            self.server.count('refs')
+            graph = self.server.graphs.get(path.rstrip('/')[:-len('/+refs')].strip('/'), None)
+            if graph is None:
+                self._reply(404)
+                return
+            self._reply(200, {key: {'value': val} for key, val in sorted(graph.refs.items())})
+        elif '/+/' in path:
+            self.server.count('commit')
+            repo, rev = path.split('/+/', 1)
+            graph = self.server.graphs.get(repo.strip('/'), None)
+            if graph is None:
+                body = commit(rev)
+            else:
+                sha = graph.resolve(rev.strip('/'))
+                if sha is None:
+                    self._reply(404)
+                    return
+                body = {key: val for key, val in graph.commits[sha].items() if key != '_epoch'}
+            body['tree_diff'] = self.server.tree_diff
+            self._reply(200, body)
+        else:
+            self.server.count('other')
+            self._reply(404)
+
+
+class Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.0, handshake=0.0, graphs=None, page_size=PAGE_SIZE, changes_size=CHANGES_SIZE,
+                 tree_size=0, page_max=None):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.changes_size = changes_size
+        self.graphs = graphs if graphs is not None else {}
+        self.changes = {}
+        self.ids = {}
+        for repo, graph in sorted(self.graphs.items()):
+            for sha, item in graph.commits.items():
+                if '\nChange-Id: ' not in item['message']:
+                    continue
+                key = item['message'].rsplit('Change-Id: ', 1)[1].strip()
+                self.ids[key] = sha
+                self.changes[sha] = {
+                    '_number': len(self.changes) + 1,
+                    'branch': 'master',
+                    'change_id': key,
+                    'project': repo,
+                    'status': 'MERGED',
+                    'current_revision': sha,
+                    'topic': 'bench',
+                    'hashtags': []
+                }
+        self.handshake = handshake
+        self.latency = latency
+        # Default log page size, and the largest n= a client may ask for
+        self.page_size = page_size
+        self.page_max = page_max if page_max is not None else page_size
+        self.stats = {}
+        # Files changed by every commit, as full commit JSON lists them in tree_diff
+        self.tree_diff = [{
+            'type': 'modify',
+            'old_id': '%040x' % index,
+            'old_mode': 33188,
+            'old_path': 'frameworks/base/core/java/android/file%d.java' % index,
+            'new_id': '%040x' % (index + 1),
+            'new_mode': 33188,
+            'new_path': 'frameworks/base/core/java/android/file%d.java' % index
+        } for index in range(tree_size)]
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}
+
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ..logger.logger import Logger
+from ..metrics.metrics import Metrics
+
+
+class CacheException(Exception):
+    def __init__(self, info):
+        super().__init__(self)
+        self._info = info
+
+    def __str__(self):
+        return self._info
+
+
+class Cache(object):
+    _name = 'cache.db'
+
+    def __init__(self, config=None):
+        if config is None or config.get('cache', None) is None:
+            raise CacheException('config invalid')
+        self._dir = config['cache'].get('dir', '')
+        self._dir = os.path.expanduser(self._dir if len(self._dir) != 0 else '~/.cache/diffmanifests')
+        self._size = config['cache'].get('size', 512)
+        self._size = (self._size if self._size > 0 else 512) * 1024 * 1024
+        self._errors = 0
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(self._dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self._dir, self._name),
+                                       check_same_thread=False, isolation_level=None, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS commits ('
+                             'host TEXT, repo TEXT, key TEXT, value TEXT, size INTEGER, atime REAL, '
+                             'PRIMARY KEY (host, repo, key))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS commits_atime ON commits (atime)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS graph ('
+                             'host TEXT, repo TEXT, sha TEXT, parents TEXT, epoch INTEGER, '
+                             'PRIMARY KEY (host, repo, sha))')
+            self._db.execute('CREATE TABLE IF NOT EXISTS changes ('
+                             'host TEXT, key TEXT, value TEXT, mtime REAL, '
+                             'PRIMARY KEY (host, key))')
+            self._total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM commits').fetchone()[0]
+        except (OSError, sqlite3.Error) as e:
+            raise CacheException('cache invalid: %s' % str(e))
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits its size cap again
+        while self._total > self._size:
+            rows = self._db.execute('SELECT host, repo, key, size FROM commits ORDER BY atime LIMIT 100').fetchall()
+            if len(rows) == 0:
+                self._total = 0
+                break
+            drop = []
+            for row in rows:
+                drop.append(row[:3])
+                self._total -= row[3]
+                if self._total <= self._size:
+                    break
+            self._db.executemany('DELETE FROM commits WHERE host = ? AND repo = ? AND key = ?', drop)
+
+    def _fail(self, e):
+        # The cache only saves requests, so a failure such as another run holding the database
+        # locked turns into a miss or a skipped write. Called with the lock held.
+        try:
+            if self._db.in_transaction:
+                self._db.execute('ROLLBACK')
+        except sqlite3.Error:
+            # A closed connection cannot tell, nor has anything to roll back
+            pass
+        if self._errors == 0:
+            Logger.warn('cache: %s' % str(e))
+        self._errors += 1
+        Metrics.count('cache_error')
+
+    def _batch(self, sql, rows):
+        with self._lock:
+            try:
+                self._db.execute('BEGIN')
+                self._db.executemany(sql, rows)
+                self._db.execute('COMMIT')
+            except sqlite3.Error as e:
+                self._fail(e)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, host, repo, key):
+        with self._lock:
+            try:
+                row = self._db.execute('SELECT value FROM commits WHERE host = ? AND repo = ? AND key = ?',
+                                       (host, repo, key)).fetchone()
+            except sqlite3.Error as e:
+                self._fail(e)
+                return None
+            if row is None:
+                return None
+            try:
+                self._db.execute('UPDATE commits SET atime = ? WHERE host = ? AND repo = ? AND key = ?',
+                                 (time.time(), host, repo, key))
+            except sqlite3.Error as e:
+                self._fail(e)
+        return json.loads(row[0])
+
+    def put(self, host, repo, key, value):
+        buf = json.dumps(value, ensure_ascii=False)
+        size = len(buf.encode('utf-8'))
+        with self._lock:
+            try:
+                row = self._db.execute('SELECT size FROM commits WHERE host = ? AND repo = ? AND key = ?',
+                                       (host, repo, key)).fetchone()
+                self._db.execute('INSERT OR REPLACE INTO commits (host, repo, key, value, size, atime) '
+                                 'VALUES (?, ?, ?, ?, ?, ?)', (host, repo, key, buf, size, time.time()))
+                self._total += size - (row[0] if row is not None else 0)
+                self._evict()
+            except sqlite3.Error as e:
+                self._fail(e)
+
+    def node(self, host, repo, sha):
+        with self._lock:
+            try:
+                row = self._db.execute('SELECT parents, epoch FROM graph WHERE host = ? AND repo = ? AND sha = ?',
+                                       (host, repo, sha)).fetchone()
+            except sqlite3.Error as e:
+                self._fail(e)
+                return None
+        if row is None:
+            return None
+        return row[0].split(), row[1]
+
+    def put_nodes(self, host, repo, nodes):
+        # Graph nodes are a few dozen bytes each and immutable, so they stay out of the LRU cap
+        self._batch('INSERT OR IGNORE INTO graph (host, repo, sha, parents, epoch) VALUES (?, ?, ?, ?, ?)',
+                    [(host, repo, sha, ' '.join(parents), epoch) for sha, parents, epoch in nodes])
+
+    def change(self, host, key):
+        # Gerrit change of a commit as stored by put_changes() with its store time, or None
+        with self._lock:
+            try:
+                row = self._db.execute('SELECT value, mtime FROM changes WHERE host = ? AND key = ?',
+                                       (host, key)).fetchone()
+            except sqlite3.Error as e:
+                self._fail(e)
+                return None
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put_changes(self, host, changes):
+        # Change entries are a few hundred bytes each and kept out of the LRU cap like graph nodes
+        now = time.time()
+        self._batch('INSERT OR REPLACE INTO changes (host, key, value, mtime) VALUES (?, ?, ?, ?)',
+                    [(host, key, json.dumps(value, ensure_ascii=False), now) for key, value in changes])
@@ -16,6 +16,15 @@ class Argument(object):
                                   dest='config_file',
                                   help='config file, format: .json',
                                   required=True)
+        self._parser.add_argument('-e', '--engine',
+                                  choices=['async', 'sync'],
+                                  default='sync',
+                                  dest='engine',
+                                  help='query engine, async requires aiohttp')
+        self._parser.add_argument('-j', '--jobs',
+                                  dest='jobs',
+                                  help='number of repos queried in parallel, overrides querier.workers',
+                                  type=int)
         self._parser.add_argument('-m', '--manifest1-file',
                                   dest='manifest1_file',
                                   help='manifest1 file, format: .xml',
@@ -24,10 +33,21 @@ class Argument(object):
                                   dest='manifest2_file',
                                   help='manifest2 file, format: .xml',
                                   required=True)
+        self._parser.add_argument('--metrics-file',
+                                  dest='metrics_file',
+                                  help='write request metrics as .json, and as a Prometheus textfile next to it')
+        self._parser.add_argument('--no-cache',
+                                  action='store_true',
+                                  dest='no_cache',
+                                  help='do not read or write the on-disk commit and change cache')
         self._parser.add_argument('-o', '--output-file',
                                   dest='output_file',
                                   help='output file, format: ' + ', '.join(Printer.format()),
                                   required=True)
+        self._parser.add_argument('--refresh-gerrit',
+                                  action='store_true',
+                                  dest='refresh_gerrit',
+                                  help='look every Gerrit change up again instead of taking it from the cache')
         self._parser.add_argument('-r', '--recursion-depth',
                                   default=2000,
                                   dest='recursion_depth',
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Gerrit and Gitiles put this in front of JSON replies against cross-site script inclusion
+XSSI = b")]}'"
+
+_decoder = json.JSONDecoder()
+_space = re.compile(r'[ \t\n\r]*')
+
+
+def decode(data):
+    # Parse a JSON reply given as bytes, skipping the XSSI prefix at its start without a copy
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    start = len(XSSI) if data.startswith(XSSI) else 0
+    if orjson is not None:
+        return orjson.loads(memoryview(data)[start:])
+    text = data.decode('utf-8')
+    ret, end = _decoder.raw_decode(text, _space.match(text, start).end())
+    if _space.match(text, end).end() != len(text):
+        raise json.JSONDecodeError('Extra data', text, end)
+    return ret
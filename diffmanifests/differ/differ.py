@@ -22,96 +22,44 @@ class Differ(object):
             return ''
         return data['manifest']['default']['@revision']
 
-    def _diff(self, data1, data2):
-        def _make_key(item):
+    def _index(self, data):
+        # Build one path -> project index in a single pass, resolving the default revision once
+        project = data['manifest']['project']
+        if type(project) is not list:
+            project = [project]
+        revision = self._revision(data)
+        buf = {}
+        for item in project:
             # Use path if available to uniquely identify the project across branch/upstream changes
-            return item.get('@path', item['@name'])
-
-        def _helper(data, project, key):
-            revision = ''
-            upstream = ''
-            name = ''
-            for item in project:
-                item_name = item['@name']
-                item_upstream = item.get('@upstream', self._revision(data))
-                item_key = _make_key(item)
-                if item_key == key:
-                    revision = item.get('@revision', '')
-                    upstream = item_upstream
-                    name = item_name
-                    break
-            return name, revision, upstream
-
-        project1 = data1['manifest']['project']
-        if type(project1) is not list:
-            project1 = [project1]
+            key = item.get('@path', item['@name'])
+            if key in buf:
+                # Keep the first project for duplicated keys
+                continue
+            buf[key] = {
+                Repo.NAME: item['@name'],
+                Repo.BRANCH: item.get('@upstream', revision),
+                Repo.COMMIT: item.get('@revision', '')
+            }
+        return buf
 
+    def _diff(self, data1, data2):
         # Default revisions are kept for display only; matching ignores upstream changes
-        default_revision1 = self._revision(data1)
-        keys1 = []
-        for item in project1:
-            keys1.append(_make_key(item))
-
-        project2 = data2['manifest']['project']
-        if type(project2) is not list:
-            project2 = [project2]
-
-        default_revision2 = self._revision(data2)
-        keys2 = []
-        for item in project2:
-            keys2.append(_make_key(item))
+        index1 = self._index(data1)
+        index2 = self._index(data2)
 
+        # Use path/name as display key to differentiate duplicates with different paths
         added = {}
-        buf = list(set(keys2).difference(set(keys1)))
-        for key in buf:
-            name, revision2, upstream2 = _helper(data2, project2, key)
-            # Use path/name as display key to differentiate duplicates with different paths
-            display_key = key
-            added[display_key] = [
-                {},
-                {
-                    Repo.NAME: name,
-                    Repo.BRANCH: upstream2,
-                    Repo.COMMIT: revision2
-                }
-            ]
+        for key, val in index2.items():
+            if key not in index1:
+                added[key] = [{}, val]
 
         removed = {}
-        buf = list(set(keys1).difference(set(keys2)))
-        for key in buf:
-            name, revision1, upstream1 = _helper(data1, project1, key)
-            # Use path/name as display key to differentiate duplicates with different paths
-            display_key = key
-            removed[display_key] = [
-                {
-                    Repo.NAME: name,
-                    Repo.BRANCH: upstream1,
-                    Repo.COMMIT: revision1
-                },
-                {}
-            ]
-
         updated = {}
-        buf = list(set(keys1).intersection(set(keys2)))
-        for key in buf:
-            name1, revision1, upstream1 = _helper(data1, project1, key)
-            name2, revision2, upstream2 = _helper(data2, project2, key)
-            if revision1 == revision2:
-                continue
-            # Use path/name as display key to differentiate duplicates with different paths
-            display_key = key
-            updated[display_key] = [
-                {
-                    Repo.NAME: name1,
-                    Repo.BRANCH: upstream1,
-                    Repo.COMMIT: revision1
-                },
-                {
-                    Repo.NAME: name2,
-                    Repo.BRANCH: upstream2,
-                    Repo.COMMIT: revision2
-                }
-            ]
+        for key, val in index1.items():
+            if key not in index2:
+                removed[key] = [val, {}]
+            elif val[Repo.COMMIT] != index2[key][Repo.COMMIT]:
+                updated[key] = [val, index2[key]]
 
         return added, removed, updated
 
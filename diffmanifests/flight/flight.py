@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+
+from ..metrics.metrics import Metrics
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+        self.value = None
+
+
+class Flight(object):
+    # Concurrent calls with the same key share one call of the first caller and its result
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, call):
+        with self._lock:
+            flight = self._calls.get(key, None)
+            if flight is None:
+                flight = self._calls[key] = _Call()
+                leader = True
+            else:
+                leader = False
+        if leader is False:
+            Metrics.count('coalesced')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = call()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+        return flight.value
+
+
+class AsyncFlight(object):
+    # The same for coroutines on one event loop
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, call):
+        future = self._calls.get(key, None)
+        if future is not None:
+            Metrics.count('coalesced')
+            return await asyncio.shield(future)
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Retrieved here, so that a call nobody shared is not reported as unhandled
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            del self._calls[key]
+        return value
@@ -1,7 +1,20 @@
 # -*- coding: utf-8 -*-
 
-import json
 import requests
+import time
+
+from ..cache.cache import Cache, CacheException
+from ..decoder.decoder import decode
+from ..flight.flight import AsyncFlight, Flight
+from ..logger.logger import Logger
+from ..metrics.metrics import Metrics
+from ..policy.policy import Policy
+from ..session.session import connect, fetch
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 
 class GerritException(Exception):
@@ -14,38 +27,132 @@ class GerritException(Exception):
 
 
 class Gerrit(object):
-    def __init__(self, config):
+    # Change fields kept by the cache
+    _fields = ('_number', 'branch', 'change_id', 'current_revision', 'hashtags', 'project', 'status', 'topic')
+
+    def __init__(self, config, policy=None):
         if config is None:
             raise GerritException('Invalid gerrit config')
         self._pass = config['gerrit'].get('pass', '')
+        self._pool_connections = config['gerrit'].get('pool_connections', 10)
+        self._pool_connections = self._pool_connections if self._pool_connections > 0 else 10
+        self._pool_maxsize = config['gerrit'].get('pool_maxsize', 10)
+        self._pool_maxsize = self._pool_maxsize if self._pool_maxsize > 0 else 10
         self._query = config['gerrit'].get('query', {'option': ['CURRENT_REVISION']})
+        self._retry = config['gerrit'].get('retry', 0)
+        self._retry = self._retry if self._retry >= 0 else 0
+        self._timeout = config['gerrit'].get('timeout', -1)
+        self._timeout = self._timeout if self._timeout >= 0 else None
         self._user = config['gerrit'].get('user', '')
         self._url = config['gerrit'].get('url', 'localhost:80')
         if len(self._pass) != 0 and len(self._user) != 0:
             self._url += '/a'
+        self._cache = None
+        if config.get('cache', None) is not None:
+            try:
+                self._cache = Cache(config)
+            except CacheException as e:
+                Logger.warn('cache disabled: %s' % str(e))
+            self._refresh = config['cache'].get('gerrit_refresh', False) is True
+            self._ttl = config['cache'].get('gerrit_ttl', 172800)
+            self._ttl = self._ttl if self._ttl >= 0 else 172800
+        self._flight = Flight()
+        self._policy = policy if policy is not None else Policy(config)
+        self._session = self._open()
 
-    def get(self, _id):
-        if len(self._pass) != 0 and len(self._user) != 0:
-            response = requests.get(url=self._url+'/changes/'+str(_id)+'/detail', auth=(self._user, self._pass))
-        else:
-            response = requests.get(url=self._url+'/changes/'+str(_id)+'/detail')
+    def _open(self):
+        return connect('gerrit', self._user, self._pass, self._retry, self._pool_connections, self._pool_maxsize)
+
+    def _get(self, endpoint, url, params=None):
+        start = time.perf_counter()
+        try:
+            response = self._policy.send(url, lambda: self._session.get(url=url, params=params,
+                                                                        timeout=self._timeout))
+        except requests.exceptions.RequestException:
+            Metrics.request('gerrit', endpoint, '', 'error', 0, time.perf_counter() - start)
+            raise
+        return self._reply(endpoint, start, response)
+
+    def _reply(self, endpoint, start, response):
         if response.status_code != requests.codes.ok:
+            Metrics.request('gerrit', endpoint, '', response.status_code, 0, time.perf_counter() - start)
             return None
-        return json.loads(response.text.replace(")]}'", ''))
+        content = response.content
+        Metrics.request('gerrit', endpoint, '', response.status_code, len(content), time.perf_counter() - start)
+        return decode(content)
 
-    def query(self, search, start):
-        payload = {
-            'o': self._query['option'],
-            'q': search,
-            'start': start
-        }
-        if len(self._pass) != 0 and len(self._user) != 0:
-            response = requests.get(url=self._url+'/changes/', auth=(self._user, self._pass), params=payload)
-        else:
-            response = requests.get(url=self._url+'/changes/', params=payload)
-        if response.status_code != requests.codes.ok:
+    def close(self):
+        self._session.close()
+        if self._cache is not None:
+            self._cache.close()
+
+    def recall(self, commit, key):
+        # Change of a commit found in an earlier run as (change, fresh), or None to look it up.
+        # The number, project and branch of a merged change never change and are kept for good,
+        # while topic and hashtags, and changes not merged yet, are only fresh for gerrit_ttl.
+        if self._cache is None or self._refresh is True:
+            return None
+        row = self._cache.change(self.url(), commit + ' ' + key)
+        if row is None:
             return None
-        return json.loads(response.text.replace(")]}'", ''))
+        value, mtime = row
+        fresh = time.time() - mtime < self._ttl
+        if fresh is False and (value is None or value.get('status', '') != 'MERGED'):
+            return None
+        return value, fresh
+
+    def keep(self, changes):
+        # Remember the change, or None for no change, of (commit, key, change) items
+        if self._cache is None or len(changes) == 0:
+            return
+        buf = []
+        for commit, key, change in changes:
+            if change is not None:
+                change = {name: change[name] for name in self._fields if name in change}
+            buf.append((commit + ' ' + key, change))
+        self._cache.put_changes(self.url(), buf)
+
+    def get(self, _id):
+        return self._flight.do(('detail', str(_id)),
+                               lambda: self._get('detail', self._url+'/changes/'+str(_id)+'/detail'))
+
+    def query(self, search, start):
+        # Workers looking up the same commits at once share one query
+        payload = [('o', item) for item in self._query['option']] + [('q', search), ('start', str(start))]
+        return self._flight.do(('query', search, start), lambda: self._get('query', self._url+'/changes/', payload))
 
     def url(self):
         return self._url
+
+
+class AsyncGerrit(Gerrit):
+    # get() and query() of Gerrit return coroutines here, as the transport below is one
+    def __init__(self, config, policy=None):
+        if aiohttp is None:
+            raise GerritException('aiohttp required')
+        super().__init__(config, policy)
+        self._auth = aiohttp.BasicAuth(self._user, self._pass) \
+            if len(self._pass) != 0 and len(self._user) != 0 else None
+        self._flight = AsyncFlight()
+
+    def _open(self):
+        # An aiohttp session is bound to its event loop, so it is handed over by open()
+        return None
+
+    async def _get(self, endpoint, url, params=None):
+        start = time.perf_counter()
+        try:
+            response = await self._policy.asend(url, lambda: fetch(
+                self._session, url, params=params, auth=self._auth, timeout=self._timeout, retry=self._retry))
+        except aiohttp.ClientError:
+            Metrics.request('gerrit', endpoint, '', 'error', 0, time.perf_counter() - start)
+            raise
+        return self._reply(endpoint, start, response)
+
+    def open(self, session):
+        self._session = session
+
+    def close(self):
+        # The session is owned by the caller of open()
+        if self._cache is not None:
+            self._cache.close()
@@ -1,9 +1,52 @@
 # -*- coding: utf-8 -*-
 
-import json
+import calendar
+import queue
+import re
 import requests
+import threading
+import time
 
-from requests.adapters import HTTPAdapter
+from collections import OrderedDict
+
+from ..cache.cache import Cache, CacheException
+from ..decoder.decoder import decode
+from ..flight.flight import AsyncFlight, Flight
+from ..logger.logger import Logger
+from ..metrics.metrics import Metrics
+from ..policy.policy import Policy
+from ..session.session import connect, fetch
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+SHA_RE = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+
+def epoch(value):
+    # Committer time such as 'Mon Jan 01 12:00:00 2024 +0800', or with a localized month
+    # such as '1月'. Parsed by hand as strptime is far too slow for every log entry.
+    try:
+        _, month, day, clock, year, zone = value.split()
+        month = MONTHS[month] if month in MONTHS else int(month.rstrip('月'))
+        hour, minute, second = clock.split(':')
+        offset = (int(zone[1:3]) * 3600 + int(zone[3:5]) * 60) * (-1 if zone[0] == '-' else 1)
+        return calendar.timegm((int(year), month, int(day), int(hour), int(minute), int(second))) - offset
+    except (KeyError, ValueError):
+        raise ValueError('time invalid: %s' % value)
+
+
+def committed(commit):
+    # Committer epoch of a commit record, parsed once and kept on the record
+    if '_epoch' not in commit:
+        commit['_epoch'] = epoch(commit['committer']['time'])
+    return commit['_epoch']
 
 
 class GitilesException(Exception):
@@ -16,49 +59,413 @@ class GitilesException(Exception):
 
 
 class Gitiles(object):
-    def __init__(self, config=None):
+    def __init__(self, config=None, policy=None):
         if config is None or config.get('gitiles', None) is None:
             raise GitilesException('config invalid')
+        self._page = config['gitiles'].get('page', 0)
+        self._page = self._page if self._page >= 0 else 0
+        self._page_max = config['gitiles'].get('page_max', 0)
+        self._page_max = self._page_max if self._page_max >= self._page else self._page
         self._pass = config['gitiles'].get('pass', '')
+        self._pool_connections = config['gitiles'].get('pool_connections', 10)
+        self._pool_connections = self._pool_connections if self._pool_connections > 0 else 10
+        self._pool_maxsize = config['gitiles'].get('pool_maxsize', 10)
+        self._pool_maxsize = self._pool_maxsize if self._pool_maxsize > 0 else 10
         self._retry = config['gitiles'].get('retry', 0)
         self._retry = self._retry if self._retry >= 0 else 0
         self._timeout = config['gitiles'].get('timeout', -1)
         self._timeout = self._timeout if self._timeout >= 0 else None
         self._url = config['gitiles'].get('url', 'http://localhost:80').rstrip('/')
         self._user = config['gitiles'].get('user', '')
+        self._cache = None
+        if config.get('cache', None) is not None:
+            try:
+                self._cache = Cache(config)
+            except CacheException as e:
+                Logger.warn('cache disabled: %s' % str(e))
+        self._count = {}
+        self._lock = threading.Lock()
+        self._memo = OrderedDict()
+        self._memo_size = config['gitiles'].get('memo', 10000)
+        self._memo_size = self._memo_size if self._memo_size >= 0 else 10000
+        self._nodes = {}
+        self._cursors = OrderedDict()
+        self._flight = Flight()
+        self._policy = policy if policy is not None else Policy(config)
+        self._session = self._open()
+
+    def _open(self):
+        return connect('gitiles', self._user, self._pass, self._retry, self._pool_connections, self._pool_maxsize)
+
+    def _get(self, repo, url, endpoint, done):
+        # Workers asking for the same page or commit at once share one request. Only the one
+        # sending it runs done(), so that what it fetched is counted and kept once.
+        return self._flight.do(url, lambda: done(*self._send(repo, url, endpoint)))
+
+    def _send(self, repo, url, endpoint):
+        self._sent(repo)
+        start = time.perf_counter()
+        try:
+            response = self._policy.send(self._url + url,
+                                         lambda: self._session.get(url=self._url + url, timeout=self._timeout))
+        except requests.exceptions.RequestException:
+            Metrics.request('gitiles', endpoint, repo, 'error', 0, time.perf_counter() - start)
+            raise
+        return self._reply(repo, endpoint, start, response)
 
-    def commit(self, repo, commit):
-        session = requests.Session()
-        session.keep_alive = False
-        session.mount('http://', HTTPAdapter(max_retries=self._retry))
-        session.mount('https://', HTTPAdapter(max_retries=self._retry))
-        if len(self._pass) == 0 or len(self._user) == 0:
-            response = session.get(url=self._url + '/%s/+/%s?format=JSON' % (repo, commit), timeout=self._timeout)
-        else:
-            response = session.get(url=self._url + '/%s/+/%s?format=JSON' % (repo, commit),
-                                   auth=(self._user, self._pass), timeout=self._timeout)
-        session.close()
+    def _sent(self, repo):
+        with self._lock:
+            self._count[repo] = self._count.get(repo, 0) + 1
+
+    def _reply(self, repo, endpoint, start, response):
         if response.status_code != requests.codes.ok:
+            Metrics.request('gitiles', endpoint, repo, response.status_code, 0, time.perf_counter() - start)
+            return response.status_code, None
+        content = response.content
+        Metrics.request('gitiles', endpoint, repo, response.status_code, len(content), time.perf_counter() - start)
+        return response.status_code, decode(content)
+
+    def _run(self, plan):
+        # A plan is (True, value) when the memo or the cache already answered, or (False,
+        # (repo, url, endpoint, done)) with the request to send and done(status, data) to
+        # turn its reply into the value. Only this and the transport differ for AsyncGitiles.
+        found, ret = plan
+        if found is True:
+            return ret
+        return self._get(*ret)
+
+    def _size(self, repo, start):
+        # Log page size, doubled up to page_max each time a walk follows the cursor of its last page
+        if self._page == 0:
+            return 0
+        with self._lock:
+            size = self._cursors.pop((repo, start), None) if start is not None else None
+        return min(size * 2, self._page_max) if size is not None else self._page
+
+    def _follow(self, repo, size, data):
+        if size == 0 or data is None or data.get('next', None) is None:
+            return
+        with self._lock:
+            self._cursors[(repo, data['next'])] = size
+            while len(self._cursors) > 1000:
+                self._cursors.popitem(last=False)
+
+    def _put(self, repo, data):
+        # Commits never change, so every log entry fetched is kept for commit()
+        if data is None:
+            return
+        Metrics.count('log_pages')
+        Metrics.count('log_entries', len(data.get('log', [])))
+        for item in data.get('log', []):
+            self._remember(('commit', repo, item.get('commit', '')), item)
+            if self._cache is not None and SHA_RE.match(item.get('commit', '')) is not None:
+                self._cache.put(self._url, repo, item['commit'], item)
+        self._grow(repo, data.get('log', []))
+
+    def _grow(self, repo, data):
+        # Add parents and committer epoch of fetched commits to the commit graph
+        nodes = []
+        for item in data:
+            if SHA_RE.match(item.get('commit', '')) is None:
+                continue
+            try:
+                nodes.append((item['commit'], list(item.get('parents', [])), committed(item)))
+            except (KeyError, TypeError, ValueError):
+                continue
+        if len(nodes) == 0:
+            return
+        with self._lock:
+            for sha, parents, seconds in nodes:
+                self._nodes[(repo, sha)] = (parents, seconds)
+        if self._cache is not None:
+            self._cache.put_nodes(self._url, repo, nodes)
+
+    def _header(self, data):
+        # The commit of a one entry log, whatever commit spelling was asked for
+        if data is None or len(data.get('log', [])) == 0:
             return None
-        ret = json.loads(response.text.replace(")]}'", ''))
-        return ret
+        return data['log'][0]
+
+    def _recall(self, key, count=True):
+        # Run-scoped memo in front of commit() and commits(), returns (found, value)
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                Metrics.count('memo_hit')
+                return True, self._memo[key]
+        if count is True:
+            Metrics.count('memo_miss')
+        return False, None
+
+    def _remember(self, key, value, status=200):
+        # Missing objects are remembered too so that probing ref variants is not repeated
+        if self._memo_size == 0 or (value is None and status != 404):
+            return
+        with self._lock:
+            self._memo[key] = value
+            self._memo.move_to_end(key)
+            while len(self._memo) > self._memo_size:
+                self._memo.popitem(last=False)
+
+    def close(self):
+        self._session.close()
+        if self._cache is not None:
+            self._cache.close()
+
+    def commit(self, repo, commit, tree=False):
+        return self._run(self._commit(repo, commit, tree))
+
+    def _commit(self, repo, commit, tree):
+        # Only the headers are fetched by default, with a one entry log that leaves out
+        # the tree_diff file list, which can be megabytes for large merges
+        if tree is True:
+            return False, (repo, '/%s/+/%s?format=JSON' % (repo, commit), 'commit', lambda status, data: data)
+        found, ret = self._known(repo, commit)
+        if found is True:
+            return True, ret
+        cached = self._cache is not None and SHA_RE.match(commit) is not None
+
+        def _done(status, data):
+            ret = self._header(data)
+            if cached is True and ret is not None:
+                self._cache.put(self._url, repo, commit, ret)
+            if ret is not None:
+                self._grow(repo, [ret])
+            self._remember(('commit', repo, commit), ret, status)
+            return ret
+        return False, (repo, '/%s/+log/%s?n=1&format=JSON' % (repo, commit), 'header', _done)
+
+    def _known(self, repo, commit, count=True):
+        found, ret = self._recall(('commit', repo, commit), count)
+        if found is True:
+            return True, ret
+        if self._cache is not None and SHA_RE.match(commit) is not None:
+            ret = self._cache.get(self._url, repo, commit)
+            if ret is not None:
+                Metrics.count('cache_hit')
+                self._remember(('commit', repo, commit), ret)
+                return True, ret
+            if count is True:
+                Metrics.count('cache_miss')
+        return False, None
+
+    def known(self, repo, commit):
+        # Commit header from the memo or the cache as (found, value), without any request.
+        # Misses are counted by the commit() that has to follow one.
+        return self._known(repo, commit, False)
 
     def commits(self, repo, branch, commit):
-        session = requests.Session()
-        session.keep_alive = False
-        session.mount('http://', HTTPAdapter(max_retries=self._retry))
-        session.mount('https://', HTTPAdapter(max_retries=self._retry))
-        if len(self._pass) == 0 or len(self._user) == 0:
-            response = session.get(url=self._url + '/%s/+log/%s/?s=%s&format=JSON' % (repo, branch, commit),
-                                   timeout=self._timeout)
-        else:
-            response = session.get(url=self._url + '/%s/+log/%s/?s=%s&format=JSON' % (repo, branch, commit),
-                                   auth=(self._user, self._pass), timeout=self._timeout)
-        session.close()
-        if response.status_code != requests.codes.ok:
-            return None
-        ret = json.loads(response.text.replace(")]}'", ''))
+        return self._run(self._commits(repo, branch, commit))
+
+    def _commits(self, repo, branch, commit):
+        found, ret = self._recall(('log', repo, branch, commit))
+        if found is True:
+            return True, ret
+        size = self._size(repo, commit)
+        url = '/%s/+log/%s/?s=%s&format=JSON' % (repo, branch, commit)
+        if size != 0:
+            url += '&n=%d' % size
+
+        def _done(status, data):
+            self._follow(repo, size, data)
+            self._put(repo, data)
+            self._remember(('log', repo, branch, commit), data, status)
+            return data
+        return False, (repo, url, 'log', _done)
+
+    def range(self, repo, commit1, commit2, start=None):
+        # Commits reachable from commit2 but not from commit1
+        return self._run(self._range(repo, commit1, commit2, start))
+
+    def _range(self, repo, commit1, commit2, start):
+        url = '/%s/+log/%s..%s/?format=JSON' % (repo, commit1, commit2)
+        if start is not None:
+            url += '&s=%s' % start
+        # A range between two full SHAs is immutable too, so whole pages can be kept
+        key = None
+        if self._cache is not None and SHA_RE.match(commit1) is not None and SHA_RE.match(commit2) is not None:
+            key = '%s..%s' % (commit1, commit2) + ('@%s' % start if start is not None else '')
+            ret = self._cache.get(self._url, repo, key)
+            if ret is not None:
+                Metrics.count('cache_hit')
+                return True, ret
+            Metrics.count('cache_miss')
+        size = self._size(repo, start)
+        if size != 0:
+            url += '&n=%d' % size
+
+        def _done(status, data):
+            self._follow(repo, size, data)
+            self._put(repo, data)
+            if key is not None and data is not None:
+                self._cache.put(self._url, repo, key, data)
+            return data
+        return False, (repo, url, 'range', _done)
+
+    def node(self, repo, sha):
+        # Parents and committer epoch of a commit seen in this or an earlier run, or None
+        with self._lock:
+            ret = self._nodes.get((repo, sha), None)
+        if ret is not None or self._cache is None:
+            return ret
+        ret = self._cache.node(self._url, repo, sha)
+        if ret is not None:
+            with self._lock:
+                self._nodes[(repo, sha)] = ret
         return ret
 
+    def refs(self, repo):
+        # All refs of the repo, keyed by full ref name
+        return self._run(self._refs(repo))
+
+    def _refs(self, repo):
+        found, ret = self._recall(('refs', repo))
+        if found is True:
+            return True, ret
+
+        def _done(status, data):
+            self._remember(('refs', repo), data, status)
+            return data
+        return False, (repo, '/%s/+refs?format=JSON' % repo, 'refs', _done)
+
+    def spelling(self, repo, branch):
+        # Ref spelling that worked for the branch in an earlier run
+        if self._cache is None:
+            return None
+        ret = self._cache.get(self._url, repo, 'ref:' + branch)
+        return ret.get('ref', None) if ret is not None else None
+
+    def learn(self, repo, branch, ref):
+        if self._cache is not None:
+            self._cache.put(self._url, repo, 'ref:' + branch, {'ref': ref})
+
+    def count(self, repo):
+        # Number of requests sent for the repo so far
+        with self._lock:
+            return self._count.get(repo, 0)
+
     def url(self):
         return self._url
+
+
+class AsyncGitiles(Gitiles):
+    # The calls of Gitiles return coroutines here, as _run() and the transport below are ones
+    def __init__(self, config=None, policy=None):
+        if aiohttp is None:
+            raise GitilesException('aiohttp required')
+        super().__init__(config, policy)
+        self._auth = aiohttp.BasicAuth(self._user, self._pass) \
+            if len(self._pass) != 0 and len(self._user) != 0 else None
+        self._flight = AsyncFlight()
+
+    def _open(self):
+        # An aiohttp session is bound to its event loop, so it is handed over by open()
+        return None
+
+    async def _send(self, repo, url, endpoint):
+        self._sent(repo)
+        start = time.perf_counter()
+        try:
+            response = await self._policy.asend(self._url + url, lambda: fetch(
+                self._session, self._url + url, auth=self._auth, timeout=self._timeout, retry=self._retry))
+        except aiohttp.ClientError:
+            Metrics.request('gitiles', endpoint, repo, 'error', 0, time.perf_counter() - start)
+            raise
+        return self._reply(repo, endpoint, start, response)
+
+    async def _get(self, repo, url, endpoint, done):
+        async def _call():
+            return done(*(await self._send(repo, url, endpoint)))
+        return await self._flight.do(url, _call)
+
+    async def _run(self, plan):
+        found, ret = plan
+        if found is True:
+            return ret
+        return await self._get(*ret)
+
+    def open(self, session):
+        self._session = session
+
+    def close(self):
+        # The session is owned by the caller of open()
+        if self._cache is not None:
+            self._cache.close()
+
+
+class Pages(object):
+    # Log pages of one walk, fetch(cursor) returns a page or None. Once the walk asks for
+    # its second page, or right away if eager, the following ones are fetched up to depth
+    # pages ahead on a thread as soon as their cursor is known. close() stops it when the
+    # walk ends early.
+    def __init__(self, fetch, start=None, cursor='next', depth=1, first=None, eager=False):
+        self._count = 0
+        self._cursor = cursor
+        self._depth = depth if depth >= 0 else 1
+        self._fetch = fetch
+        self._first = first
+        self._more = True
+        self._pages = None
+        self._slots = None
+        self._start = start
+        self._stop = threading.Event()
+        if first is not None:
+            self._follow(first)
+        if eager is True and self._depth != 0:
+            self._begin()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._first is not None:
+            page, self._first = self._first, None
+            self._count += 1
+            return page
+        if self._pages is not None:
+            page = self._pages.get()
+            self._slots.release()
+            if page is self._pages:
+                self._more, self._pages = False, None
+                raise StopIteration
+            if isinstance(page, Exception):
+                raise page
+            return page
+        if self._more is False:
+            raise StopIteration
+        if self._count == 0 or self._depth == 0:
+            page = self._fetch(self._start)
+            self._count += 1
+            self._follow(page)
+            return page
+        self._begin()
+        return self.__next__()
+
+    def _begin(self):
+        self._pages = queue.Queue()
+        self._slots = threading.Semaphore(self._depth)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _follow(self, page):
+        self._start = page.get(self._cursor, None) if page is not None else None
+        self._more = self._start is not None
+
+    def _run(self):
+        # The queue itself marks the end of the walk
+        while self._more is True:
+            while not self._slots.acquire(timeout=0.1):
+                if self._stop.is_set():
+                    return
+            if self._stop.is_set():
+                return
+            try:
+                page = self._fetch(self._start)
+            except Exception as e:
+                self._pages.put(e)
+                break
+            self._follow(page)
+            self._pages.put(page)
+        self._pages.put(self._pages)
+
+    def close(self):
+        self._stop.set()
@@ -3,24 +3,55 @@
 import json
 import os
 import sys
-import xmltodict
 
+from xml.etree import ElementTree
 from .cmd.argument import Argument
 from .cmd.banner import BANNER
 from .differ.differ import Differ, DifferException
 from .logger.logger import Logger
+from .metrics.metrics import Metrics, MetricsException
 from .printer.printer import Printer, PrinterException
-from .querier.querier import Querier, QuerierException
+from .querier.querier import AsyncQuerier, Querier, QuerierException
+
+
+MANIFEST_TAGS = ('default', 'project', 'remote')
+
+
+def _parse(name):
+    # Stream the manifest and keep only the top-level elements Differ needs,
+    # in the same shape xmltodict produced: attributes are prefixed with '@',
+    # a single element is a dict and repeated elements are a list.
+    buf = {}
+    depth = 0
+    root = None
+    for event, elem in ElementTree.iterparse(name, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if elem.tag in MANIFEST_TAGS:
+            item = {'@' + key: val for key, val in elem.attrib.items()}
+            buf.setdefault(elem.tag, []).append(item if len(item) != 0 else None)
+        # Drop the processed element and its subtree to keep memory flat
+        root.clear()
+    data = {}
+    for key, val in buf.items():
+        data[key] = val[0] if len(val) == 1 else val
+    return {root.tag: data}
 
 
 def load(name):
-    with open(name, 'r') as f:
-        if name.endswith('.json'):
+    if name.endswith('.json'):
+        with open(name, 'r') as f:
             data = json.load(f)
-        elif name.endswith('.xml'):
-            data = json.loads(json.dumps(xmltodict.parse(f.read())))
-        else:
-            data = None
+    elif name.endswith('.xml'):
+        data = _parse(name)
+    else:
+        data = None
     return data
 
 
@@ -30,20 +61,38 @@ def main():
     argument = Argument()
     arg = argument.parse(sys.argv)
 
+    if arg.metrics_file is None:
+        return _run(arg)
+
+    Metrics.enable()
+    try:
+        return _run(arg)
+    finally:
+        Metrics.disable()
+        try:
+            Metrics.write(arg.metrics_file)
+        except MetricsException as e:
+            Logger.error(str(e))
+
+
+def _run(arg):
     if os.path.exists(arg.config_file) and arg.config_file.endswith('.json'):
-        config = load(arg.config_file)
+        with Metrics.phase('load'):
+            config = load(arg.config_file)
     else:
         Logger.error('config invalid: %s' % arg.config_file)
         return -1
 
     if os.path.exists(arg.manifest1_file) and arg.manifest1_file.endswith('.xml'):
-        manifest1 = load(arg.manifest1_file)
+        with Metrics.phase('load'):
+            manifest1 = load(arg.manifest1_file)
     else:
         Logger.error('manifest invalid: %s' % arg.manifest1_file)
         return -2
 
     if os.path.exists(arg.manifest2_file) and arg.manifest2_file.endswith('.xml'):
-        manifest2 = load(arg.manifest2_file)
+        with Metrics.phase('load'):
+            manifest2 = load(arg.manifest2_file)
     else:
         Logger.error('manifest invalid: %s' % arg.manifest2_file)
         return -3
@@ -52,11 +101,22 @@ def main():
         Logger.error('output invalid: %s' % arg.output_file)
         return -4
 
+    if arg.jobs is not None:
+        config.setdefault('querier', {})['workers'] = arg.jobs
+
+    if arg.no_cache is True:
+        config.pop('cache', None)
+    else:
+        config.setdefault('cache', {})
+        if arg.refresh_gerrit is True:
+            config['cache']['gerrit_refresh'] = True
+
     sys.setrecursionlimit(arg.recursion_depth)
 
     try:
-        differ = Differ(config)
-        buf = differ.run(manifest1, manifest2)
+        with Metrics.phase('diff'):
+            differ = Differ(config)
+            buf = differ.run(manifest1, manifest2)
     except DifferException as e:
         Logger.error(str(e))
         return -5
@@ -66,15 +126,20 @@ def main():
         return 0
 
     try:
-        querier = Querier(config)
-        buf = querier.run(buf)
+        with Metrics.phase('query'):
+            querier = AsyncQuerier(config) if arg.engine == 'async' else Querier(config)
+            try:
+                buf = querier.run(buf)
+            finally:
+                querier.close()
     except QuerierException as e:
         Logger.error(str(e))
         return -6
 
     try:
-        printer = Printer(config)
-        printer.run(buf, arg.output_file)
+        with Metrics.phase('print'):
+            printer = Printer(config)
+            printer.run(buf, arg.output_file)
     except PrinterException as e:
         Logger.error(str(e))
         return -7
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class MetricsException(Exception):
+    def __init__(self, info):
+        super().__init__(self)
+        self._info = info
+
+    def __str__(self):
+        return self._info
+
+
+class Metrics(object):
+    # Upper bounds in seconds, the same as the Prometheus client defaults
+    _buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    _counters = {}
+    _enabled = False
+    _endpoints = {}
+    _lock = threading.Lock()
+    _phases = {}
+    _repos = {}
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def enable():
+        Metrics.reset()
+        Metrics._enabled = True
+
+    @staticmethod
+    def disable():
+        Metrics._enabled = False
+
+    @staticmethod
+    def enabled():
+        return Metrics._enabled
+
+    @staticmethod
+    def reset():
+        with Metrics._lock:
+            Metrics._counters = {}
+            Metrics._endpoints = {}
+            Metrics._phases = {}
+            Metrics._repos = {}
+
+    @staticmethod
+    def count(name, value=1):
+        if Metrics._enabled is False:
+            return
+        with Metrics._lock:
+            Metrics._counters[name] = Metrics._counters.get(name, 0) + value
+
+    @staticmethod
+    def request(service, endpoint, repo, status, size, elapsed):
+        if Metrics._enabled is False:
+            return
+        status = str(status)
+        with Metrics._lock:
+            key = (service, endpoint)
+            if key not in Metrics._endpoints:
+                Metrics._endpoints[key] = {
+                    'buckets': [0] * (len(Metrics._buckets) + 1),
+                    'bytes': 0,
+                    'count': 0,
+                    'seconds': 0.0,
+                    'status': {}
+                }
+            buf = Metrics._endpoints[key]
+            buf['count'] += 1
+            buf['bytes'] += size
+            buf['seconds'] += elapsed
+            buf['status'][status] = buf['status'].get(status, 0) + 1
+            index = 0
+            while index < len(Metrics._buckets) and elapsed > Metrics._buckets[index]:
+                index += 1
+            buf['buckets'][index] += 1
+            if len(repo) == 0:
+                return
+            key = (service, repo)
+            if key not in Metrics._repos:
+                Metrics._repos[key] = {'bytes': 0, 'count': 0, 'seconds': 0.0, 'status': {}}
+            buf = Metrics._repos[key]
+            buf['count'] += 1
+            buf['bytes'] += size
+            buf['seconds'] += elapsed
+            buf['status'][status] = buf['status'].get(status, 0) + 1
+
+    @staticmethod
+    @contextlib.contextmanager
+    def phase(name):
+        # Time spent in the same phase adds up
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if Metrics._enabled is True:
+                with Metrics._lock:
+                    Metrics._phases[name] = Metrics._phases.get(name, 0.0) + time.perf_counter() - start
+
+    @staticmethod
+    def dump():
+        with Metrics._lock:
+            return {
+                'counters': dict(Metrics._counters),
+                'endpoints': [{
+                    'buckets': dict(zip([str(item) for item in Metrics._buckets] + ['+Inf'], val['buckets'])),
+                    'bytes': val['bytes'],
+                    'count': val['count'],
+                    'endpoint': key[1],
+                    'seconds': val['seconds'],
+                    'service': key[0],
+                    'status': dict(val['status'])
+                } for key, val in sorted(Metrics._endpoints.items())],
+                'phases': dict(Metrics._phases),
+                'repos': [{
+                    'bytes': val['bytes'],
+                    'count': val['count'],
+                    'repo': key[1],
+                    'seconds': val['seconds'],
+                    'service': key[0],
+                    'status': dict(val['status'])
+                } for key, val in sorted(Metrics._repos.items())]
+            }
+
+    @staticmethod
+    def prometheus():
+        def _labels(**kwargs):
+            return ','.join(['%s="%s"' % (key, str(val).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for key, val in sorted(kwargs.items())])
+
+        data = Metrics.dump()
+        buf = [
+            '# HELP diffmanifests_requests_total Requests sent, by endpoint and status.',
+            '# TYPE diffmanifests_requests_total counter'
+        ]
+        for item in data['endpoints']:
+            for status, val in sorted(item['status'].items()):
+                buf.append('diffmanifests_requests_total{%s} %d' % (
+                    _labels(service=item['service'], endpoint=item['endpoint'], status=status), val))
+        buf.extend([
+            '# HELP diffmanifests_response_bytes_total Response bytes received, by endpoint.',
+            '# TYPE diffmanifests_response_bytes_total counter'
+        ])
+        for item in data['endpoints']:
+            buf.append('diffmanifests_response_bytes_total{%s} %d' % (
+                _labels(service=item['service'], endpoint=item['endpoint']), item['bytes']))
+        buf.extend([
+            '# HELP diffmanifests_request_duration_seconds Request latency, by endpoint.',
+            '# TYPE diffmanifests_request_duration_seconds histogram'
+        ])
+        for item in data['endpoints']:
+            total = 0
+            for le, val in item['buckets'].items():
+                total += val
+                buf.append('diffmanifests_request_duration_seconds_bucket{%s} %d' % (
+                    _labels(service=item['service'], endpoint=item['endpoint'], le=le), total))
+            buf.append('diffmanifests_request_duration_seconds_sum{%s} %f' % (
+                _labels(service=item['service'], endpoint=item['endpoint']), item['seconds']))
+            buf.append('diffmanifests_request_duration_seconds_count{%s} %d' % (
+                _labels(service=item['service'], endpoint=item['endpoint']), item['count']))
+        buf.extend([
+            '# HELP diffmanifests_repo_requests_total Requests sent, by repo.',
+            '# TYPE diffmanifests_repo_requests_total counter'
+        ])
+        for item in data['repos']:
+            buf.append('diffmanifests_repo_requests_total{%s} %d' % (
+                _labels(service=item['service'], repo=item['repo']), item['count']))
+        buf.extend([
+            '# HELP diffmanifests_repo_response_bytes_total Response bytes received, by repo.',
+            '# TYPE diffmanifests_repo_response_bytes_total counter'
+        ])
+        for item in data['repos']:
+            buf.append('diffmanifests_repo_response_bytes_total{%s} %d' % (
+                _labels(service=item['service'], repo=item['repo']), item['bytes']))
+        buf.extend([
+            '# HELP diffmanifests_repo_request_seconds_total Time spent in requests, by repo.',
+            '# TYPE diffmanifests_repo_request_seconds_total counter'
+        ])
+        for item in data['repos']:
+            buf.append('diffmanifests_repo_request_seconds_total{%s} %f' % (
+                _labels(service=item['service'], repo=item['repo']), item['seconds']))
+        buf.extend([
+            '# HELP diffmanifests_phase_seconds Wall time of each run phase.',
+            '# TYPE diffmanifests_phase_seconds gauge'
+        ])
+        for key, val in sorted(data['phases'].items()):
+            buf.append('diffmanifests_phase_seconds{%s} %f' % (_labels(phase=key), val))
+        buf.extend([
+            '# HELP diffmanifests_events_total Internal events such as cache hits.',
+            '# TYPE diffmanifests_events_total counter'
+        ])
+        for key, val in sorted(data['counters'].items()):
+            buf.append('diffmanifests_events_total{%s} %d' % (_labels(name=key), val))
+        return '\n'.join(buf) + '\n'
+
+    @staticmethod
+    def write(name):
+        # JSON goes to name, the Prometheus textfile next to it with a .prom extension
+        try:
+            with open(name, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(Metrics.dump(), indent=2))
+            prom = os.path.splitext(name)[0] + '.prom'
+            with open(prom if prom != name else name + '.prom', 'w', encoding='utf-8') as f:
+                f.write(Metrics.prometheus())
+        except OSError as e:
+            raise MetricsException('metrics invalid: %s' % str(e))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+import urllib.parse
+
+from ..logger.logger import Logger
+from ..metrics.metrics import Metrics
+
+
+class PolicyException(Exception):
+    def __init__(self, info):
+        super().__init__(self)
+        self._info = info
+
+    def __str__(self):
+        return self._info
+
+
+class Policy(object):
+    # Quota errors and transient server errors are worth another try
+    _codes = (429, 500, 502, 503, 504)
+
+    def __init__(self, config=None):
+        if config is None:
+            raise PolicyException('config invalid')
+        policy = config.get('policy', {})
+        self._backoff = policy.get('backoff', 0.5)
+        self._backoff = self._backoff if self._backoff > 0 else 0.5
+        self._backoff_max = policy.get('backoff_max', 30)
+        self._backoff_max = self._backoff_max if self._backoff_max >= self._backoff else self._backoff
+        self._budget = policy.get('budget', 100)
+        self._budget = self._budget if self._budget >= 0 else 100
+        self._burst = policy.get('burst', 10)
+        self._burst = self._burst if self._burst > 0 else 10
+        self._rate = policy.get('rate', 0)
+        self._rate = self._rate if self._rate >= 0 else 0
+        self._retries = policy.get('retries', 0)
+        self._retries = self._retries if self._retries >= 0 else 0
+        self._buckets = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+        Metrics.count(name)
+
+    def _after(self, value):
+        # Retry-After is either a number of seconds or an HTTP date
+        if not isinstance(value, str):
+            return None
+        if value.strip().isdigit():
+            return float(value.strip())
+        try:
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def delay(self, url):
+        # Seconds to hold a request to the host of url back. Every host has a token bucket
+        # of burst requests refilled at rate per second, and the slot is taken right away.
+        if self._rate == 0:
+            return 0.0
+        host = urllib.parse.urlsplit(url).netloc or url
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(host, (self._burst, now))
+            tokens = min(self._burst, tokens + (now - last) * self._rate) - 1
+            self._buckets[host] = (tokens, now)
+        if tokens >= 0:
+            return 0.0
+        self._count('throttled')
+        return -tokens / self._rate
+
+    def retry(self, url, status, attempt, after=None):
+        # Seconds to back off before another try, or None to give up. Retry-After wins
+        # over the jittered exponential backoff, and all retries share one budget.
+        if status not in self._codes:
+            return None
+        if attempt >= self._retries:
+            if self._retries != 0:
+                self._count('retry_failed')
+                Logger.warn('%s: %d after %d retries' % (url, status, attempt))
+            return None
+        # A server asking for more than backoff_max would hold a worker for that long
+        delay = self._after(after)
+        if delay is not None and delay > self._backoff_max:
+            self._count('retry_failed')
+            Logger.warn('%s: %d, Retry-After %.0fs beyond backoff_max' % (url, status, delay))
+            return None
+        with self._lock:
+            budget = self._budget
+            self._budget = budget - 1 if budget > 0 else 0
+        if budget == 0:
+            self._count('retry_exhausted')
+            Logger.warn('%s: %d, retry budget exhausted' % (url, status))
+            return None
+        self._count('retry_429' if status == 429 else 'retry_5xx')
+        if delay is None:
+            delay = self._random.uniform(0, min(self._backoff_max, self._backoff * 2 ** attempt))
+        return delay
+
+    def send(self, url, request):
+        # request() sends one try and returns its response
+        attempt = 0
+        while True:
+            delay = self.delay(url)
+            if delay != 0:
+                time.sleep(delay)
+            response = request()
+            delay = self.retry(url, response.status_code, attempt, response.headers.get('Retry-After', None))
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    async def asend(self, url, request):
+        # The same for a coroutine request() on an event loop
+        attempt = 0
+        while True:
+            delay = self.delay(url)
+            if delay != 0:
+                await asyncio.sleep(delay)
+            response = await request()
+            delay = self.retry(url, response.status_code, attempt, response.headers.get('Retry-After', None))
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
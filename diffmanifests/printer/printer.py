@@ -3,14 +3,14 @@
 import json
 import openpyxl
 import os
-import re
 import time
 
-from openpyxl.styles import Alignment, Font
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle
 from ..proto.proto import Commit
 
 # Refer: openpyxl/cell/cell.py
-ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+ILLEGAL_CHARACTERS = str.maketrans({chr(item): ' ' for item in list(range(0o0, 0o11)) + [0o13, 0o14] + list(range(0o16, 0o40))})
 
 head = {
     'A': Commit.DIFF,
@@ -73,29 +73,27 @@ class Printer(object):
                 _txt_helper(item, f)
 
     def _xlsx(self, data, name):
-        def _styling_head(sheet):
-            for item in head.keys():
-                sheet[item+'1'].alignment = Alignment(horizontal='center', shrink_to_fit=True, vertical='center')
-                sheet[item+'1'].font = Font(bold=True, name='Calibri')
-            sheet.freeze_panes = sheet['B2']
-
-        def _styling_data(sheet, rows):
-            for key in head.keys():
-                for row in range(rows):
-                    sheet[key+str(row+2)].alignment = Alignment(vertical='center')
-                    sheet[key+str(row+2)].font = Font(bold=False, name='Calibri')
-
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = time.strftime('%Y-%m-%d', time.localtime(time.time()))
-        ws.append([head[key].upper() for key in sorted(head.keys())])
+        # Rows are streamed by a write-only workbook and share two named styles,
+        # so memory stays flat however many rows are written
+        wb = openpyxl.Workbook(write_only=True)
+        wb.add_named_style(NamedStyle(name='diff_head',
+                                      alignment=Alignment(horizontal='center', shrink_to_fit=True, vertical='center'),
+                                      font=Font(bold=True, name='Calibri')))
+        wb.add_named_style(NamedStyle(name='diff_data',
+                                      alignment=Alignment(vertical='center'),
+                                      font=Font(bold=False, name='Calibri')))
+        ws = wb.create_sheet(time.strftime('%Y-%m-%d', time.localtime(time.time())))
+        ws.freeze_panes = 'B2'
+
+        def _cell(value, style):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style
+            return cell
+
+        keys = [head[key] for key in sorted(head.keys())]
+        ws.append([_cell(item.upper(), 'diff_head') for item in keys])
         for item in data:
-            buf = []
-            for key in sorted(head.keys()):
-                buf.append(re.sub(ILLEGAL_CHARACTERS_RE, ' ', item[head[key]]))
-            ws.append(buf)
-        _styling_head(ws)
-        _styling_data(ws, len(data))
+            ws.append([_cell(item[key].translate(ILLEGAL_CHARACTERS), 'diff_data') for key in keys])
         wb.save(filename=name)
 
     def run(self, data, name):
@@ -1,12 +1,31 @@
 # -*- coding: utf-8 -*-
 
-import datetime
+import asyncio
+import heapq
+import re
+import threading
 
-from ..gerrit.gerrit import Gerrit
-from ..gitiles.gitiles import Gitiles
+from concurrent.futures import ThreadPoolExecutor
+from ..gerrit.gerrit import AsyncGerrit, Gerrit, GerritException
+from ..gitiles.gitiles import SHA_RE, AsyncGitiles, Gitiles, GitilesException, Pages, committed
 from ..logger.logger import Logger
+from ..metrics.metrics import Metrics
+from ..policy.policy import Policy
 from ..proto.proto import Commit, Label, Repo
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+CHANGE_ID_RE = re.compile(r'^Change-Id:[ \t]*(I[0-9a-f]{40})[ \t]*$', re.MULTILINE)
+
+
+def change_id(message):
+    # Change-Id trailer of a commit message, read from its last paragraph as Gerrit does, or None
+    buf = CHANGE_ID_RE.findall(message.strip().split('\n\n')[-1])
+    return buf[-1] if len(buf) != 0 else None
+
 
 class QuerierException(Exception):
     def __init__(self, info):
@@ -18,48 +37,104 @@ class QuerierException(Exception):
 
 
 class Querier(object):
+    # Gerrit search operators of the lookup kinds, numbers are looked up with change: too
+    _operators = {'change': 'change', 'commit': 'commit', 'number': 'change'}
+
     def __init__(self, config=None):
         if config is None:
             raise QuerierException('config invalid')
-        self.gerrit = Gerrit(config)
-        self.gitiles = Gitiles(config)
+        # Both clients share one rate limit and retry budget
+        self.policy = Policy(config)
+        self.gerrit = Gerrit(config, self.policy)
+        self.gitiles = Gitiles(config, self.policy)
+        self._batch = config.get('querier', {}).get('batch', 50)
+        self._batch = self._batch if self._batch > 0 else 50
+        self._counts = {}
+        self._deferred = False
+        self._fallback = config.get('querier', {}).get('commit_fallback', False) is True
+        self._lock = threading.Lock()
+        self._prefetch = config.get('querier', {}).get('prefetch', 1)
+        self._prefetch = self._prefetch if self._prefetch >= 0 else 1
+        self._spellings = {}
+        self._workers = config.get('querier', {}).get('workers', 1)
+        self._workers = self._workers if self._workers > 0 else 1
 
-    def _get_commits_with_variants(self, repo, branch, commit):
+    def _variants(self, repo, branch):
         candidates = [branch]
         if branch and not branch.startswith('refs/'):
             candidates.extend([f'refs/heads/{branch}', f'refs/tags/{branch}'])
-        for b in candidates:
+        # Try the spelling that worked before first, from this run or an earlier one
+        with self._lock:
+            known = self._spellings.get((repo, branch), None)
+        if known is None:
+            known = self.gitiles.spelling(repo, branch)
+            if known is not None:
+                with self._lock:
+                    self._spellings[(repo, branch)] = known
+        if known is not None and known in candidates:
+            candidates = [known] + [item for item in candidates if item != known]
+        return candidates
+
+    def _prune(self, repo, candidates):
+        # One +refs listing per repo tells which full ref spellings exist at all
+        try:
+            refs = self.gitiles.refs(repo)
+        except Exception as e:
+            Logger.warn('_prune: Failed to list refs for repo: %s: %s' % (repo, str(e)))
+            refs = None
+        if refs is None:
+            return candidates
+        return [item for item in candidates if not item.startswith('refs/') or item in refs]
+
+    def _get_commits_with_variants(self, repo, branch, commit):
+        candidates = self._variants(repo, branch)
+        index = 0
+        while index < len(candidates):
             try:
-                data = self.gitiles.commits(repo, b, commit)
+                data = self.gitiles.commits(repo, candidates[index], commit)
             except StopIteration:
                 data = None
             if data is not None and len(data.get('log', [])) != 0:
+                with self._lock:
+                    learned = self._spellings.get((repo, branch), None) != candidates[index]
+                    self._spellings[(repo, branch)] = candidates[index]
+                if learned is True:
+                    self.gitiles.learn(repo, branch, candidates[index])
                 return data
+            index += 1
+            if index == 1 and len(candidates) > 1:
+                candidates = candidates[:1] + self._prune(repo, candidates[1:])
         return None
 
-    def _build(self, repo, branch, commit, label):
-        def _query(commit):
-            buf = self.gerrit.query('commit:' + commit, 0)
-            if buf is None or len(buf) != 1:
-                return '', '', []
-
-            # Construct the change URL based on Gerrit instance type
-            gerrit_url = self.gerrit.url()
-            # Remove /a suffix if present (used for authenticated access)
-            if gerrit_url.endswith('/a'):
-                gerrit_url = gerrit_url[:-2]
-
-            change_number = str(buf[0]['_number'])
-
-            # For self-hosted Gerrit (non-googlesource), add /c/ prefix
-            if 'googlesource.com' not in gerrit_url:
-                change_url = gerrit_url + '/c/' + repo + '/+/' + change_number
-            else:
-                change_url = gerrit_url + '/' + change_number
+    def _change(self, repo, change):
+        # Construct the change URL based on Gerrit instance type
+        gerrit_url = self.gerrit.url()
+        # Remove /a suffix if present (used for authenticated access)
+        if gerrit_url.endswith('/a'):
+            gerrit_url = gerrit_url[:-2]
 
-            return change_url, buf[0].get('topic', ''), buf[0].get('hashtags', [])
+        change_number = str(change['_number'])
 
-        change, topic, hashtags = _query(commit['commit'])
+        # For self-hosted Gerrit (non-googlesource), add /c/ prefix
+        if 'googlesource.com' not in gerrit_url:
+            change_url = gerrit_url + '/c/' + repo + '/+/' + change_number
+        else:
+            change_url = gerrit_url + '/' + change_number
+
+        return change_url, change.get('topic', ''), change.get('hashtags', [])
+
+    def _query(self, repo, commit):
+        buf = self.gerrit.query('commit:' + commit, 0)
+        if buf is None or len(buf) != 1:
+            return '', '', []
+        return self._change(repo, buf[0])
+
+    def _build(self, repo, branch, commit, label):
+        if self._deferred is True:
+            # Filled in by _resolve() with batched queries once every record is known
+            change, topic, hashtags = '', '', []
+        else:
+            change, topic, hashtags = self._query(repo, commit['commit'])
         return [{
             Commit.AUTHOR: '%s <%s>' % (commit['author']['name'], commit['author']['email']),
             Commit.BRANCH: branch,
@@ -76,106 +151,103 @@ class Querier(object):
         }]
 
     def _ahead(self, commit1, commit2):
-        def _helper(data):
-            for item in data:
-                if '\u4e00' <= item <= '\u9fff':
-                    return True
-            return False
-
-        buf1 = " ".join(commit1['committer']['time'].split(" ")[1:])
-        if _helper(buf1) is True:
-            buf1 = datetime.datetime.strptime(buf1, '%m月 %d %H:%M:%S %Y %z')
-        else:
-            buf1 = datetime.datetime.strptime(buf1, '%b %d %H:%M:%S %Y %z')
-        buf2 = " ".join(commit2['committer']['time'].split(" ")[1:])
-        if _helper(buf2) is True:
-            buf2 = datetime.datetime.strptime(buf2, '%m月 %d %H:%M:%S %Y %z')
-        else:
-            buf2 = datetime.datetime.strptime(buf2, '%b %d %H:%M:%S %Y %z')
-        return buf2 > buf1
+        return committed(commit2) > committed(commit1)
 
     def _commits(self, repo, commit1, commit2, backward):
-        def _helper(repo, commit1, commit2, backward):
-            buf = []
-            commit = self.gitiles.commit(repo, commit1[Repo.COMMIT])
-            if commit is None:
-                return [], None, False
-            commits = self._get_commits_with_variants(repo, commit2[Repo.BRANCH], commit2[Repo.COMMIT])
-            if commits is None:
-                return [], None, False
-            completed = False
-            next = commits.get('next', None) if backward else commits.get('previous', None)
-            for item in commits['log']:
-                if item['commit'] == commit1[Repo.COMMIT] or item['commit'].startswith(commit1[Repo.COMMIT]):
-                    completed = True
-                    break
-                if (backward and self._ahead(item, commit)) \
-                        or (not backward and self._ahead(commit, item)):
-                    next = None
-                    break
-                buf.append(item)
-            return buf, next, completed
-
+        commit = self.gitiles.commit(repo, commit1[Repo.COMMIT])
+        if commit is None:
+            return [], False
         buf = []
-        while True:
-            commits, next, completed = _helper(repo, commit1, commit2, backward)
-            buf.extend(commits)
-            if completed is True:
-                status = True
-                break
-            else:
-                if next is None:
-                    status = False
-                    break
-            commit2 = {
-                Repo.BRANCH: commit2[Repo.BRANCH],
-                Repo.COMMIT: next
-            }
-        return buf, status
+        pages = Pages(lambda start: self._get_commits_with_variants(repo, commit2[Repo.BRANCH], start),
+                      commit2[Repo.COMMIT], 'next' if backward else 'previous', self._prefetch)
+        try:
+            for commits in pages:
+                if commits is None:
+                    return buf, False
+                for item in commits['log']:
+                    if item['commit'] == commit1[Repo.COMMIT] or item['commit'].startswith(commit1[Repo.COMMIT]):
+                        return buf, True
+                    if (backward and self._ahead(item, commit)) \
+                            or (not backward and self._ahead(commit, item)):
+                        return buf, False
+                    buf.append(item)
+            return buf, False
+        finally:
+            pages.close()
 
     def _commit1(self, repo, commit1, commit2):
-        # Try to get commits from commit2's history using the branch (with variants)
-        commits = self._get_commits_with_variants(repo, commit2[Repo.BRANCH], commit2[Repo.COMMIT])
-        if commits is None:
-            # Fallback: try using commit hash directly (rare for +log, but attempt variants)
-            commits = self._get_commits_with_variants(repo, commit2[Repo.COMMIT], commit2[Repo.COMMIT])
+        def _history(commit):
+            # Try to get commits from the commit's history using the branch (with variants)
+            branch = commit[Repo.BRANCH]
+            commits = self._get_commits_with_variants(repo, branch, commit[Repo.COMMIT])
             if commits is None:
-                Logger.warn('_commit1: Failed to get commits for repo: %s with branch variants and commit hash' % repo)
-                return None, ''
+                # Fallback: try using commit hash directly (rare for +log, but attempt variants)
+                branch = commit[Repo.COMMIT]
+                commits = self._get_commits_with_variants(repo, branch, commit[Repo.COMMIT])
+            return branch, commits
 
+        branch2, commits2 = _history(commit2)
+        if commits2 is None:
+            Logger.warn('_commit1: Failed to get commits for repo: %s with branch variants and commit hash' % repo)
+            return None, ''
+        branch1, commits1 = _history(commit1)
+        if commits1 is None:
+            Logger.warn('_commit1: Failed to get commits of commit1 for repo: %s with branch variants and commit hash' % repo)
+            return None, ''
+
+        # Walk both histories page by page and stop at the first commit seen by both.
+        # The merge base is the intersection that comes first in commit2's history.
+        pages1 = Pages(lambda start: self._get_commits_with_variants(repo, branch1, start),
+                       depth=self._prefetch, first=commits1)
+        pages2 = Pages(lambda start: self._get_commits_with_variants(repo, branch2, start),
+                       depth=self._prefetch, first=commits2)
+        try:
+            return self._base(repo, commit1, pages1, pages2)
+        finally:
+            pages1.close()
+            pages2.close()
+
+    def _base(self, repo, commit1, pages1, pages2):
+        commits1 = next(pages1)
+        commits2 = next(pages2)
+        seen1 = set()
+        seen2 = {}
+        base = None
         iterations = 0
         max_iterations = 100  # Prevent infinite loops
-        checked_commits = []
         while iterations < max_iterations:
             iterations += 1
-            commit = None
-            for item in commits.get('log', []):
-                checked_commits.append(item['commit'][:8])  # Store first 8 chars for logging
-                # Check if this commit exists in commit1's history by querying from commit1
-                # Try branch variants to find the intersection
-                data = self._get_commits_with_variants(repo, commit1[Repo.BRANCH], item['commit'])
-                if data is not None and len(data['log']) != 0:
-                    commit = {
-                        Repo.BRANCH: commit1[Repo.BRANCH],
-                        Repo.COMMIT: item['commit']
-                    }
-                    break
-            if commit is not None:
-                break
-            data = commits.get('next', None)
-            if data is None:
-                Logger.warn('_commit1: No more commits to check (pagination ended) for repo: %s after %d iterations (checked: %s)' % (repo, iterations, ', '.join(checked_commits)))
+            for item in commits2.get('log', []) if commits2 is not None else []:
+                if item['commit'] in seen2:
+                    continue
+                seen2[item['commit']] = len(seen2)
+                if item['commit'] in seen1 and (base is None or seen2[item['commit']] < seen2[base]):
+                    base = item['commit']
+            for item in commits1.get('log', []) if commits1 is not None else []:
+                if item['commit'] in seen1:
+                    continue
+                seen1.add(item['commit'])
+                if item['commit'] in seen2 and (base is None or seen2[item['commit']] < seen2[base]):
+                    base = item['commit']
+            if base is not None:
                 break
-            commits = self._get_commits_with_variants(repo, commit2[Repo.BRANCH], data)
-            if commits is None:
-                Logger.warn('_commit1: Failed to get next page of commits for repo: %s' % repo)
+            if commits2 is not None:
+                commits2 = next(pages2, None)
+            if commits1 is not None:
+                commits1 = next(pages1, None)
+            if commits1 is None and commits2 is None:
+                Logger.warn('_commit1: No more commits to check (pagination ended) for repo: %s after %d iterations (checked: %d, %d)' % (repo, iterations, len(seen1), len(seen2)))
                 break
 
-        if iterations >= max_iterations:
-            Logger.warn('_commit1: Reached max iterations (%d) for repo: %s' % (max_iterations, repo))
-
-        if commit is None:
+        if base is None:
+            if iterations >= max_iterations:
+                Logger.warn('_commit1: Reached max iterations (%d) for repo: %s' % (max_iterations, repo))
             return None, ''
+
+        commit = {
+            Repo.BRANCH: commit1[Repo.BRANCH],
+            Repo.COMMIT: base
+        }
         data1 = self.gitiles.commit(repo, commit1[Repo.COMMIT])
         data2 = self.gitiles.commit(repo, commit[Repo.COMMIT])
         if data1 is None or data2 is None:
@@ -186,7 +258,135 @@ class Querier(object):
             label = Label.REMOVE_COMMIT
         return commit, label
 
+    def _pages(self, repo, commit1, commit2):
+        # Range logs are always read to the end, so nothing fetched ahead is wasted and
+        # their pages are fetched right away, without holding back at the prefetch depth
+        return Pages(lambda start: self.gitiles.range(repo, commit1[Repo.COMMIT], commit2[Repo.COMMIT], start),
+                     depth=100 if self._prefetch != 0 else 0, eager=True)
+
+    def _range(self, repo, commit1, commit2, pages=None):
+        # List commits in commit1..commit2 with one paginated range log
+        buf = []
+        iterations = 0
+        max_iterations = 100  # Prevent infinite loops
+        pages = pages if pages is not None else self._pages(repo, commit1, commit2)
+        try:
+            for data in pages:
+                iterations += 1
+                if data is None:
+                    return None
+                buf.extend(data.get('log', []))
+                if iterations == max_iterations:
+                    break
+            else:
+                return buf
+        finally:
+            pages.close()
+        Logger.warn('_range: Reached max iterations (%d) for repo: %s' % (max_iterations, repo))
+        return None
+
+    def _graph(self, repo, commit1, commit2):
+        steps = self._split(self.gitiles, repo, commit1, commit2)
+        reply = None
+        while True:
+            try:
+                kind, sha = steps.send(reply)
+            except StopIteration as e:
+                return e.value
+            reply = self.gitiles.commits(repo, sha, sha) if kind == 'log' else self.gitiles.commit(repo, sha)
+
+    def _split(self, gitiles, repo, commit1, commit2):
+        # Split the history of both commits on the local commit graph, in committer time
+        # order like a range log. Only commits not seen in this or an earlier run cost a
+        # request, which this generator yields as ('log', sha) for a log page from sha or
+        # ('commit', sha) for a commit header and is sent the reply of. Everything else is
+        # looked up locally. Returns (added, removed) or None to leave it to range logs.
+        if SHA_RE.match(commit1[Repo.COMMIT]) is None or SHA_RE.match(commit2[Repo.COMMIT]) is None:
+            return None
+        pages = {}
+        max_pages = 100  # Prevent unbounded walks
+
+        def _node(sha):
+            node = gitiles.node(repo, sha)
+            if node is None and len(pages) < max_pages:
+                pages[sha] = yield 'log', sha
+                node = gitiles.node(repo, sha)
+            return node
+
+        side1, side2, both = 1, 2, 3
+        flags = {}
+        order = {}
+        queue = []
+        for sha, flag in [(commit2[Repo.COMMIT], side2), (commit1[Repo.COMMIT], side1)]:
+            node = yield from _node(sha)
+            if node is None:
+                return None
+            flags[sha] = flags.get(sha, 0) | flag
+            heapq.heappush(queue, (-node[1], sha))
+        # Keep going a few commits past the point where only common history is left,
+        # as git does, to tolerate committer clock skew
+        slop = 5
+        while len(queue) != 0:
+            if all(flags[item[1]] == both for item in queue):
+                slop -= 1
+                if slop == 0:
+                    break
+            else:
+                slop = 5
+            _, sha = heapq.heappop(queue)
+            order.setdefault(sha, len(order))
+            for parent in (yield from _node(sha))[0]:
+                flag = flags.get(parent, 0)
+                if flag | flags[sha] == flag:
+                    continue
+                node = yield from _node(parent)
+                if node is None:
+                    return None
+                flags[parent] = flag | flags[sha]
+                heapq.heappush(queue, (-node[1], parent))
+        seen = {}
+        for data in pages.values():
+            for item in (data or {}).get('log', []):
+                seen[item.get('commit', '')] = item
+        added, removed = [], []
+        for sha in sorted(order, key=order.get):
+            if flags[sha] == both:
+                continue
+            data = seen.get(sha, None)
+            if data is None:
+                found, data = gitiles.known(repo, sha)
+                if found is False:
+                    data = yield 'commit', sha
+            if data is None:
+                return None
+            (added if flags[sha] == side2 else removed).append(data)
+        return added, removed
+
     def _diff(self, repo, commit1, commit2):
+        # The local commit graph answers first, then range logs, and walking the history
+        # is left for servers without range logs
+        ret = self._graph(repo, commit1, commit2)
+        if ret is not None:
+            return self._listed(repo, commit1, commit2, *ret)
+        pages = self._pages(repo, commit2, commit1)
+        try:
+            added = self._range(repo, commit1, commit2)
+            removed = self._range(repo, commit2, commit1, pages) if added is not None else None
+        finally:
+            pages.close()
+        if added is not None and removed is not None:
+            return self._listed(repo, commit1, commit2, added, removed)
+        return self._walk(repo, commit1, commit2)
+
+    def _listed(self, repo, commit1, commit2, added, removed):
+        buf = []
+        for item in added:
+            buf.extend(self._build(repo, commit2[Repo.BRANCH], item, Label.ADD_COMMIT))
+        for item in removed:
+            buf.extend(self._build(repo, commit1[Repo.BRANCH], item, Label.REMOVE_COMMIT))
+        return buf
+
+    def _walk(self, repo, commit1, commit2):
         buf = []
         commit, label = self._commit1(repo, commit1, commit2)
         if commit is None:
@@ -223,6 +423,21 @@ class Querier(object):
                 buf.extend(self._build(repo, commit1[Repo.BRANCH], item, label))
         return buf
 
+    def _tasks(self, data, label):
+        tasks = []
+        for key, val in data.get(label, {}).items():
+            # Extract actual repo name from the commit data if available
+            # For projects with duplicate names, use the 'name' field from Repo
+            repo_name = key
+            if val and len(val) > 0:
+                # Check first non-empty dict in the list
+                for item in val:
+                    if item and Repo.NAME in item:
+                        repo_name = item[Repo.NAME]
+                        break
+            tasks.append((repo_name, val))
+        return tasks
+
     def _fetch(self, data, label):
         def _helper(repo, commit, label):
             buf1, buf2 = commit
@@ -242,23 +457,388 @@ class Querier(object):
             else:
                 return []
 
+        def _safe_helper(repo, commit, label):
+            # Isolate failures so that one broken repo does not abort the whole run
+            try:
+                buf = _helper(repo, commit, label)
+            except Exception as e:
+                Logger.error('%s: %s: %s' % (label, repo, str(e)))
+                return []
+            Logger.info('%s: %s: %d gitiles requests' % (label, repo, self.gitiles.count(repo)))
+            return buf
+
+        tasks = self._tasks(data, label)
+        if self._workers == 1 or len(tasks) <= 1:
+            results = [_safe_helper(repo, val, label) for repo, val in tasks]
+        else:
+            # map() yields in submission order, which keeps output identical to the serial run
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                results = list(executor.map(lambda task: _safe_helper(task[0], task[1], label), tasks))
+
         buf = []
-        for key, val in data.get(label, {}).items():
-            # Extract actual repo name from the commit data if available
-            # For projects with duplicate names, use the 'name' field from Repo
-            repo_name = key
-            if val and len(val) > 0:
-                # Check first non-empty dict in the list
-                for item in val:
-                    if item and Repo.NAME in item:
-                        repo_name = item[Repo.NAME]
-                        break
-            buf.extend(_helper(repo_name, val, label))
+        for item in results:
+            buf.extend(item)
+        return buf
+
+    def _count(self, name, value=1):
+        if value == 0:
+            return
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + value
+        Metrics.count(name, value)
+
+    def _match(self, commits, buf):
+        # Map changes back to the commits, returns the commits that still need a query of their own
+        changes = {}
+        matched = 0
+        for item in buf:
+            revisions = set(item.get('revisions', {}).keys())
+            if item.get('current_revision', None) is not None:
+                revisions.add(item['current_revision'])
+            revisions = revisions.intersection(commits)
+            if len(revisions) != 0:
+                matched += 1
+            for revision in revisions:
+                changes.setdefault(revision, []).append(item)
+        if matched == len(buf):
+            return changes, []
+        # Some change matched an older patch set, query unmatched commits one by one
+        return changes, [item for item in commits if item not in changes]
+
+    def _claim(self, records, owners, keys, buf):
+        # Map changes found by Change-Id back to the commits carrying it. A Change-Id can be
+        # on several branches and projects, so the revision decides first, then project and branch.
+        found = {}
+        for item in buf:
+            found.setdefault(item.get('change_id', ''), []).append(item)
+        changes = {}
+        for key in keys:
+            for commit, _ in owners[key]:
+                candidates = [item for item in found.get(key, [])
+                              if commit == item.get('current_revision', None) or commit in item.get('revisions', {})]
+                if len(candidates) == 0:
+                    record = records[commit][0]
+                    candidates = [item for item in found.get(key, []) if item.get('project', None) == record[Commit.REPO]]
+                    if len(candidates) > 1:
+                        branch = record.get(Commit.BRANCH, '')
+                        branch = branch[len('refs/heads/'):] if branch.startswith('refs/heads/') else branch
+                        candidates = [item for item in candidates if item.get('branch', None) == branch]
+                if len(candidates) == 1:
+                    changes[commit] = candidates
+                    self._count('change_id_hit')
+                else:
+                    self._count('change_id_miss')
+        return changes
+
+    def _renew(self, owners, keys, buf):
+        # Merged changes known from an earlier run get topic and hashtags refreshed by number,
+        # and keep what was known when the refresh did not return them
+        found = {str(item.get('_number', '')): item for item in buf}
+        changes = {}
+        for key in keys:
+            for commit, _, value in owners[key]:
+                changes[commit] = [found.get(key, value)]
+        return changes
+
+    def _settle(self, kind, keys, owners, changes, complete):
+        # (commit, key, change) items worth keeping for later runs. A change not found is only
+        # kept as such when the whole batch query answered.
+        if kind == 'commit':
+            return [(commit, '', data[0] if len(data) == 1 else None) for commit, data in changes.items()]
+        buf = []
+        for key in keys:
+            for item in owners[key]:
+                commit = item[0]
+                if commit in changes and (kind == 'change' or changes[commit][0] is not item[2]):
+                    buf.append((commit, item[1], changes[commit][0]))
+                elif kind == 'change' and complete is True:
+                    buf.append((commit, item[1], None))
+        return buf
+
+    def _lookup(self, kind, keys):
+        # Query changes of many commits or Change-Ids at once, returns None if the batch query failed.
+        # The steps of _resolve() are generators that yield the (search, start) queries they need and
+        # are sent the results, so that Querier and AsyncQuerier only differ in how they send them.
+        search = ' OR '.join([self._operators[kind] + ':' + item for item in keys])
+        buf = []
+        start = 0
+        while True:
+            data = yield search, start
+            if data is None:
+                return None
+            buf.extend(data)
+            if len(data) == 0 or data[-1].get('_more_changes', False) is not True:
+                break
+            start += len(data)
         return buf
 
+    def _single(self, kind, keys):
+        changes = {}
+        for item in keys:
+            try:
+                data = yield self._operators[kind] + ':' + item, 0
+            except Exception as e:
+                Logger.error('_resolve: %s: %s' % (item, str(e)))
+                continue
+            if data is not None:
+                changes[item] = data
+        return changes
+
+    def _settled(self, records, batch):
+        # Changes of one batch and the entries to keep of them
+        kind, keys, owners = batch
+        try:
+            found = yield from self._lookup(kind, keys)
+        except Exception as e:
+            Logger.error('_resolve: %s' % str(e))
+            found = None
+        complete = found is not None
+        # Fall back to queries of their own so that one bad batch does not blank the others
+        if kind == 'commit':
+            if found is None:
+                changes = yield from self._single(kind, keys)
+            else:
+                changes, commits = self._match(keys, found)
+                changes.update((yield from self._single(kind, commits)))
+        else:
+            if found is None:
+                found = [item for data in (yield from self._single(kind, keys)).values() for item in data]
+            if kind == 'change':
+                changes = self._claim(records, owners, keys, found)
+            else:
+                changes = self._renew(owners, keys, found)
+        return changes, self._settle(kind, keys, owners, changes, complete)
+
+    def _drive(self, steps):
+        reply, error = None, None
+        while True:
+            try:
+                search = steps.send(reply) if error is None else steps.throw(error)
+            except StopIteration as e:
+                return e.value
+            try:
+                reply, error = self.gerrit.query(*search), None
+            except Exception as e:
+                reply, error = None, e
+
+    def _batches(self, buf):
+        # Commits with a Change-Id trailer are looked up by change:. Upstream imports, merges and
+        # automated bumps have none and so no change to find; they are skipped unless commit_fallback
+        # asks for commit: queries. Changes found in an earlier run come from the cache.
+        records = {}
+        for item in buf:
+            records.setdefault(item[Commit.COMMIT], []).append(item)
+        cached = {}
+        commits = []
+        ids = {}
+        numbers = {}
+        for commit, items in records.items():
+            key = change_id(items[0].get(Commit.MESSAGE, ''))
+            if key is None and self._fallback is not True:
+                self._count('change_id_skip')
+                continue
+            key = key if key is not None else ''
+            found = self.gerrit.recall(commit, key)
+            if found is not None and found[1] is True:
+                cached[commit] = [found[0]] if found[0] is not None else []
+                self._count('change_cache_hit')
+            elif found is not None:
+                numbers.setdefault(str(found[0]['_number']), []).append((commit, key, found[0]))
+                self._count('change_cache_refresh')
+            elif len(key) != 0:
+                ids.setdefault(key, []).append((commit, key))
+            else:
+                commits.append(commit)
+        batches = [('commit', commits[i:i+self._batch], None) for i in range(0, len(commits), self._batch)]
+        for kind, owners in [('change', ids), ('number', numbers)]:
+            keys = list(owners.keys())
+            batches.extend([(kind, keys[i:i+self._batch], owners) for i in range(0, len(keys), self._batch)])
+        return records, cached, batches
+
+    def _apply(self, records, results):
+        for changes in results:
+            for commit, data in changes.items():
+                if len(data) != 1:
+                    continue
+                for item in records.get(commit, []):
+                    change, topic, hashtags = self._change(item[Commit.REPO], data[0])
+                    item[Commit.CHANGE] = change
+                    item[Commit.HASHTAGS] = hashtags
+                    item[Commit.TOPIC] = topic
+
+    def _resolve(self, buf):
+        records, cached, batches = self._batches(buf)
+        if self._workers == 1 or len(batches) <= 1:
+            results = [self._drive(self._settled(records, item)) for item in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=self._workers) as executor:
+                results = list(executor.map(lambda item: self._drive(self._settled(records, item)), batches))
+        self._apply(records, [cached] + [item[0] for item in results])
+        self.gerrit.keep([entry for item in results for entry in item[1]])
+
     def run(self, data):
         buf = []
-        buf.extend(self._fetch(data, Label.ADD_REPO))
-        buf.extend(self._fetch(data, Label.REMOVE_REPO))
-        buf.extend(self._fetch(data, Label.UPDATE_REPO))
+        self._deferred = True
+        try:
+            buf.extend(self._fetch(data, Label.ADD_REPO))
+            buf.extend(self._fetch(data, Label.REMOVE_REPO))
+            buf.extend(self._fetch(data, Label.UPDATE_REPO))
+        finally:
+            self._deferred = False
+        self._resolve(buf)
+        self._summary()
+        return buf
+
+    def close(self):
+        # Pooled sessions and cache connections are held until the run is over
+        self.gerrit.close()
+        self.gitiles.close()
+
+    def _summary(self):
+        with self._lock:
+            counts = dict(self._counts)
+        if len(counts) != 0:
+            Logger.info('gerrit: %s' % ', '.join(['%s %d' % (key, val) for key, val in sorted(counts.items())]))
+        counts = self.policy.counts()
+        if len(counts) != 0:
+            Logger.warn('throttling: %s' % ', '.join(['%s %d' % (key, val) for key, val in sorted(counts.items())]))
+
+
+class AsyncQuerier(Querier):
+    def __init__(self, config=None):
+        super().__init__(config)
+        if aiohttp is None:
+            raise QuerierException('aiohttp required for the async engine')
+        try:
+            self.agerrit = AsyncGerrit(config, self.policy)
+            self.agitiles = AsyncGitiles(config, self.policy)
+        except (GerritException, GitilesException) as e:
+            raise QuerierException(str(e))
+        # Records are always resolved against Gerrit in batches once they are all built
+        self._deferred = True
+        self._inflight = config.get('querier', {}).get('inflight', 100)
+        self._inflight = self._inflight if self._inflight > 0 else 100
+        self._inflight_per_host = config.get('querier', {}).get('inflight_per_host', 20)
+        self._inflight_per_host = self._inflight_per_host if self._inflight_per_host > 0 else 20
+
+    async def _arange(self, repo, commit1, commit2):
+        buf = []
+        start = None
+        iterations = 0
+        max_iterations = 100  # Prevent infinite loops
+        while iterations < max_iterations:
+            iterations += 1
+            data = await self.agitiles.range(repo, commit1[Repo.COMMIT], commit2[Repo.COMMIT], start)
+            if data is None:
+                return None
+            buf.extend(data.get('log', []))
+            start = data.get('next', None)
+            if start is None:
+                return buf
+        Logger.warn('_range: Reached max iterations (%d) for repo: %s' % (max_iterations, repo))
+        return None
+
+    async def _agraph(self, repo, commit1, commit2):
+        # The same walk as _graph(). Its steps only look the local graph, memo and cache up,
+        # so they run on a thread, while the commits missing are fetched by the async client.
+        def _step(reply):
+            try:
+                return False, steps.send(reply)
+            except StopIteration as e:
+                return True, e.value
+
+        steps = self._split(self.agitiles, repo, commit1, commit2)
+        loop = asyncio.get_running_loop()
+        reply = None
+        while True:
+            done, ret = await loop.run_in_executor(None, _step, reply)
+            if done is True:
+                return ret
+            kind, sha = ret
+            if kind == 'log':
+                reply = await self.agitiles.commits(repo, sha, sha)
+            else:
+                reply = await self.agitiles.commit(repo, sha)
+
+    async def _adiff(self, repo, commit1, commit2):
+        ret = await self._agraph(repo, commit1, commit2)
+        if ret is not None:
+            return self._listed(repo, commit1, commit2, *ret)
+        added, removed = await asyncio.gather(self._arange(repo, commit1, commit2),
+                                              self._arange(repo, commit2, commit1))
+        if added is not None and removed is not None:
+            return self._listed(repo, commit1, commit2, added, removed)
+        # Walking the history is only needed for servers without range logs, leave it on a thread
+        return await asyncio.get_running_loop().run_in_executor(None, self._walk, repo, commit1, commit2)
+
+    async def _afetch(self, repo, commit, label):
+        async def _helper(repo, commit, label):
+            buf1, buf2 = commit
+            Logger.info(label + ': ' + repo)
+            if label == Label.ADD_REPO:
+                data = await self.agitiles.commit(repo, buf2[Repo.COMMIT])
+                if data is None:
+                    return []
+                return self._build(repo, buf2[Repo.BRANCH], data, label)
+            elif label == Label.REMOVE_REPO:
+                data = await self.agitiles.commit(repo, buf1[Repo.COMMIT])
+                if data is None:
+                    return []
+                return self._build(repo, buf1[Repo.BRANCH], data, label)
+            elif label == Label.UPDATE_REPO:
+                return await self._adiff(repo, buf1, buf2)
+            else:
+                return []
+
+        try:
+            buf = await _helper(repo, commit, label)
+        except Exception as e:
+            Logger.error('%s: %s: %s' % (label, repo, str(e)))
+            return []
+        Logger.info('%s: %s: %d gitiles requests' % (label, repo, self.agitiles.count(repo) + self.gitiles.count(repo)))
+        return buf
+
+    async def _adrive(self, steps):
+        reply, error = None, None
+        while True:
+            try:
+                search = steps.send(reply) if error is None else steps.throw(error)
+            except StopIteration as e:
+                return e.value
+            try:
+                reply, error = await self.agerrit.query(*search), None
+            except Exception as e:
+                reply, error = None, e
+
+    async def _aresolve(self, buf):
+        records, cached, batches = self._batches(buf)
+        results = await asyncio.gather(*[self._adrive(self._settled(records, item)) for item in batches])
+        self._apply(records, [cached] + [item[0] for item in results])
+        self.gerrit.keep([entry for item in results for entry in item[1]])
+
+    async def _arun(self, data):
+        # The connector caps connections in flight, both overall and per host
+        connector = aiohttp.TCPConnector(limit=self._inflight, limit_per_host=self._inflight_per_host)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            self.agerrit.open(session)
+            self.agitiles.open(session)
+            tasks = []
+            for label in [Label.ADD_REPO, Label.REMOVE_REPO, Label.UPDATE_REPO]:
+                tasks.extend([self._afetch(repo, val, label) for repo, val in self._tasks(data, label)])
+            # gather() keeps submission order, which keeps output identical to Querier.run()
+            results = await asyncio.gather(*tasks)
+            buf = []
+            for item in results:
+                buf.extend(item)
+            await self._aresolve(buf)
+        return buf
+
+    def close(self):
+        super().close()
+        self.agerrit.close()
+        self.agitiles.close()
+
+    def run(self, data):
+        buf = asyncio.run(self._arun(data))
+        self._summary()
         return buf
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import requests
+import threading
+import weakref
+
+from requests.adapters import HTTPAdapter
+from ..metrics.metrics import Metrics
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class Adapter(HTTPAdapter):
+    # Counts the connections its pools open as <service>_connections, so that
+    # connection reuse shows in the metrics next to the request counts
+    def __init__(self, service, **kwargs):
+        self._lock = threading.Lock()
+        self._opened = weakref.WeakKeyDictionary()
+        self._service = service
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        pool = getattr(response.raw, '_pool', None)
+        if pool is not None:
+            with self._lock:
+                opened = pool.num_connections - self._opened.get(pool, 0)
+                self._opened[pool] = pool.num_connections
+            if opened != 0:
+                Metrics.count('%s_connections' % self._service, opened)
+        return response
+
+
+def connect(service, user, password, retry, pool_connections, pool_maxsize):
+    # One long-lived session keeps connections alive across calls. The adapter
+    # pool is thread-safe, so the session can be shared by worker threads.
+    session = requests.Session()
+    adapter = Adapter(service, max_retries=retry, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if len(password) != 0 and len(user) != 0:
+        session.auth = (user, password)
+    return session
+
+
+class Reply(object):
+    # Status, headers and body of an aiohttp response, read before the connection is
+    # released and named like requests.Response so that Policy and the clients take both
+    def __init__(self, status_code, headers, content):
+        self.content = content
+        self.headers = headers
+        self.status_code = status_code
+
+
+async def fetch(session, url, params=None, auth=None, timeout=None, retry=0):
+    # One GET on an aiohttp session. Connection errors are tried again up to retry
+    # times, as the adapter of connect() does for requests.
+    while True:
+        try:
+            async with session.get(url, params=params, auth=auth,
+                                   timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                return Reply(response.status, response.headers, await response.read())
+        except aiohttp.ClientConnectionError:
+            if retry == 0:
+                raise
+            retry -= 1
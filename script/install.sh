@@ -81,27 +81,38 @@ $PYTHON_BIN -m PyInstaller --onefile \
   --name "$BINARY_NAME" \
   --add-data "diffmanifests/config:diffmanifests/config" \
   --hidden-import diffmanifests \
+  --hidden-import diffmanifests.cache \
+  --hidden-import diffmanifests.cache.cache \
   --hidden-import diffmanifests.cmd \
   --hidden-import diffmanifests.cmd.argument \
   --hidden-import diffmanifests.cmd.banner \
   --hidden-import diffmanifests.cmd.version \
+  --hidden-import diffmanifests.decoder \
+  --hidden-import diffmanifests.decoder.decoder \
   --hidden-import diffmanifests.differ \
   --hidden-import diffmanifests.differ.differ \
+  --hidden-import diffmanifests.flight \
+  --hidden-import diffmanifests.flight.flight \
   --hidden-import diffmanifests.gerrit \
   --hidden-import diffmanifests.gerrit.gerrit \
   --hidden-import diffmanifests.gitiles \
   --hidden-import diffmanifests.gitiles.gitiles \
   --hidden-import diffmanifests.logger \
   --hidden-import diffmanifests.logger.logger \
+  --hidden-import diffmanifests.metrics \
+  --hidden-import diffmanifests.metrics.metrics \
+  --hidden-import diffmanifests.policy \
+  --hidden-import diffmanifests.policy.policy \
   --hidden-import diffmanifests.printer \
   --hidden-import diffmanifests.printer.printer \
   --hidden-import diffmanifests.proto \
   --hidden-import diffmanifests.proto.proto \
   --hidden-import diffmanifests.querier \
   --hidden-import diffmanifests.querier.querier \
+  --hidden-import diffmanifests.session \
+  --hidden-import diffmanifests.session.session \
   --hidden-import colorama \
   --hidden-import requests \
-  --hidden-import xmltodict \
   --hidden-import openpyxl \
   --hidden-import openpyxl.workbook \
   --hidden-import openpyxl.worksheet \
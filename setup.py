@@ -14,7 +14,6 @@ requirements = [
     'colorama',
     'openpyxl',
     'requests',
-    'xmltodict',
 ]
 
 # Development dependencies (not needed for installation)
@@ -41,7 +40,9 @@ setuptools.setup(
     include_package_data=True,
     install_requires=requirements,
     extras_require={
+        'async': ['aiohttp'],
         'dev': dev_requirements,
+        'json': ['orjson'],
     },
     keywords=['diff', 'manifests', 'gitiles', 'api'],
     license='Apache-2.0',
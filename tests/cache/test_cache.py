@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from diffmanifests.cache.cache import Cache, CacheException
+
+
+class _Locked(object):
+    # Connection whose writes fail as if another run held the database locked
+    def __init__(self, db):
+        self.db = db
+        self.locked = True
+
+    def _check(self, sql):
+        if self.locked is True and sql.split()[0] in ('INSERT', 'UPDATE', 'DELETE'):
+            raise sqlite3.OperationalError('database is locked')
+
+    def execute(self, sql, *args):
+        self._check(sql)
+        return self.db.execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        self._check(sql)
+        return self.db.executemany(sql, *args)
+
+    def close(self):
+        self.db.close()
+
+    @property
+    def in_transaction(self):
+        return self.db.in_transaction
+
+
+def test_exception():
+    exception = CacheException('exception')
+    assert str(exception) == 'exception'
+
+
+def test_cache_invalid_config():
+    with pytest.raises(CacheException):
+        Cache(None)
+
+    with pytest.raises(CacheException):
+        Cache({})
+
+
+def test_cache_put_get():
+    with tempfile.TemporaryDirectory() as path:
+        cache = Cache({'cache': {'dir': path}})
+
+        assert cache.get('https://host', 'platform/build', 'a' * 40) is None
+
+        cache.put('https://host', 'platform/build', 'a' * 40, {'commit': 'a' * 40, 'message': 'Test\n'})
+        assert cache.get('https://host', 'platform/build', 'a' * 40) == {'commit': 'a' * 40, 'message': 'Test\n'}
+
+        # Keys are scoped by host and repo
+        assert cache.get('https://other', 'platform/build', 'a' * 40) is None
+        assert cache.get('https://host', 'platform/art', 'a' * 40) is None
+
+        cache.close()
+
+
+def test_cache_persistent():
+    with tempfile.TemporaryDirectory() as path:
+        cache = Cache({'cache': {'dir': os.path.join(path, 'sub')}})
+        cache.put('https://host', 'platform/build', 'b' * 40, {'commit': 'b' * 40})
+        cache.close()
+
+        cache = Cache({'cache': {'dir': os.path.join(path, 'sub')}})
+        assert cache.get('https://host', 'platform/build', 'b' * 40) == {'commit': 'b' * 40}
+        cache.close()
+
+
+def test_cache_lru_eviction():
+    with tempfile.TemporaryDirectory() as path:
+        cache = Cache({'cache': {'dir': path, 'size': 1}})
+        value = {'message': 'x' * (300 * 1024)}
+
+        cache.put('https://host', 'repo', '1', value)
+        cache.put('https://host', 'repo', '2', value)
+        cache.put('https://host', 'repo', '3', value)
+        # Touch the oldest entry so that the second one becomes least recently used
+        assert cache.get('https://host', 'repo', '1') is not None
+        cache.put('https://host', 'repo', '4', value)
+
+        assert cache.get('https://host', 'repo', '1') is not None
+        assert cache.get('https://host', 'repo', '2') is None
+        assert cache.get('https://host', 'repo', '3') is not None
+        assert cache.get('https://host', 'repo', '4') is not None
+
+        cache.close()
+
+
+def test_cache_nodes():
+    with tempfile.TemporaryDirectory() as path:
+        cache = Cache({'cache': {'dir': path, 'size': 1}})
+        assert cache.node('https://host', 'platform/build', 'a' * 40) is None
+
+        cache.put_nodes('https://host', 'platform/build', [('a' * 40, ['b' * 40, 'c' * 40], 1700000000),
+                                                           ('b' * 40, [], 1600000000)])
+        cache.close()
+
+        cache = Cache({'cache': {'dir': path, 'size': 1}})
+        assert cache.node('https://host', 'platform/build', 'a' * 40) == (['b' * 40, 'c' * 40], 1700000000)
+        assert cache.node('https://host', 'platform/build', 'b' * 40) == ([], 1600000000)
+        assert cache.node('https://host', 'platform/art', 'a' * 40) is None
+        cache.close()
+
+
+def test_cache_changes():
+    with tempfile.TemporaryDirectory() as path:
+        cache = Cache({'cache': {'dir': path, 'size': 1}})
+        assert cache.change('https://host', 'a' * 40) is None
+
+        cache.put_changes('https://host', [('a' * 40, {'_number': 1, 'status': 'MERGED'}), ('b' * 40, None)])
+        cache.close()
+
+        cache = Cache({'cache': {'dir': path, 'size': 1}})
+        value, mtime = cache.change('https://host', 'a' * 40)
+        assert value == {'_number': 1, 'status': 'MERGED'}
+        assert mtime > 0
+        assert cache.change('https://host', 'b' * 40)[0] is None
+        assert cache.change('https://other', 'a' * 40) is None
+        cache.close()
+
+
+def test_cache_locked():
+    with tempfile.TemporaryDirectory() as path:
+        cache = Cache({'cache': {'dir': path}})
+        cache.put('https://host', 'repo', 'a' * 40, {'commit': 'a' * 40})
+        cache._db = _Locked(cache._db)
+
+        # Failed writes are skipped and leave no transaction open behind them
+        cache.put('https://host', 'repo', 'b' * 40, {'commit': 'b' * 40})
+        cache.put_nodes('https://host', 'repo', [('b' * 40, [], 1700000000)])
+        cache.put_changes('https://host', [('b' * 40, None)])
+        assert cache._db.in_transaction is False
+        # Reads still work while the access time cannot be updated
+        assert cache.get('https://host', 'repo', 'a' * 40) == {'commit': 'a' * 40}
+
+        cache._db.locked = False
+        cache.put_nodes('https://host', 'repo', [('b' * 40, [], 1700000000)])
+        cache.put_changes('https://host', [('b' * 40, None)])
+        assert cache.node('https://host', 'repo', 'b' * 40) == ([], 1700000000)
+        assert cache.change('https://host', 'b' * 40)[0] is None
+        assert cache.get('https://host', 'repo', 'a' * 40) == {'commit': 'a' * 40}
+        assert cache.get('https://host', 'repo', 'b' * 40) is None
+        cache.close()
+
+
+def test_cache_closed():
+    with tempfile.TemporaryDirectory() as path:
+        cache = Cache({'cache': {'dir': path}})
+        cache.close()
+
+        # A closed cache misses and skips writes instead of raising
+        assert cache.get('https://host', 'repo', 'a' * 40) is None
+        cache.put('https://host', 'repo', 'a' * 40, {'commit': 'a' * 40})
+        assert cache.node('https://host', 'repo', 'a' * 40) is None
+        cache.put_nodes('https://host', 'repo', [('a' * 40, [], 1700000000)])
+        assert cache.change('https://host', 'a' * 40) is None
+        cache.put_changes('https://host', [('a' * 40, None)])
@@ -72,3 +72,101 @@ def test_argument_parse_long_form_args():
     assert args.manifest2_file == 'manifest2.xml'
     assert args.output_file == 'output.json'
     assert args.recursion_depth == 5000
+
+
+def test_argument_parse_jobs():
+    """Test that jobs is optional and parsed as an integer"""
+    argument = Argument()
+    args = argument.parse([
+        'prog',
+        '-c', 'config.json',
+        '-m', 'manifest1.xml',
+        '-n', 'manifest2.xml',
+        '-o', 'output.json'
+    ])
+    assert args.jobs is None
+
+    args = argument.parse([
+        'prog',
+        '-c', 'config.json',
+        '-m', 'manifest1.xml',
+        '-n', 'manifest2.xml',
+        '-o', 'output.json',
+        '--jobs', '16'
+    ])
+    assert args.jobs == 16
+
+
+def test_argument_parse_no_cache():
+    """Test that no-cache is a flag defaulting to False"""
+    argument = Argument()
+    args = argument.parse([
+        'prog',
+        '-c', 'config.json',
+        '-m', 'manifest1.xml',
+        '-n', 'manifest2.xml',
+        '-o', 'output.json'
+    ])
+    assert args.no_cache is False
+
+    args = argument.parse([
+        'prog',
+        '-c', 'config.json',
+        '-m', 'manifest1.xml',
+        '-n', 'manifest2.xml',
+        '-o', 'output.json',
+        '--no-cache'
+    ])
+    assert args.no_cache is True
+
+
+def test_argument_parse_refresh_gerrit():
+    """Test that refresh-gerrit is a flag defaulting to False"""
+    argument = Argument()
+    args = argument.parse([
+        'prog',
+        '-c', 'config.json',
+        '-m', 'manifest1.xml',
+        '-n', 'manifest2.xml',
+        '-o', 'output.json'
+    ])
+    assert args.refresh_gerrit is False
+
+    args = argument.parse([
+        'prog',
+        '-c', 'config.json',
+        '-m', 'manifest1.xml',
+        '-n', 'manifest2.xml',
+        '-o', 'output.json',
+        '--refresh-gerrit'
+    ])
+    assert args.refresh_gerrit is True
+
+
+def test_argument_parse_engine():
+    """Test that engine defaults to sync and accepts async"""
+    argument = Argument()
+    argv = [
+        'prog',
+        '-c', 'config.json',
+        '-m', 'manifest1.xml',
+        '-n', 'manifest2.xml',
+        '-o', 'output.json'
+    ]
+    assert argument.parse(argv).engine == 'sync'
+    assert argument.parse(argv + ['-e', 'async']).engine == 'async'
+    assert argument.parse(argv + ['--engine', 'sync']).engine == 'sync'
+
+
+def test_argument_parse_metrics_file():
+    """Test that metrics-file is optional"""
+    argument = Argument()
+    argv = [
+        'prog',
+        '-c', 'config.json',
+        '-m', 'manifest1.xml',
+        '-n', 'manifest2.xml',
+        '-o', 'output.json'
+    ]
+    assert argument.parse(argv).metrics_file is None
+    assert argument.parse(argv + ['--metrics-file', 'metrics.json']).metrics_file == 'metrics.json'
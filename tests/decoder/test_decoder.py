@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest.mock
+
+import pytest
+
+from diffmanifests.decoder import decoder
+from diffmanifests.decoder.decoder import decode
+
+
+def _backends():
+    # The optional orjson backend when installed, and the stdlib one always
+    ret = [None]
+    if decoder.orjson is not None:
+        ret.append(decoder.orjson)
+    return ret
+
+
+def test_decode():
+    for backend in _backends():
+        with unittest.mock.patch.object(decoder, 'orjson', backend):
+            assert decode(b")]}'\n" + json.dumps({'log': [{'commit': 'abc123'}]}).encode()) == \
+                {'log': [{'commit': 'abc123'}]}
+            assert decode(b")]}'[1, 2]") == [1, 2]
+            assert decode(b'  {"next": null}\n') == {'next': None}
+            assert decode(")]}'\n[\"中文\"]") == ['中文']
+
+
+def test_decode_prefix_in_payload():
+    # Only the prefix at the start is skipped, the same text inside a message stays
+    data = b")]}'\n" + json.dumps([{'subject': "Revert \")]}'\" handling"}]).encode()
+    for backend in _backends():
+        with unittest.mock.patch.object(decoder, 'orjson', backend):
+            assert decode(data) == [{'subject': "Revert \")]}'\" handling"}]
+
+
+def test_decode_invalid():
+    for backend in _backends():
+        with unittest.mock.patch.object(decoder, 'orjson', backend):
+            for data in [b'', b")]}'", b")]}'\n[1] x", b'<html>']:
+                with pytest.raises(ValueError):
+                    decode(data)
@@ -293,3 +293,42 @@ def test_differ_missing_remote_key():
         assert False, "Should raise DifferException"
     except Exception as e:
         assert 'remote invalid' in str(e)
+
+
+def test_differ_duplicate_keys_keep_first():
+    """Projects sharing the same key resolve to the first one in the manifest"""
+    differ = Differ(None)
+
+    data1 = {
+        'manifest': {
+            'default': {'@revision': 'master'},
+            'remote': [{'@name': 'origin'}],
+            'project': [
+                {'@name': 'platform/a', '@path': 'dup', '@revision': 'r1'},
+                {'@name': 'platform/b', '@path': 'dup', '@revision': 'r2'}
+            ]
+        }
+    }
+
+    data2 = {
+        'manifest': {
+            'default': {'@revision': 'master'},
+            'remote': [{'@name': 'origin'}],
+            'project': [
+                {'@name': 'platform/a', '@path': 'dup', '@revision': 'r3'},
+                {'@name': 'platform/c', '@revision': 'r4'}
+            ]
+        }
+    }
+
+    buf = differ.run(data1, data2)
+    assert buf['update repo'] == {
+        'dup': [
+            {'name': 'platform/a', 'branch': 'master', 'commit': 'r1'},
+            {'name': 'platform/a', 'branch': 'master', 'commit': 'r3'}
+        ]
+    }
+    assert buf['add repo'] == {
+        'platform/c': [{}, {'name': 'platform/c', 'branch': 'master', 'commit': 'r4'}]
+    }
+    assert len(buf['remove repo']) == 0
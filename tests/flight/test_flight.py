@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+
+from diffmanifests.flight.flight import AsyncFlight, Flight
+from diffmanifests.metrics.metrics import Metrics
+
+
+def test_flight():
+    flight = Flight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return {'commit': 'abc123'}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', call)))
+    leader.start()
+    started.wait()
+
+    Metrics.enable()
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', call))) for _ in range(3)]
+    for item in followers:
+        item.start()
+    while Metrics.dump()['counters'].get('coalesced', 0) != 3:
+        pass
+    release.set()
+    for item in [leader] + followers:
+        item.join()
+    Metrics.disable()
+
+    assert len(calls) == 1
+    assert len(results) == 4
+    assert all(item is results[0] for item in results)
+
+    # The key is free again once the call is done
+    assert flight.do('key', lambda: 'again') == 'again'
+
+
+def test_flight_error():
+    flight = Flight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def call():
+        started.set()
+        release.wait()
+        raise ValueError('failed')
+
+    def run():
+        try:
+            flight.do('key', call)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=run)
+    leader.start()
+    started.wait()
+    Metrics.enable()
+    follower = threading.Thread(target=run)
+    follower.start()
+    while Metrics.dump()['counters'].get('coalesced', 0) != 1:
+        pass
+    release.set()
+    leader.join()
+    follower.join()
+    Metrics.disable()
+
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+
+def test_async_flight():
+    flight = AsyncFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'commit': 'abc123'}
+
+    async def failed():
+        await asyncio.sleep(0.01)
+        raise ValueError('failed')
+
+    async def run():
+        results = await asyncio.gather(*[flight.do('key', call) for _ in range(4)],
+                                       flight.do('other', call))
+        errors = await asyncio.gather(*[flight.do('key', failed) for _ in range(2)], return_exceptions=True)
+        return results, errors
+
+    results, errors = asyncio.run(run())
+
+    assert len(calls) == 2
+    assert all(item is results[0] for item in results[:4])
+    assert all(isinstance(item, ValueError) for item in errors)
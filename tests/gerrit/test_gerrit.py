@@ -71,12 +71,12 @@ def test_gerrit_hashtags_in_response():
         }
     ]
 
-    with unittest.mock.patch('requests.get') as mock_get:
+    with unittest.mock.patch('requests.Session.get') as mock_get:
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 200
         # Proper JSON formatting with Gerrit prefix
         import json
-        mock_response.text = ")]}\'\n" + json.dumps(mock_response_data)
+        mock_response.content = b")]}'\n" + json.dumps(mock_response_data).encode()
         mock_get.return_value = mock_response
 
         result = gerrit.query('commit:abc123', 0)
@@ -112,12 +112,12 @@ def test_gerrit_response_without_hashtags():
         "status": "NEW"
     }]
 
-    with unittest.mock.patch('requests.get') as mock_get:
+    with unittest.mock.patch('requests.Session.get') as mock_get:
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 200
         # Proper JSON formatting with Gerrit prefix
         import json
-        mock_response.text = ")]}\'\n" + json.dumps(mock_response_data)
+        mock_response.content = b")]}'\n" + json.dumps(mock_response_data).encode()
         mock_get.return_value = mock_response
 
         result = gerrit.query('commit:abc123', 0)
@@ -177,21 +177,20 @@ def test_gerrit_get_with_auth():
 
     gerrit = Gerrit(config)
 
-    with unittest.mock.patch('diffmanifests.gerrit.gerrit.requests.get') as mock_get:
+    with unittest.mock.patch('diffmanifests.gerrit.gerrit.requests.Session.get') as mock_get:
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 200
         import json
-        mock_response.text = ")]}'" + json.dumps({"_number": 123, "subject": "Test"})
+        mock_response.content = b")]}'" + json.dumps({"_number": 123, "subject": "Test"}).encode()
         mock_get.return_value = mock_response
 
         result = gerrit.get(123)
 
         assert result is not None
         assert result['_number'] == 123
-        # Verify auth was passed to requests.get
+        # Verify auth is sent by the session
         mock_get.assert_called_once()
-        call_args = mock_get.call_args
-        assert call_args[1]['auth'] == ('admin', 'password')
+        assert gerrit._session.auth == ('admin', 'password')
 
 
 def test_gerrit_get_failure():
@@ -209,7 +208,7 @@ def test_gerrit_get_failure():
 
     gerrit = Gerrit(config)
 
-    with unittest.mock.patch('requests.get') as mock_get:
+    with unittest.mock.patch('requests.Session.get') as mock_get:
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 404
         mock_get.return_value = mock_response
@@ -234,21 +233,20 @@ def test_gerrit_query_with_auth():
 
     gerrit = Gerrit(config)
 
-    with unittest.mock.patch('diffmanifests.gerrit.gerrit.requests.get') as mock_get:
+    with unittest.mock.patch('diffmanifests.gerrit.gerrit.requests.Session.get') as mock_get:
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 200
         import json
-        mock_response.text = ")]}'" + json.dumps([{"_number": 123, "subject": "Test"}])
+        mock_response.content = b")]}'" + json.dumps([{"_number": 123, "subject": "Test"}]).encode()
         mock_get.return_value = mock_response
 
         result = gerrit.query('status:open', 0)
 
         assert result is not None
         assert len(result) == 1
-        # Verify auth was passed to requests.get
+        # Verify auth is sent by the session
         mock_get.assert_called_once()
-        call_args = mock_get.call_args
-        assert call_args[1]['auth'] == ('admin', 'password')
+        assert gerrit._session.auth == ('admin', 'password')
 
 
 def test_gerrit_query_failure():
@@ -266,7 +264,7 @@ def test_gerrit_query_failure():
 
     gerrit = Gerrit(config)
 
-    with unittest.mock.patch('requests.get') as mock_get:
+    with unittest.mock.patch('requests.Session.get') as mock_get:
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 500
         mock_get.return_value = mock_response
@@ -274,3 +272,184 @@ def test_gerrit_query_failure():
         result = gerrit.query('status:open', 0)
 
         assert result is None
+
+
+def test_async_gerrit():
+    """Test the async client sends the same query parameters"""
+    import asyncio
+    import json
+
+    import pytest
+    aiohttp = pytest.importorskip('aiohttp')
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    from diffmanifests.gerrit.gerrit import AsyncGerrit
+
+    requested = []
+
+    async def handler(request):
+        if request.path.endswith('/detail'):
+            return web.Response(text=")]}'\n" + json.dumps({'_number': 1, 'status': 'MERGED'}))
+        requested.append((request.path, request.query.getall('o'), request.query['q'], request.query['start']))
+        if request.query['q'] == 'commit:missing':
+            return web.Response(status=400)
+        return web.Response(text=")]}'\n" + json.dumps([{'_number': 1}]))
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', handler)
+        async with TestServer(app) as server:
+            gerrit = AsyncGerrit({'gerrit': {
+                'query': {'option': ['CURRENT_REVISION', 'DETAILED_LABELS']},
+                'url': str(server.make_url('')).rstrip('/')
+            }})
+            async with aiohttp.ClientSession() as session:
+                gerrit.open(session)
+                assert await gerrit.query('commit:a OR commit:b', 100) == [{'_number': 1}]
+                assert await gerrit.query('commit:missing', 0) is None
+                assert await gerrit.get(1) == {'_number': 1, 'status': 'MERGED'}
+
+    asyncio.run(run())
+    assert requested[0] == ('/changes/', ['CURRENT_REVISION', 'DETAILED_LABELS'], 'commit:a OR commit:b', '100')
+
+
+def test_gerrit_query_retry():
+    """Test that Gerrit queries are retried on quota errors"""
+    config = {
+        "gerrit": {
+            "pass": "",
+            "query": {
+                "option": ["CURRENT_REVISION"]
+            },
+            "url": "https://android-review.googlesource.com",
+            "user": ""
+        },
+        "policy": {
+            "retries": 2
+        }
+    }
+
+    gerrit = Gerrit(config)
+
+    busy = unittest.mock.Mock()
+    busy.status_code = 429
+    busy.headers = {'Retry-After': '1'}
+    done = unittest.mock.Mock()
+    done.status_code = 200
+    done.headers = {}
+    done.content = b")]}'\n[{\"_number\": 123456}]"
+
+    with unittest.mock.patch('requests.Session.get', side_effect=[busy, done]) as mock_get, \
+            unittest.mock.patch('diffmanifests.policy.policy.time.sleep') as mock_sleep:
+        result = gerrit.query('commit:abc123', 0)
+
+    assert result == [{'_number': 123456}]
+    assert mock_get.call_count == 2
+    mock_sleep.assert_called_once_with(1.0)
+
+
+def test_gerrit_session():
+    """Test that Gerrit keeps one pooled session with timeout and retries"""
+    config = {
+        "gerrit": {
+            "pass": "",
+            "pool_connections": 0,
+            "pool_maxsize": 20,
+            "retry": 2,
+            "timeout": 30,
+            "url": "https://android-review.googlesource.com",
+            "user": ""
+        }
+    }
+
+    gerrit = Gerrit(config)
+    session = gerrit._session
+    adapter = session.get_adapter('https://android-review.googlesource.com')
+    assert adapter._pool_connections == 10
+    assert adapter._pool_maxsize == 20
+    assert adapter.max_retries.total == 2
+    assert session.auth is None
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'\n[]"
+        mock_get.return_value = mock_response
+
+        gerrit.query('commit:abc123', 0)
+        gerrit.get(123)
+
+        assert mock_get.call_count == 2
+        assert all(item[1]['timeout'] == 30 for item in mock_get.call_args_list)
+        assert gerrit._session is session
+
+    gerrit.close()
+
+
+def test_gerrit_error():
+    """Test that Gerrit records failed requests and raises"""
+    import pytest
+    import requests
+
+    from diffmanifests.metrics.metrics import Metrics
+
+    config = {
+        "gerrit": {
+            "url": "https://android-review.googlesource.com"
+        }
+    }
+
+    gerrit = Gerrit(config)
+
+    Metrics.enable()
+    with unittest.mock.patch('requests.Session.get', side_effect=requests.exceptions.Timeout()):
+        with pytest.raises(requests.exceptions.Timeout):
+            gerrit.query('commit:abc123', 0)
+    Metrics.disable()
+
+    assert Metrics.dump()['endpoints'][0]['status'] == {'error': 1}
+
+
+def test_gerrit_recall():
+    """Test merged changes are kept for good and other fields only for gerrit_ttl"""
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as path:
+        config = {
+            "cache": {
+                "dir": path,
+                "gerrit_ttl": 60
+            },
+            "gerrit": {
+                "url": "https://android-review.googlesource.com"
+            }
+        }
+
+        gerrit = Gerrit(config)
+        assert gerrit.recall('a' * 40, 'I' + '1' * 40) is None
+
+        merged = {'_number': 1, 'status': 'MERGED', 'topic': 'topic1', 'hashtags': ['tag1'], 'revisions': {}}
+        gerrit.keep([('a' * 40, 'I' + '1' * 40, merged),
+                     ('b' * 40, '', {'_number': 2, 'status': 'NEW'}),
+                     ('c' * 40, 'I' + '3' * 40, None)])
+
+        change, fresh = gerrit.recall('a' * 40, 'I' + '1' * 40)
+        assert change == {'_number': 1, 'status': 'MERGED', 'topic': 'topic1', 'hashtags': ['tag1']}
+        assert fresh is True
+        assert gerrit.recall('b' * 40, '') == ({'_number': 2, 'status': 'NEW'}, True)
+        assert gerrit.recall('c' * 40, 'I' + '3' * 40) == (None, True)
+        # Keyed by commit and Change-Id
+        assert gerrit.recall('a' * 40, '') is None
+
+        with unittest.mock.patch('diffmanifests.gerrit.gerrit.time.time', return_value=time.time() + 120):
+            assert gerrit.recall('a' * 40, 'I' + '1' * 40) == (change, False)
+            assert gerrit.recall('b' * 40, '') is None
+            assert gerrit.recall('c' * 40, 'I' + '3' * 40) is None
+        gerrit.close()
+
+        config['cache']['gerrit_refresh'] = True
+        gerrit = Gerrit(config)
+        assert gerrit.recall('a' * 40, 'I' + '1' * 40) is None
+        gerrit.close()
@@ -1,12 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import json
 import os
 import pprint
 import requests
+import threading
 import unittest.mock
 
 from diffmanifests.main import load
-from diffmanifests.gitiles.gitiles import Gitiles, GitilesException
+from diffmanifests.gitiles.gitiles import Gitiles, GitilesException, Pages, committed, epoch
 
 
 def test_exception():
@@ -157,13 +159,31 @@ def test_gitiles_commit_with_auth():
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 200
         import json
-        mock_response.text = ")]}'" + json.dumps({"commit": "abc123", "tree": "def456"})
+        mock_response.content = b")]}'" + json.dumps({"log": [{"commit": "abc123", "tree": "def456"}]}).encode()
         mock_get.return_value = mock_response
 
         result = gitiles.commit('platform/build', 'abc123def456')
 
         assert result is not None
         assert result['commit'] == 'abc123'
+        # Only the headers are fetched, with a one entry log
+        assert mock_get.call_args[1]['url'] == 'https://android.googlesource.com/platform/build/+log/abc123def456?n=1&format=JSON'
+
+
+def test_gitiles_commit_tree():
+    """Test Gitiles.commit() fetches the full commit with tree=True"""
+    import json
+
+    gitiles = Gitiles({'gitiles': {'url': 'https://android.googlesource.com'}})
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'" + json.dumps({'commit': 'abc123', 'tree_diff': []}).encode()
+        mock_get.return_value = mock_response
+
+        assert gitiles.commit('platform/build', 'abc123', tree=True)['tree_diff'] == []
+        assert mock_get.call_args[1]['url'] == 'https://android.googlesource.com/platform/build/+/abc123?format=JSON'
 
 
 def test_gitiles_commit_failure():
@@ -186,7 +206,8 @@ def test_gitiles_commits_failure():
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     gitiles = Gitiles(config)
 
-    with unittest.mock.patch('requests.Session.get') as mock_get:
+    with unittest.mock.patch('requests.Session.get') as mock_get, \
+            unittest.mock.patch('diffmanifests.policy.policy.time.sleep') as mock_sleep:
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 500
         mock_get.return_value = mock_response
@@ -194,6 +215,9 @@ def test_gitiles_commits_failure():
         result = gitiles.commits('platform/build', 'master', 'abc123')
 
         assert result is None
+        # Server errors are retried as configured before giving up
+        assert mock_get.call_count == config['policy']['retries'] + 1
+        assert mock_sleep.call_count == config['policy']['retries']
 
 
 def test_gitiles_with_empty_config():
@@ -222,13 +246,600 @@ def test_gitiles_commits_with_auth():
         mock_response = unittest.mock.Mock()
         mock_response.status_code = 200
         import json
-        mock_response.text = ")]}'" + json.dumps({
+        mock_response.content = b")]}'" + json.dumps({
             "log": [{"commit": "abc123", "message": "Test"}],
             "previous": "def456"
-        })
+        }).encode()
         mock_get.return_value = mock_response
 
         result = gitiles.commits('platform/build', 'master', 'abc123')
 
         assert result is not None
         assert len(result['log']) == 1
+
+
+def test_gitiles_session_reuse():
+    """Test that Gitiles reuses one pooled session across calls"""
+    config = {
+        'gitiles': {
+            'url': 'https://android.googlesource.com',
+            'user': 'test@example.com',
+            'pass': 'password',
+            'pool_connections': 4,
+            'pool_maxsize': 16,
+            'retry': 2,
+            'timeout': 30
+        }
+    }
+
+    gitiles = Gitiles(config)
+    session = gitiles._session
+
+    adapter = session.get_adapter('https://android.googlesource.com')
+    assert adapter._pool_connections == 4
+    assert adapter._pool_maxsize == 16
+    assert adapter.max_retries.total == 2
+    assert session.auth == ('test@example.com', 'password')
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        import json
+        mock_response.content = b")]}'" + json.dumps({"commit": "abc123", "log": []}).encode()
+        mock_get.return_value = mock_response
+
+        gitiles.commit('platform/build', 'abc123')
+        gitiles.commits('platform/build', 'master', 'abc123')
+
+        assert mock_get.call_count == 2
+        assert gitiles._session is session
+        assert gitiles.count('platform/build') == 2
+        assert gitiles.count('platform/art') == 0
+
+    gitiles.close()
+
+
+def test_gitiles_with_invalid_pool():
+    """Test that non-positive pool sizes fall back to the defaults"""
+    config = {
+        'gitiles': {
+            'url': 'https://android.googlesource.com',
+            'pool_connections': 0,
+            'pool_maxsize': -1
+        }
+    }
+
+    gitiles = Gitiles(config)
+    adapter = gitiles._session.get_adapter('https://android.googlesource.com')
+    assert adapter._pool_connections == 10
+    assert adapter._pool_maxsize == 10
+
+
+def test_gitiles_range():
+    """Test Gitiles.range() requests a range log and follows the start cursor"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    gitiles = Gitiles(config)
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        import json
+        mock_response.content = b")]}'" + json.dumps({"log": [{"commit": "def456"}], "next": "abc789"}).encode()
+        mock_get.return_value = mock_response
+
+        result = gitiles.range('platform/build', 'abc123', 'def456')
+        assert result['next'] == 'abc789'
+        assert mock_get.call_args[1]['url'] == gitiles.url() + '/platform/build/+log/abc123..def456/?format=JSON&n=50'
+
+        gitiles.range('platform/build', 'abc123', 'def456', 'abc789')
+        assert mock_get.call_args[1]['url'] == gitiles.url() + '/platform/build/+log/abc123..def456/?format=JSON&s=abc789&n=100'
+
+        mock_response.status_code = 404
+        assert gitiles.range('platform/build', 'abc123', 'fffffff') is None
+
+
+def test_gitiles_page():
+    """Test log pages start at page entries and double while a walk follows the cursors"""
+    import json
+
+    gitiles = Gitiles({'gitiles': {'page': 10, 'page_max': 30, 'url': 'https://android.googlesource.com'}})
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_get.return_value = mock_response
+
+        sizes = []
+        for start, cursor in [('sha0', 'sha1'), ('sha1', 'sha2'), ('sha2', 'sha3'), ('sha3', None)]:
+            mock_response.content = b")]}'" + json.dumps({'log': [{'commit': start}], 'next': cursor}).encode()
+            gitiles.commits('platform/build', 'master', start)
+            sizes.append(mock_get.call_args[1]['url'].split('&n=')[1])
+        assert sizes == ['10', '20', '30', '30']
+
+        # Walks that do not follow a cursor start over
+        gitiles.range('platform/build', 'sha0', 'sha3', 'sha9')
+        assert mock_get.call_args[1]['url'].endswith('&s=sha9&n=10')
+
+    gitiles = Gitiles({'gitiles': {'url': 'https://android.googlesource.com'}})
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'" + json.dumps({'log': [{'commit': 'sha0'}], 'next': 'sha1'}).encode()
+        mock_get.return_value = mock_response
+
+        gitiles.commits('platform/build', 'master', 'sha0')
+        gitiles.commits('platform/build', 'master', 'sha1')
+        assert '&n=' not in mock_get.call_args[1]['url']
+
+
+def test_gitiles_cache():
+    """Test commits are served from the on-disk cache across Gitiles instances"""
+    import json
+    import tempfile
+
+    sha1 = '1' * 40
+    sha2 = '2' * 40
+
+    with tempfile.TemporaryDirectory() as path:
+        config = {
+            'cache': {'dir': path},
+            'gitiles': {'url': 'https://android.googlesource.com'}
+        }
+
+        with unittest.mock.patch('requests.Session.get') as mock_get:
+            mock_response = unittest.mock.Mock()
+            mock_response.status_code = 200
+            mock_get.return_value = mock_response
+
+            gitiles = Gitiles(config)
+            mock_response.content = b")]}'" + json.dumps({'log': [{'commit': sha1, 'message': 'one'}]}).encode()
+            assert gitiles.commit('platform/build', sha1)['message'] == 'one'
+            mock_response.content = b")]}'" + json.dumps({'log': [{'commit': sha2, 'message': 'two'}]}).encode()
+            gitiles.commits('platform/build', 'master', sha2)
+            assert mock_get.call_count == 2
+            gitiles.close()
+
+            gitiles = Gitiles(config)
+            assert gitiles.commit('platform/build', sha1)['message'] == 'one'
+            assert gitiles.commit('platform/build', sha2)['message'] == 'two'
+            assert mock_get.call_count == 2
+
+            # Abbreviated SHAs and other repos are not answered from the cache
+            mock_response.content = b")]}'" + json.dumps({'log': [{'commit': sha1, 'message': 'one'}]}).encode()
+            gitiles.commit('platform/build', sha1[:7])
+            gitiles.commit('platform/art', sha1)
+            assert mock_get.call_count == 4
+            gitiles.close()
+
+
+def test_gitiles_cache_range():
+    """Test range logs between full SHAs are cached, branch names are not"""
+    import json
+    import tempfile
+
+    sha1 = '1' * 40
+    sha2 = '2' * 40
+
+    with tempfile.TemporaryDirectory() as path:
+        config = {
+            'cache': {'dir': path},
+            'gitiles': {'url': 'https://android.googlesource.com'}
+        }
+        gitiles = Gitiles(config)
+
+        with unittest.mock.patch('requests.Session.get') as mock_get:
+            mock_response = unittest.mock.Mock()
+            mock_response.status_code = 200
+            mock_response.content = b")]}'" + json.dumps({'log': [{'commit': sha2}]}).encode()
+            mock_get.return_value = mock_response
+
+            gitiles.range('platform/build', sha1, sha2)
+            gitiles.range('platform/build', sha1, sha2)
+            assert mock_get.call_count == 1
+
+            gitiles.range('platform/build', sha1, 'master')
+            gitiles.range('platform/build', sha1, 'master')
+            assert mock_get.call_count == 3
+
+        gitiles.close()
+
+
+def test_async_gitiles():
+    """Test the async client against a local aiohttp server"""
+    import asyncio
+    import json
+
+    import pytest
+    aiohttp = pytest.importorskip('aiohttp')
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+
+    from diffmanifests.gitiles.gitiles import AsyncGitiles
+
+    requested = []
+
+    async def handler(request):
+        requested.append(request.path_qs)
+        if 'missing' in request.path:
+            return web.Response(status=404)
+        if request.query.get('n', None) == '1':
+            return web.Response(text=")]}'\n" + json.dumps({'log': [{'commit': 'a' * 40}]}))
+        if '/+log/' in request.path:
+            return web.Response(text=")]}'\n" + json.dumps({'log': [{'commit': 'b' * 40}]}))
+        return web.Response(text=")]}'\n" + json.dumps({'commit': 'a' * 40}))
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', handler)
+        async with TestServer(app) as server:
+            gitiles = AsyncGitiles({'gitiles': {'url': str(server.make_url('/'))}})
+            async with aiohttp.ClientSession() as session:
+                gitiles.open(session)
+                assert (await gitiles.commit('platform/build', 'a' * 40))['commit'] == 'a' * 40
+                assert (await gitiles.commits('platform/build', 'master', 'a' * 40))['log'][0]['commit'] == 'b' * 40
+                assert (await gitiles.range('platform/build', 'a' * 40, 'master', 'c' * 40)) is not None
+                assert (await gitiles.commit('platform/missing', 'a' * 40)) is None
+            gitiles.close()
+            return gitiles
+
+    gitiles = asyncio.run(run())
+    assert requested == [
+        '/platform/build/+log/%s?n=1&format=JSON' % ('a' * 40),
+        '/platform/build/+log/master/?s=%s&format=JSON' % ('a' * 40),
+        '/platform/build/+log/%s..master/?format=JSON&s=%s' % ('a' * 40, 'c' * 40),
+        '/platform/missing/+log/%s?n=1&format=JSON' % ('a' * 40)
+    ]
+    assert gitiles.count('platform/build') == 3
+
+
+def test_async_gitiles_without_aiohttp():
+    """Test the async client reports a missing aiohttp"""
+    import pytest
+
+    from diffmanifests.gitiles.gitiles import AsyncGitiles
+
+    with unittest.mock.patch('diffmanifests.gitiles.gitiles.aiohttp', None):
+        with pytest.raises(GitilesException):
+            AsyncGitiles({'gitiles': {'url': 'https://android.googlesource.com'}})
+
+
+def test_gitiles_metrics():
+    """Test requests are recorded per endpoint and repo when metrics are enabled"""
+    from diffmanifests.metrics.metrics import Metrics
+
+    config = {'gitiles': {'url': 'https://android.googlesource.com'}}
+    gitiles = Gitiles(config)
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'{\"log\": []}"
+        mock_get.return_value = mock_response
+
+        Metrics.enable()
+        try:
+            gitiles.commits('platform/build', 'master', 'abc123')
+            gitiles.range('platform/build', 'abc123', 'def456')
+            mock_response.status_code = 404
+            gitiles.commit('platform/build', 'abc123')
+            data = Metrics.dump()
+        finally:
+            Metrics.disable()
+
+    assert [(item['endpoint'], item['count'], item['status']) for item in data['endpoints']] == [
+        ('header', 1, {'404': 1}), ('log', 1, {'200': 1}), ('range', 1, {'200': 1})
+    ]
+    assert data['endpoints'][1]['bytes'] == len(mock_response.content)
+    assert data['repos'][0]['count'] == 3
+
+
+def test_gitiles_memo():
+    """Test repeated commit and log fetches in one run are served from the memo"""
+    import json
+
+    from diffmanifests.metrics.metrics import Metrics
+
+    config = {'gitiles': {'url': 'https://android.googlesource.com'}}
+    gitiles = Gitiles(config)
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'" + json.dumps({'log': [{'commit': 'abc123'}, {'commit': 'abc122'}], 'next': 'abc121'}).encode()
+        mock_get.return_value = mock_response
+
+        Metrics.enable()
+        try:
+            assert gitiles.commits('platform/build', 'master', 'abc123')['next'] == 'abc121'
+            assert gitiles.commits('platform/build', 'master', 'abc123')['next'] == 'abc121'
+            # Log entries answer commit() as well
+            assert gitiles.commit('platform/build', 'abc122') == {'commit': 'abc122'}
+            assert mock_get.call_count == 1
+
+            # Other repos, refs and commits are fetched
+            gitiles.commits('platform/art', 'master', 'abc123')
+            gitiles.commits('platform/build', 'refs/heads/master', 'abc123')
+            assert mock_get.call_count == 3
+
+            # Missing objects are remembered, server errors are not
+            mock_response.status_code = 404
+            assert gitiles.commit('platform/build', 'missing') is None
+            assert gitiles.commit('platform/build', 'missing') is None
+            assert mock_get.call_count == 4
+            mock_response.status_code = 500
+            assert gitiles.commit('platform/build', 'broken') is None
+            assert gitiles.commit('platform/build', 'broken') is None
+            assert mock_get.call_count == 6
+
+            counters = Metrics.dump()['counters']
+        finally:
+            Metrics.disable()
+
+    assert counters['memo_hit'] == 3
+    assert counters['memo_miss'] == 6
+
+
+def test_gitiles_memo_bounded():
+    """Test the memo keeps only the most recently used entries"""
+    import json
+
+    gitiles = Gitiles({'gitiles': {'memo': 2, 'url': 'https://android.googlesource.com'}})
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'" + json.dumps({'log': [{'commit': 'abc123'}]}).encode()
+        mock_get.return_value = mock_response
+
+        gitiles.commit('platform/build', 'sha1')
+        gitiles.commit('platform/build', 'sha2')
+        gitiles.commit('platform/build', 'sha1')
+        gitiles.commit('platform/build', 'sha3')
+        assert mock_get.call_count == 3
+        gitiles.commit('platform/build', 'sha1')
+        assert mock_get.call_count == 3
+        gitiles.commit('platform/build', 'sha2')
+        assert mock_get.call_count == 4
+
+    gitiles = Gitiles({'gitiles': {'memo': 0, 'url': 'https://android.googlesource.com'}})
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'" + json.dumps({'log': [{'commit': 'abc123'}]}).encode()
+        mock_get.return_value = mock_response
+
+        gitiles.commit('platform/build', 'sha1')
+        gitiles.commit('platform/build', 'sha1')
+        assert mock_get.call_count == 2
+
+
+def _gated(content):
+    # Session.get mock that holds the first request until release is set, so that the
+    # followers are known to wait on it before it returns
+    started = threading.Event()
+    release = threading.Event()
+
+    def get(*args, **kwargs):
+        started.set()
+        release.wait()
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'" + json.dumps(content).encode()
+        return mock_response
+
+    return get, started, release
+
+
+def _overlap(call, started, release):
+    # Run call() on a leader and three followers that join its request in flight
+    from diffmanifests.metrics.metrics import Metrics
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=call) for _ in range(3)]
+    for item in followers:
+        item.start()
+    while Metrics.dump()['counters'].get('coalesced', 0) != 3:
+        pass
+    release.set()
+    for item in [leader] + followers:
+        item.join()
+
+
+def test_gitiles_single_flight():
+    """Test concurrent requests for the same commit share one request"""
+    from diffmanifests.metrics.metrics import Metrics
+
+    gitiles = Gitiles({'gitiles': {'memo': 0, 'url': 'https://android.googlesource.com'}})
+    get, started, release = _gated({'log': [{'commit': 'abc123'}]})
+
+    results = []
+    Metrics.enable()
+    try:
+        with unittest.mock.patch('requests.Session.get', side_effect=get) as mock_get:
+            _overlap(lambda: results.append(gitiles.commit('platform/build', 'abc123')), started, release)
+    finally:
+        Metrics.disable()
+
+    assert mock_get.call_count == 1
+    assert gitiles.count('platform/build') == 1
+    assert len(results) == 4
+    assert all(item is results[0] for item in results)
+
+
+def test_gitiles_single_flight_keeps_once():
+    """Test a page shared by concurrent walks is counted and cached once"""
+    import tempfile
+
+    from diffmanifests.metrics.metrics import Metrics
+
+    get, started, release = _gated({'log': [{'commit': 'a' * 40}, {'commit': 'b' * 40}]})
+
+    with tempfile.TemporaryDirectory() as path:
+        gitiles = Gitiles({'cache': {'dir': path}, 'gitiles': {'memo': 0, 'url': 'https://android.googlesource.com'}})
+        Metrics.enable()
+        try:
+            with unittest.mock.patch('requests.Session.get', side_effect=get) as mock_get, \
+                    unittest.mock.patch.object(gitiles._cache, 'put', wraps=gitiles._cache.put) as mock_put:
+                _overlap(lambda: gitiles.range('platform/build', 'c' * 40, 'a' * 40), started, release)
+        finally:
+            Metrics.disable()
+        gitiles.close()
+
+    counters = Metrics.dump()['counters']
+    assert mock_get.call_count == 1
+    assert counters['log_pages'] == 1
+    assert counters['log_entries'] == 2
+    # Two log entries and the range page itself
+    assert mock_put.call_count == 3
+
+
+def test_gitiles_refs():
+    """Test refs are listed once per repo"""
+    import json
+
+    gitiles = Gitiles({'gitiles': {'url': 'https://android.googlesource.com'}})
+
+    with unittest.mock.patch('requests.Session.get') as mock_get:
+        mock_response = unittest.mock.Mock()
+        mock_response.status_code = 200
+        mock_response.content = b")]}'" + json.dumps({'refs/heads/master': {'value': 'abc123'}}).encode()
+        mock_get.return_value = mock_response
+
+        assert gitiles.refs('platform/build') == {'refs/heads/master': {'value': 'abc123'}}
+        assert gitiles.refs('platform/build') == {'refs/heads/master': {'value': 'abc123'}}
+        mock_get.assert_called_once_with(url='https://android.googlesource.com/platform/build/+refs?format=JSON',
+                                         timeout=None)
+
+    # Spellings are only kept with a cache
+    assert gitiles.spelling('platform/build', 'v1.0') is None
+    gitiles.learn('platform/build', 'v1.0', 'refs/tags/v1.0')
+    assert gitiles.spelling('platform/build', 'v1.0') is None
+
+
+def test_epoch():
+    """Test committer times are parsed to epoch seconds"""
+    import pytest
+
+    assert epoch('Mon Jan 01 12:00:00 2024 +0000') == 1704110400
+    assert epoch('Mon Jan 01 20:00:00 2024 +0800') == 1704110400
+    assert epoch('Mon Jan 01 07:30:00 2024 -0430') == 1704110400
+    assert epoch('周一 1月 01 12:00:00 2024 +0000') == 1704110400
+    assert epoch('周二 12月 31 23:59:59 2024 +0000') == 1735689599
+
+    with pytest.raises(ValueError):
+        epoch('Mon Foo 01 12:00:00 2024 +0000')
+    with pytest.raises(ValueError):
+        epoch('2024-01-01T12:00:00Z')
+
+
+def test_committed():
+    """Test the committer epoch is parsed once and kept on the commit"""
+    commit = {'committer': {'time': 'Mon Jan 01 12:00:00 2024 +0000'}}
+    assert committed(commit) == 1704110400
+    assert commit['_epoch'] == 1704110400
+
+    with unittest.mock.patch('diffmanifests.gitiles.gitiles.epoch') as mock_epoch:
+        assert committed(commit) == 1704110400
+        mock_epoch.assert_not_called()
+
+
+def test_gitiles_node():
+    """Test fetched commits are added to the commit graph and kept in the cache"""
+    import json
+    import tempfile
+
+    sha1 = 'a' * 40
+    sha2 = 'b' * 40
+    time = 'Mon Jan 01 12:00:00 2024 +0000'
+
+    with tempfile.TemporaryDirectory() as path:
+        config = {'cache': {'dir': path}, 'gitiles': {'url': 'https://android.googlesource.com'}}
+        gitiles = Gitiles(config)
+
+        with unittest.mock.patch('requests.Session.get') as mock_get:
+            mock_response = unittest.mock.Mock()
+            mock_response.status_code = 200
+            mock_response.content = b")]}'" + json.dumps({'log': [
+                {'commit': sha2, 'parents': [sha1], 'committer': {'time': time}},
+                {'commit': sha1, 'parents': [], 'committer': {'time': time}},
+                {'commit': 'abc123', 'parents': [], 'committer': {'time': time}}
+            ]}).encode()
+            mock_get.return_value = mock_response
+            assert gitiles.node('platform/build', sha2) is None
+            gitiles.commits('platform/build', 'master', sha2)
+
+        assert gitiles.node('platform/build', sha2) == ([sha1], 1704110400)
+        assert gitiles.node('platform/build', sha1) == ([], 1704110400)
+        # Abbreviated commits are not part of the graph
+        assert gitiles.node('platform/build', 'abc123') is None
+        gitiles.close()
+
+        gitiles = Gitiles(config)
+        assert gitiles.node('platform/build', sha2) == ([sha1], 1704110400)
+        assert gitiles.node('platform/art', sha2) is None
+        gitiles.close()
+
+
+def test_pages():
+    """Test log pages are returned in order with and without fetching ahead"""
+    def fetch(start):
+        index = start if start is not None else 0
+        calls.append(index)
+        return {'log': [{'commit': 'sha%d' % index}], 'next': index + 1} if index < 5 else {'log': []}
+
+    for depth in [0, 1, 3]:
+        calls = []
+        pages = Pages(fetch, depth=depth)
+        assert [len(page['log']) for page in pages] == [1, 1, 1, 1, 1, 0]
+        assert calls == [0, 1, 2, 3, 4, 5]
+        pages.close()
+
+    # A page fetched before is not fetched again
+    calls = []
+    pages = Pages(fetch, depth=1, first={'log': [], 'next': 4})
+    assert list(pages) == [{'log': [], 'next': 4}, {'log': [{'commit': 'sha4'}], 'next': 5}, {'log': []}]
+    assert calls == [4, 5]
+
+    # The walk stops at a missing page
+    pages = Pages(lambda start: None if start == 2 else {'log': [], 'next': (start or 0) + 1}, depth=1)
+    assert list(pages) == [{'log': [], 'next': 1}, {'log': [], 'next': 2}, None]
+
+
+def test_pages_close():
+    """Test fetching ahead stops once the walk is closed and errors reach the walk"""
+    import time
+
+    import pytest
+
+    calls = []
+
+    def fetch(start):
+        calls.append(start)
+        return {'log': [], 'next': (start or 0) + 1}
+
+    pages = Pages(fetch, depth=2)
+    next(pages)
+    next(pages)
+    pages.close()
+    time.sleep(0.3)
+    # The first two pages plus at most two pages ahead
+    assert len(calls) <= 4
+    count = len(calls)
+    time.sleep(0.3)
+    assert len(calls) == count
+
+    def failure(start):
+        if start is not None:
+            raise requests.exceptions.ConnectionError('failure')
+        return {'log': [], 'next': 1}
+
+    pages = Pages(failure, depth=1)
+    next(pages)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        next(pages)
+    pages.close()
+
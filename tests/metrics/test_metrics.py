@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+
+import pytest
+
+from diffmanifests.metrics.metrics import Metrics, MetricsException
+
+
+def test_exception():
+    exception = MetricsException('exception')
+    assert str(exception) == 'exception'
+
+
+def test_metrics_disabled():
+    Metrics.disable()
+    Metrics.reset()
+    Metrics.count('cache_hit')
+    Metrics.request('gitiles', 'commit', 'platform/build', 200, 100, 0.01)
+    with Metrics.phase('query'):
+        pass
+    assert Metrics.dump() == {'counters': {}, 'endpoints': [], 'phases': {}, 'repos': []}
+
+
+def test_metrics_request():
+    Metrics.enable()
+    try:
+        Metrics.request('gitiles', 'commit', 'platform/build', 200, 100, 0.003)
+        Metrics.request('gitiles', 'commit', 'platform/build', 404, 0, 0.2)
+        Metrics.request('gitiles', 'range', 'platform/art', 200, 50, 20.0)
+        Metrics.request('gerrit', 'query', '', 200, 10, 0.01)
+        Metrics.count('cache_hit')
+        Metrics.count('cache_hit', 2)
+        data = Metrics.dump()
+    finally:
+        Metrics.disable()
+
+    assert data['counters'] == {'cache_hit': 3}
+    assert [(item['service'], item['endpoint']) for item in data['endpoints']] == [
+        ('gerrit', 'query'), ('gitiles', 'commit'), ('gitiles', 'range')
+    ]
+    commit = data['endpoints'][1]
+    assert commit['count'] == 2
+    assert commit['bytes'] == 100
+    assert commit['status'] == {'200': 1, '404': 1}
+    assert commit['buckets']['0.005'] == 1
+    assert commit['buckets']['0.25'] == 1
+    assert sum(commit['buckets'].values()) == 2
+    assert data['endpoints'][2]['buckets']['+Inf'] == 1
+    # Gerrit queries are not tied to one repo
+    assert [(item['service'], item['repo'], item['count']) for item in data['repos']] == [
+        ('gitiles', 'platform/art', 1), ('gitiles', 'platform/build', 2)
+    ]
+
+
+def test_metrics_phase():
+    Metrics.enable()
+    try:
+        with Metrics.phase('load'):
+            pass
+        with Metrics.phase('load'):
+            pass
+        with pytest.raises(ValueError):
+            with Metrics.phase('query'):
+                raise ValueError('query')
+        data = Metrics.dump()
+    finally:
+        Metrics.disable()
+
+    assert sorted(data['phases'].keys()) == ['load', 'query']
+
+
+def test_metrics_prometheus():
+    Metrics.enable()
+    try:
+        Metrics.request('gitiles', 'log', 'platform/"build"', 200, 100, 0.02)
+        with Metrics.phase('print'):
+            pass
+        buf = Metrics.prometheus()
+    finally:
+        Metrics.disable()
+
+    lines = buf.splitlines()
+    assert 'diffmanifests_requests_total{endpoint="log",service="gitiles",status="200"} 1' in lines
+    assert 'diffmanifests_response_bytes_total{endpoint="log",service="gitiles"} 100' in lines
+    assert 'diffmanifests_request_duration_seconds_bucket{endpoint="log",le="0.01",service="gitiles"} 0' in lines
+    assert 'diffmanifests_request_duration_seconds_bucket{endpoint="log",le="0.025",service="gitiles"} 1' in lines
+    assert 'diffmanifests_request_duration_seconds_bucket{endpoint="log",le="+Inf",service="gitiles"} 1' in lines
+    assert 'diffmanifests_request_duration_seconds_count{endpoint="log",service="gitiles"} 1' in lines
+    assert 'diffmanifests_repo_requests_total{repo="platform/\\"build\\"",service="gitiles"} 1' in lines
+    assert any(item.startswith('diffmanifests_phase_seconds{phase="print"} ') for item in lines)
+
+
+def test_metrics_write():
+    Metrics.enable()
+    try:
+        Metrics.request('gitiles', 'commit', 'platform/build', 200, 100, 0.01)
+        with tempfile.TemporaryDirectory() as path:
+            Metrics.write(os.path.join(path, 'metrics.json'))
+            with open(os.path.join(path, 'metrics.json'), 'r') as f:
+                assert json.load(f)['endpoints'][0]['count'] == 1
+            with open(os.path.join(path, 'metrics.prom'), 'r') as f:
+                assert 'diffmanifests_requests_total' in f.read()
+
+            with pytest.raises(MetricsException):
+                Metrics.write(os.path.join(path, 'missing', 'metrics.json'))
+    finally:
+        Metrics.disable()
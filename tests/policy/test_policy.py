@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import email.utils
+import time
+import unittest.mock
+
+import pytest
+
+from diffmanifests.policy.policy import Policy, PolicyException
+
+
+def _response(status, after=None):
+    response = unittest.mock.Mock()
+    response.status_code = status
+    response.headers = {'Retry-After': after} if after is not None else {}
+    return response
+
+
+def test_exception():
+    exception = PolicyException('exception')
+    assert str(exception) == 'exception'
+
+
+def test_policy_invalid_config():
+    with pytest.raises(PolicyException):
+        Policy(None)
+
+
+def test_policy_delay():
+    policy = Policy({'policy': {'burst': 2, 'rate': 10}})
+
+    assert policy.delay('https://android.googlesource.com/platform/build') == 0
+    assert policy.delay('https://android.googlesource.com/platform/art') == 0
+    # The bucket is empty, so the third request waits for a token
+    assert 0.05 < policy.delay('https://android.googlesource.com/platform/build') <= 0.1
+    # Hosts have buckets of their own
+    assert policy.delay('https://android-review.googlesource.com/changes/') == 0
+    assert policy.counts() == {'throttled': 1}
+
+    # No rate limit by default
+    policy = Policy({})
+    for _ in range(100):
+        assert policy.delay('https://android.googlesource.com') == 0
+
+
+def test_policy_retry():
+    policy = Policy({'policy': {'backoff': 1, 'backoff_max': 4, 'retries': 3}})
+    url = 'https://android.googlesource.com'
+
+    assert policy.retry(url, 404, 0) is None
+    assert 0 <= policy.retry(url, 503, 0) <= 1
+    assert 0 <= policy.retry(url, 503, 2) <= 4
+    assert policy.retry(url, 503, 3) is None
+
+    # Retry-After in seconds or as an HTTP date
+    assert policy.retry(url, 429, 0, '3') == 3
+    after = email.utils.formatdate(time.time() + 3, usegmt=True)
+    assert 0 < policy.retry(url, 429, 0, after) <= 3
+
+    # Retry-After beyond backoff_max gives up instead of holding the worker
+    assert policy.retry(url, 429, 0, '3600') is None
+    after = email.utils.formatdate(time.time() + 60, usegmt=True)
+    assert policy.retry(url, 503, 0, after) is None
+
+    assert policy.counts() == {'retry_429': 2, 'retry_5xx': 2, 'retry_failed': 3}
+
+
+def test_policy_retry_budget():
+    policy = Policy({'policy': {'budget': 2, 'retries': 5}})
+    url = 'https://android.googlesource.com'
+
+    assert policy.retry(url, 500, 0) is not None
+    assert policy.retry(url, 500, 0) is not None
+    assert policy.retry(url, 500, 0) is None
+    assert policy.counts()['retry_exhausted'] == 1
+
+
+def test_policy_send():
+    policy = Policy({'policy': {'retries': 3}})
+    responses = [_response(429, '2'), _response(502), _response(200)]
+
+    with unittest.mock.patch('diffmanifests.policy.policy.time.sleep') as mock_sleep:
+        response = policy.send('https://android.googlesource.com', lambda: responses.pop(0))
+
+    assert response.status_code == 200
+    assert mock_sleep.call_count == 2
+    assert mock_sleep.call_args_list[0][0][0] == 2
+
+
+def test_policy_asend():
+    policy = Policy({'policy': {'retries': 3}})
+    responses = [_response(503, '1'), _response(200)]
+
+    async def request():
+        return responses.pop(0)
+
+    with unittest.mock.patch('diffmanifests.policy.policy.asyncio.sleep', new_callable=unittest.mock.AsyncMock) \
+            as mock_sleep:
+        response = asyncio.run(policy.asend('https://android.googlesource.com', request))
+
+    assert response.status_code == 200
+    mock_sleep.assert_awaited_once_with(1.0)
+    assert policy.counts() == {'retry_5xx': 1}
@@ -144,3 +144,44 @@ def test_printer_format_method():
     assert '.json' in formats
     assert '.txt' in formats
     assert '.xlsx' in formats
+
+
+def test_printer_xlsx_content():
+    """Test xlsx output keeps header, styles, frozen panes and strips illegal characters"""
+    import openpyxl
+
+    printer = Printer(None)
+    buf = [
+        {
+            Commit.AUTHOR: 'Test User <test@example.com>',
+            Commit.BRANCH: 'master',
+            Commit.COMMIT: 'ab9c7e6d04c896ddcbfc2e3bc99ab00e6a892288',
+            Commit.DATE: 'Tue Feb 18 23:29:44 2020 -0800',
+            Commit.DIFF: Label.ADD_COMMIT.upper(),
+            Commit.MESSAGE: 'Fix\x01crash\x1b\n\nBug: 123',
+            Commit.REPO: 'platform/build',
+            Commit.URL: 'https://android.googlesource.com/platform/build/+/ab9c7e6d04c896ddcbfc2e3bc99ab00e6a892288',
+            Commit.CHANGE: 'https://android-review.googlesource.com/1000000',
+            Commit.COMMITTER: 'Test User <test@example.com>',
+            Commit.TOPIC: ''
+        }
+    ]
+
+    name = 'output_content.xlsx'
+    printer.run(buf, name)
+    wb = openpyxl.load_workbook(name)
+    ws = wb.active
+    os.remove(name)
+
+    assert [cell.value for cell in ws[1]] == [
+        'DIFF', 'REPO', 'BRANCH', 'AUTHOR', 'DATE', 'COMMIT', 'MESSAGE', 'URL', 'CHANGE', 'COMMITTER', 'TOPIC'
+    ]
+    assert ws['A1'].font.bold is True
+    assert ws['A1'].alignment.horizontal == 'center'
+    assert ws['A1'].alignment.shrink_to_fit is True
+    assert ws['G2'].value == 'Fix crash \n\nBug: 123'
+    assert ws['G2'].font.bold is False
+    assert ws['G2'].font.name == 'Calibri'
+    assert ws['G2'].alignment.vertical == 'center'
+    assert ws.freeze_panes == 'B2'
+    assert ws.max_row == 2
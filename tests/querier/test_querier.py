@@ -2,6 +2,7 @@
 
 import os
 import pprint
+import pytest
 import requests
 import unittest.mock
 
@@ -566,6 +567,8 @@ def test_commit1_fallback_to_commit_hash():
     """Test _commit1 fallback logic when branch query returns no commits"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # No +refs listing, so every ref spelling is probed in order
+    querier.gitiles.refs = unittest.mock.Mock(return_value=None)
 
     repo = 'zte/vendor/zte/zte_fastmmi'
     commit1 = {
@@ -594,12 +597,14 @@ def test_commit1_fallback_to_commit_hash():
                     {'commit': '7eb4bc92a52ec944badf96a7192d884eb04e9c4c'}
                 ]
             }
-        # Check if ec5731be exists in commit1 - no (with variants)
-        if commit_arg == 'ec5731bebfad7a44666da5b6a5deb3a2b27d9eaa':
-            return {'log': []}
-        # Check if 7eb4bc92 exists in commit1 - yes
-        if commit_arg == '7eb4bc92a52ec944badf96a7192d884eb04e9c4c':
-            return {'log': [{'commit': '7eb4bc92a52ec944badf96a7192d884eb04e9c4c'}]}
+        # commit1's history on its branch reaches 7eb4bc92 but not ec5731be
+        if branch_arg == commit1['branch'] and commit_arg == commit1['commit']:
+            return {
+                'log': [
+                    {'commit': '7daac874f76aaba85b687bde7e21d38082ee5ddf'},
+                    {'commit': '7eb4bc92a52ec944badf96a7192d884eb04e9c4c'}
+                ]
+            }
         return {'log': []}
 
     with unittest.mock.patch.object(querier.gitiles, 'commits', side_effect=mock_commits_func):
@@ -622,6 +627,8 @@ def test_commit1_branch_variants_heads_and_tags():
     """_commit1 should try refs/heads/ and refs/tags/ when plain branch fails."""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # No +refs listing, so every ref spelling is probed in order
+    querier.gitiles.refs = unittest.mock.Mock(return_value=None)
 
     repo = 'Business/HeartyService/HeartyService-HeartyService'
     commit1 = { 'branch': 'storage_cleanup', 'commit': 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa' }
@@ -636,10 +643,10 @@ def test_commit1_branch_variants_heads_and_tags():
             return None
         # Succeed for refs/heads on commit2 branch
         if branch_arg == f"refs/heads/{commit2['branch']}":
-            return { 'log': [ { 'commit': commit2['commit'] } ], 'next': None }
-        # Also allow refs/heads on commit1 branch for intersection check
+            return { 'log': [ { 'commit': commit2['commit'] }, { 'commit': 'cccccccccccccccccccccccccccccccccccccccc' } ], 'next': None }
+        # Also allow refs/heads on commit1 branch, whose history is shared with commit2
         if branch_arg == f"refs/heads/{commit1['branch']}":
-            return { 'log': [ { 'commit': commit_arg } ] }
+            return { 'log': [ { 'commit': commit1['commit'] }, { 'commit': 'cccccccccccccccccccccccccccccccccccccccc' } ] }
         # Not needed, but simulate tags failing
         return None
 
@@ -662,6 +669,8 @@ def test_get_commits_with_variants_helper():
     """Direct test of _get_commits_with_variants branch fallback sequencing."""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # No +refs listing, so every ref spelling is probed in order
+    querier.gitiles.refs = unittest.mock.Mock(return_value=None)
 
     repo = 'test/repo'
     branch = 'NebulaOS1.0_V_TA_20250312'
@@ -731,8 +740,8 @@ def test_commit1_uses_branch_for_history_lookup():
                 'next': None
             }
         # Second call should query commit1's history using its branch
-        if commit_arg == 'ancestorhash' and branch_arg == commit1['branch']:
-            return {'log': [{'commit': 'ancestorhash'}]}
+        if commit_arg == commit1['commit'] and branch_arg == commit1['branch']:
+            return {'log': [{'commit': commit1['commit']}, {'commit': 'ancestorhash'}]}
         return {'log': []}
 
     with unittest.mock.patch.object(querier.gitiles, 'commits', side_effect=mock_commits):
@@ -763,6 +772,8 @@ def test_commit1_both_branch_and_hash_fail():
     """Test _commit1 when both branch and commit hash queries fail"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # No +refs listing, so every ref spelling is probed in order
+    querier.gitiles.refs = unittest.mock.Mock(return_value=None)
 
     repo = 'test/repo'
     commit1 = {
@@ -792,6 +803,8 @@ def test_diff_fallback_with_commit_hash_branch():
     """Test _diff fallback logic when _commits fails with branch but succeeds with commit hash"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # Range logs are unavailable, so _diff falls back to walking the history
+    querier.gitiles.range = unittest.mock.Mock(return_value=None)
 
     repo = 'test/repo'
     commit1 = {
@@ -840,6 +853,8 @@ def test_diff_no_common_commit_fallback():
     """Test _diff fallback when no common commit is found"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # Range logs are unavailable, so _diff falls back to walking the history
+    querier.gitiles.range = unittest.mock.Mock(return_value=None)
 
     repo = 'test/repo'
     commit1 = {
@@ -1193,6 +1208,8 @@ def test_querier_get_commits_with_variants_all_fail():
     """Test _get_commits_with_variants returns None when all variants fail"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # No +refs listing, so every ref spelling is probed in order
+    querier.gitiles.refs = unittest.mock.Mock(return_value=None)
 
     with unittest.mock.patch.object(querier.gitiles, 'commits') as mock_commits:
         mock_commits.side_effect = StopIteration()
@@ -1374,6 +1391,8 @@ def test_querier_diff_with_none_commit():
     """Test _diff when _commit1 returns None"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # Range logs are unavailable, so _diff falls back to walking the history
+    querier.gitiles.range = unittest.mock.Mock(return_value=None)
 
     commit1 = {'branch': 'master', 'commit': 'abc123'}
     commit2 = {'branch': 'master', 'commit': 'def456'}
@@ -1401,6 +1420,8 @@ def test_querier_diff_commits_failed_with_branch():
     """Test _diff when _commits fails with branch"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # Range logs are unavailable, so _diff falls back to walking the history
+    querier.gitiles.range = unittest.mock.Mock(return_value=None)
 
     commit1 = {'branch': 'master', 'commit': 'abc123'}
     commit2 = {'branch': 'master', 'commit': 'def456'}
@@ -1418,6 +1439,8 @@ def test_querier_diff_commits_failed_with_hash():
     """Test _diff when _commits fails with both branch and commit hash"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # Range logs are unavailable, so _diff falls back to walking the history
+    querier.gitiles.range = unittest.mock.Mock(return_value=None)
 
     commit1 = {'branch': 'master', 'commit': 'abc123'}
     commit2 = {'branch': 'master', 'commit': 'def456'}
@@ -1436,6 +1459,8 @@ def test_querier_diff_different_commits_between():
     """Test _diff when common commit is different from commit1"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # Range logs are unavailable, so _diff falls back to walking the history
+    querier.gitiles.range = unittest.mock.Mock(return_value=None)
 
     commit1 = {'branch': 'master', 'commit': 'abc123'}
     commit2 = {'branch': 'master', 'commit': 'def456'}
@@ -1468,6 +1493,8 @@ def test_querier_diff_commits_failed_between_commits():
     """Test _diff when _commits fails between commit1 and common commit"""
     config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
     querier = Querier(config)
+    # Range logs are unavailable, so _diff falls back to walking the history
+    querier.gitiles.range = unittest.mock.Mock(return_value=None)
 
     commit1 = {'branch': 'master', 'commit': 'abc123'}
     commit2 = {'branch': 'master', 'commit': 'def456'}
@@ -1541,3 +1568,773 @@ def test_querier_commit1_with_remove_label():
             result, label = querier._commit1('test/repo', commit1, commit2)
             # When commit1 is ahead, should return REMOVE_COMMIT
             assert label == Label.REMOVE_COMMIT or label == ''
+
+
+def test_querier_workers_from_config():
+    """Test worker count is read from the querier config section"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+
+    config['querier'] = {'workers': 8}
+    assert Querier(config)._workers == 8
+
+    config['querier'] = {'workers': 0}
+    assert Querier(config)._workers == 1
+
+    del config['querier']
+    assert Querier(config)._workers == 1
+
+
+def test_querier_fetch_parallel_keeps_order():
+    """Test parallel _fetch returns results in the same order as the serial run"""
+    import random
+    import time
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+
+    data = {
+        'update repo': {
+            'repo%d' % index: [
+                {'name': 'repo%d' % index, 'branch': 'master', 'commit': 'a%d' % index},
+                {'name': 'repo%d' % index, 'branch': 'master', 'commit': 'b%d' % index}
+            ] for index in range(32)
+        }
+    }
+
+    def mock_diff(repo, commit1, commit2):
+        time.sleep(random.random() / 100)
+        return [{'repo': repo, 'commit': commit2['commit']}]
+
+    config['querier'] = {'workers': 1}
+    querier = Querier(config)
+    with unittest.mock.patch.object(querier, '_diff', side_effect=mock_diff):
+        serial = querier._fetch(data, Label.UPDATE_REPO)
+
+    config['querier'] = {'workers': 8}
+    querier = Querier(config)
+    with unittest.mock.patch.object(querier, '_diff', side_effect=mock_diff):
+        parallel = querier._fetch(data, Label.UPDATE_REPO)
+
+    assert len(serial) == 32
+    assert parallel == serial
+
+
+def test_querier_fetch_isolates_failures():
+    """Test a failing repo is logged and skipped without aborting the others"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    config['querier'] = {'workers': 4}
+    querier = Querier(config)
+
+    data = {
+        'update repo': {
+            'repo%d' % index: [
+                {'name': 'repo%d' % index, 'branch': 'master', 'commit': 'a%d' % index},
+                {'name': 'repo%d' % index, 'branch': 'master', 'commit': 'b%d' % index}
+            ] for index in range(4)
+        }
+    }
+
+    def mock_diff(repo, commit1, commit2):
+        if repo == 'repo2':
+            raise requests.exceptions.ConnectionError('connection refused')
+        return [{'repo': repo}]
+
+    with unittest.mock.patch.object(querier, '_diff', side_effect=mock_diff):
+        with unittest.mock.patch('diffmanifests.querier.querier.Logger.error') as mock_error:
+            result = querier._fetch(data, Label.UPDATE_REPO)
+            assert result == [{'repo': 'repo0'}, {'repo': 'repo1'}, {'repo': 'repo3'}]
+            mock_error.assert_called_once()
+            assert 'repo2' in mock_error.call_args[0][0]
+
+
+def test_commit1_merge_base_walk_request_count():
+    """Test _commit1 walks both histories by pages and stops at the first shared commit"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    # Count the pages the walk needs, without the ones fetched ahead
+    config['querier']['prefetch'] = 0
+    querier = Querier(config)
+
+    def _entry(sha, hour):
+        return {'commit': sha, 'committer': {'time': 'Mon Jan 01 %02d:00:00 2024 +0000' % hour}}
+
+    # Shared history of 500 commits, then 150 commits on branch1 and 120 on branch2
+    base = ['base%036d' % index for index in range(500)]
+    history = {
+        'branch1': ['one%037d' % index for index in range(150)][::-1] + base[::-1],
+        'branch2': ['two%037d' % index for index in range(120)][::-1] + base[::-1]
+    }
+    page = 100
+
+    calls = []
+
+    def mock_commits(repo_arg, branch_arg, commit_arg):
+        calls.append((branch_arg, commit_arg))
+        if branch_arg not in history:
+            return None
+        log = history[branch_arg]
+        start = log.index(commit_arg)
+        buf = {'log': [{'commit': sha} for sha in log[start:start + page]]}
+        if start + page < len(log):
+            buf['next'] = log[start + page]
+        return buf
+
+    commit1 = {'branch': 'branch1', 'commit': history['branch1'][0]}
+    commit2 = {'branch': 'branch2', 'commit': history['branch2'][0]}
+
+    with unittest.mock.patch.object(querier.gitiles, 'commits', side_effect=mock_commits):
+        with unittest.mock.patch.object(querier.gitiles, 'commit') as mock_commit:
+            mock_commit.side_effect = [_entry(commit1['commit'], 12), _entry(base[-1], 10)]
+            result, label = querier._commit1('test/repo', commit1, commit2)
+
+    assert result == {'branch': 'branch1', 'commit': base[-1]}
+    assert label == Label.REMOVE_COMMIT
+    # Two pages on each side are enough to meet, without probing every candidate commit
+    assert len(calls) == 4
+
+
+def test_querier_diff_with_range_log():
+    """Test _diff lists both sides with paginated range logs"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    querier = Querier(config)
+
+    commit1 = {'branch': 'branch1', 'commit': 'aaa111'}
+    commit2 = {'branch': 'branch2', 'commit': 'bbb222'}
+
+    pages = {
+        ('aaa111', 'bbb222', None): {'log': [{'commit': 'bbb222'}, {'commit': 'bbb111'}], 'next': 'bbb000'},
+        ('aaa111', 'bbb222', 'bbb000'): {'log': [{'commit': 'bbb000'}]},
+        ('bbb222', 'aaa111', None): {'log': [{'commit': 'aaa111'}]}
+    }
+
+    def mock_range(repo, commit1, commit2, start=None):
+        return pages[(commit1, commit2, start)]
+
+    def mock_build(repo, branch, commit, label):
+        return [{'branch': branch, 'commit': commit['commit'], 'diff': label}]
+
+    with unittest.mock.patch.object(querier.gitiles, 'range', side_effect=mock_range) as mock_range_log:
+        with unittest.mock.patch.object(querier, '_commit1') as mock_commit1:
+            with unittest.mock.patch.object(querier, '_build', side_effect=mock_build):
+                result = querier._diff('test/repo', commit1, commit2)
+
+                assert result == [
+                    {'branch': 'branch2', 'commit': 'bbb222', 'diff': Label.ADD_COMMIT},
+                    {'branch': 'branch2', 'commit': 'bbb111', 'diff': Label.ADD_COMMIT},
+                    {'branch': 'branch2', 'commit': 'bbb000', 'diff': Label.ADD_COMMIT},
+                    {'branch': 'branch1', 'commit': 'aaa111', 'diff': Label.REMOVE_COMMIT}
+                ]
+                assert mock_range_log.call_count == 3
+                mock_commit1.assert_not_called()
+
+
+def test_querier_diff_range_log_unavailable():
+    """Test _diff falls back to walking the history when a range log fails"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    querier = Querier(config)
+
+    commit1 = {'branch': 'master', 'commit': 'abc123'}
+    commit2 = {'branch': 'master', 'commit': 'def456'}
+
+    with unittest.mock.patch.object(querier.gitiles, 'range') as mock_range_log:
+        mock_range_log.side_effect = [{'log': []}, None]
+        with unittest.mock.patch.object(querier, '_commit1') as mock_commit1:
+            mock_commit1.return_value = (None, '')
+            with unittest.mock.patch.object(querier.gitiles, 'commit') as mock_commit:
+                mock_commit.return_value = None
+                result = querier._diff('test/repo', commit1, commit2)
+                assert result == []
+                mock_commit1.assert_called_once()
+
+
+def test_querier_diff_range_log_error():
+    """Test _diff stops the prefetched removed side when listing the added side raises"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    querier = Querier(config)
+
+    commit1 = {'branch': 'master', 'commit': 'abc123'}
+    commit2 = {'branch': 'master', 'commit': 'def456'}
+    pages = unittest.mock.Mock()
+
+    with unittest.mock.patch.object(querier, '_pages', return_value=pages):
+        with unittest.mock.patch.object(querier, '_range', side_effect=requests.exceptions.Timeout('timeout')):
+            with pytest.raises(requests.exceptions.Timeout):
+                querier._diff('test/repo', commit1, commit2)
+    pages.close.assert_called_once()
+
+
+def test_querier_diff_with_commit_graph():
+    """Test _diff answers from the commit graph of an earlier run and fetches only new commits"""
+    import tempfile
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+
+    graph = {}
+    for index, (name, parents) in enumerate([('0', []), ('1', ['0']), ('a', ['1']), ('b', ['1']), ('c', ['b'])]):
+        graph[name * 40] = {'commit': name * 40, 'parents': [item * 40 for item in parents],
+                            'committer': {'time': 'Mon Jan 01 12:0%d:00 2024 +0000' % index}}
+    calls = []
+
+    def mock_get(repo, url, endpoint, done):
+        # One commit per page, so every page fetched shows up in calls
+        assert endpoint == 'log'
+        commit = url.split('?s=')[1].split('&')[0]
+        calls.append(commit[0])
+        return done(200, {'log': [graph[commit]]})
+
+    def mock_build(repo, branch, commit, label):
+        return [{'commit': commit['commit'][0], 'diff': label}]
+
+    with tempfile.TemporaryDirectory() as path:
+        config['cache'] = {'dir': path}
+
+        querier = Querier(config)
+        with unittest.mock.patch.object(querier.gitiles, '_get', side_effect=mock_get):
+            with unittest.mock.patch.object(querier, '_build', side_effect=mock_build):
+                result = querier._diff('test/repo', {'branch': 'b1', 'commit': 'a' * 40},
+                                       {'branch': 'b2', 'commit': 'b' * 40})
+        assert result == [{'commit': 'b', 'diff': Label.ADD_COMMIT}, {'commit': 'a', 'diff': Label.REMOVE_COMMIT}]
+        assert sorted(calls) == ['0', '1', 'a', 'b']
+        querier.gitiles.close()
+
+        calls.clear()
+        querier = Querier(config)
+        with unittest.mock.patch.object(querier.gitiles, '_get', side_effect=mock_get):
+            with unittest.mock.patch.object(querier.gitiles, 'range') as mock_range:
+                with unittest.mock.patch.object(querier, '_build', side_effect=mock_build):
+                    result = querier._diff('test/repo', {'branch': 'b1', 'commit': 'a' * 40},
+                                           {'branch': 'b2', 'commit': 'c' * 40})
+        assert result == [{'commit': 'c', 'diff': Label.ADD_COMMIT}, {'commit': 'b', 'diff': Label.ADD_COMMIT},
+                          {'commit': 'a', 'diff': Label.REMOVE_COMMIT}]
+        assert calls == ['c']
+        mock_range.assert_not_called()
+        querier.gitiles.close()
+
+def _records(commits):
+    return [{
+        Commit.CHANGE: '',
+        Commit.COMMIT: item,
+        Commit.HASHTAGS: [],
+        Commit.REPO: 'test/repo',
+        Commit.TOPIC: ''
+    } for item in commits]
+
+
+def test_querier_resolve_batches():
+    """Test _resolve looks up changes with OR queries of at most batch commits"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    config['querier'] = {'batch': 2, 'commit_fallback': True}
+    querier = Querier(config)
+
+    changes = {
+        'aaa': {'_number': 1, 'current_revision': 'aaa', 'topic': 'topic1', 'hashtags': ['tag1']},
+        'bbb': {'_number': 2, 'current_revision': 'bbb', 'topic': 'topic2', 'hashtags': []}
+    }
+
+    def mock_query(search, start):
+        return [changes[item.replace('commit:', '')] for item in search.split(' OR ')
+                if item.replace('commit:', '') in changes]
+
+    buf = _records(['aaa', 'bbb', 'ccc', 'aaa'])
+
+    with unittest.mock.patch.object(querier.gerrit, 'query', side_effect=mock_query) as mock_gerrit_query:
+        with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+            querier._resolve(buf)
+
+    assert [item[0][0] for item in mock_gerrit_query.call_args_list] == ['commit:aaa OR commit:bbb', 'commit:ccc']
+    assert buf[0][Commit.CHANGE] == 'https://android-review.googlesource.com/1'
+    assert buf[0][Commit.HASHTAGS] == ['tag1']
+    assert buf[0][Commit.TOPIC] == 'topic1'
+    assert buf[1][Commit.CHANGE] == 'https://android-review.googlesource.com/2'
+    assert buf[2][Commit.CHANGE] == ''
+    assert buf[3][Commit.CHANGE] == 'https://android-review.googlesource.com/1'
+
+
+def test_querier_resolve_more_changes():
+    """Test _resolve follows _more_changes pagination"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    config['querier']['commit_fallback'] = True
+    querier = Querier(config)
+
+    pages = {
+        0: [{'_number': 1, 'current_revision': 'aaa'}, {'_number': 2, 'current_revision': 'bbb', '_more_changes': True}],
+        2: [{'_number': 3, 'current_revision': 'ccc'}]
+    }
+    buf = _records(['aaa', 'bbb', 'ccc'])
+
+    with unittest.mock.patch.object(querier.gerrit, 'query', side_effect=lambda search, start: pages[start]) as mock_gerrit_query:
+        with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+            querier._resolve(buf)
+
+    assert mock_gerrit_query.call_count == 2
+    assert [item[Commit.CHANGE] for item in buf] == [
+        'https://android-review.googlesource.com/1',
+        'https://android-review.googlesource.com/2',
+        'https://android-review.googlesource.com/3'
+    ]
+
+
+def test_querier_resolve_batch_failure():
+    """Test _resolve falls back to per commit queries when a batch fails"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    config['querier']['commit_fallback'] = True
+    querier = Querier(config)
+
+    def mock_query(search, start):
+        if ' OR ' in search:
+            return None
+        if search == 'commit:bbb':
+            raise requests.exceptions.ConnectionError('connection reset')
+        return [{'_number': 1}]
+
+    buf = _records(['aaa', 'bbb'])
+
+    with unittest.mock.patch.object(querier.gerrit, 'query', side_effect=mock_query):
+        with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+            querier._resolve(buf)
+
+    assert buf[0][Commit.CHANGE] == 'https://android-review.googlesource.com/1'
+    assert buf[1][Commit.CHANGE] == ''
+
+
+def test_querier_resolve_older_patch_set():
+    """Test _resolve queries unmatched commits alone when a change matched an older patch set"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    config['querier']['commit_fallback'] = True
+    querier = Querier(config)
+
+    def mock_query(search, start):
+        if ' OR ' in search:
+            return [{'_number': 1, 'current_revision': 'aaa'}, {'_number': 2, 'current_revision': 'zzz'}]
+        if search == 'commit:bbb':
+            return [{'_number': 2, 'current_revision': 'zzz'}]
+        return []
+
+    buf = _records(['aaa', 'bbb', 'ccc'])
+
+    with unittest.mock.patch.object(querier.gerrit, 'query', side_effect=mock_query) as mock_gerrit_query:
+        with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+            querier._resolve(buf)
+
+    assert mock_gerrit_query.call_count == 3
+    assert [item[Commit.CHANGE] for item in buf] == [
+        'https://android-review.googlesource.com/1',
+        'https://android-review.googlesource.com/2',
+        ''
+    ]
+
+
+def test_change_id():
+    """Test Change-Id trailers are read from the last paragraph of a message"""
+    from diffmanifests.querier.querier import change_id
+
+    key = 'I' + 'a' * 40
+    assert change_id('Fix build\n\nBug: 1\nChange-Id: %s\n' % key) == key
+    assert change_id('Fix build\n\nChange-Id: %s\nChange-Id: I%s' % (key, 'b' * 40)) == 'I' + 'b' * 40
+    assert change_id('Merge "Fix build"') is None
+    assert change_id('Revert\n\nChange-Id: %s\n\nTest: none' % key) is None
+    assert change_id('Fix build\n\nChange-Id: I123456789') is None
+    assert change_id('') is None
+
+
+def test_querier_resolve_change_ids():
+    """Test _resolve looks up changes by Change-Id and skips commits without one"""
+    from diffmanifests.metrics.metrics import Metrics
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    config['querier'] = {'batch': 2}
+    querier = Querier(config)
+
+    key1, key2, key3 = 'I' + '1' * 40, 'I' + '2' * 40, 'I' + '3' * 40
+    changes = {
+        key1: [{'_number': 1, 'change_id': key1, 'current_revision': 'aaa', 'project': 'test/repo', 'branch': 'master'}],
+        # Cherry-picked to another branch, the revision tells them apart
+        key2: [{'_number': 2, 'change_id': key2, 'current_revision': 'zzz', 'project': 'test/repo', 'branch': 'stable'},
+               {'_number': 3, 'change_id': key2, 'current_revision': 'bbb', 'project': 'test/repo', 'branch': 'master'}]
+    }
+
+    def mock_query(search, start):
+        return [item for key in search.split(' OR ') for item in changes.get(key.replace('change:', ''), [])]
+
+    buf = _records(['aaa', 'bbb', 'ccc', 'ddd', 'eee'])
+    buf[0][Commit.MESSAGE] = 'One\n\nChange-Id: %s' % key1
+    buf[1][Commit.MESSAGE] = 'Two\n\nChange-Id: %s' % key2
+    buf[2][Commit.MESSAGE] = 'Three\n\nChange-Id: %s' % key3
+    buf[3][Commit.MESSAGE] = 'Merge branch "upstream"'
+    buf[4][Commit.MESSAGE] = 'Import upstream'
+
+    Metrics.enable()
+    with unittest.mock.patch.object(querier.gerrit, 'query', side_effect=mock_query) as mock_gerrit_query:
+        with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+            querier._resolve(buf)
+    Metrics.disable()
+
+    assert [item[0][0] for item in mock_gerrit_query.call_args_list] == [
+        'change:%s OR change:%s' % (key1, key2), 'change:%s' % key3]
+    assert [item[Commit.CHANGE] for item in buf] == [
+        'https://android-review.googlesource.com/1',
+        'https://android-review.googlesource.com/3',
+        '', '', ''
+    ]
+    assert Metrics.dump()['counters'] == {'change_id_hit': 2, 'change_id_miss': 1, 'change_id_skip': 2}
+
+    # Without Change-Id the commits are looked up with commit: only when asked to
+    config['querier'] = {'commit_fallback': True}
+    querier = Querier(config)
+    buf = _records(['ddd'])
+    buf[0][Commit.MESSAGE] = 'Import upstream'
+
+    with unittest.mock.patch.object(querier.gerrit, 'query', return_value=[{'_number': 4, 'current_revision': 'ddd'}]) as mock_gerrit_query:
+        with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+            querier._resolve(buf)
+
+    mock_gerrit_query.assert_called_once_with('commit:ddd', 0)
+    assert buf[0][Commit.CHANGE] == 'https://android-review.googlesource.com/4'
+
+
+def test_querier_resolve_change_id_branch():
+    """Test a change found by Change-Id on another revision is matched by project and branch"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    querier = Querier(config)
+
+    key = 'I' + '1' * 40
+    found = [{'_number': 1, 'change_id': key, 'current_revision': 'yyy', 'project': 'test/repo', 'branch': 'stable'},
+             {'_number': 2, 'change_id': key, 'current_revision': 'zzz', 'project': 'test/repo', 'branch': 'master'},
+             {'_number': 3, 'change_id': key, 'current_revision': 'xxx', 'project': 'other/repo', 'branch': 'master'}]
+
+    buf = _records(['aaa'])
+    buf[0][Commit.BRANCH] = 'refs/heads/master'
+    buf[0][Commit.MESSAGE] = 'One\n\nChange-Id: %s' % key
+
+    with unittest.mock.patch.object(querier.gerrit, 'query', side_effect=[None, found]) as mock_gerrit_query:
+        with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+            querier._resolve(buf)
+
+    # The failed batch falls back to a query of its own
+    assert [item[0][0] for item in mock_gerrit_query.call_args_list] == ['change:%s' % key] * 2
+    assert buf[0][Commit.CHANGE] == 'https://android-review.googlesource.com/2'
+
+
+def test_querier_resolve_cache():
+    """Test _resolve takes changes from the cache and refreshes merged ones by number"""
+    import tempfile
+    import time
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    key1, key2 = 'I' + '1' * 40, 'I' + '2' * 40
+    changes = [{'_number': 1, 'change_id': key1, 'current_revision': 'aaa', 'project': 'test/repo',
+                'status': 'MERGED', 'topic': 'topic1', 'hashtags': []}]
+
+    def records():
+        buf = _records(['aaa', 'bbb'])
+        buf[0][Commit.MESSAGE] = 'One\n\nChange-Id: %s' % key1
+        buf[1][Commit.MESSAGE] = 'Two\n\nChange-Id: %s' % key2
+        return buf
+
+    def resolve(config, found):
+        querier = Querier(config)
+        buf = records()
+        with unittest.mock.patch.object(querier.gerrit, 'query', return_value=found) as mock_gerrit_query:
+            with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+                querier._resolve(buf)
+        querier.gerrit.close()
+        return buf, [item[0][0] for item in mock_gerrit_query.call_args_list]
+
+    with tempfile.TemporaryDirectory() as path:
+        config['cache'] = {'dir': path, 'gerrit_ttl': 3600}
+
+        buf, searches = resolve(config, changes)
+        assert searches == ['change:%s OR change:%s' % (key1, key2)]
+        assert [item[Commit.TOPIC] for item in buf] == ['topic1', '']
+
+        # Found and not found changes are both taken from the cache
+        buf, searches = resolve(config, changes)
+        assert searches == []
+        assert buf[0][Commit.CHANGE] == 'https://android-review.googlesource.com/1'
+        assert [item[Commit.TOPIC] for item in buf] == ['topic1', '']
+
+        # Past the TTL the merged change is refreshed by number, the missing one looked up again
+        with unittest.mock.patch('diffmanifests.gerrit.gerrit.time.time', return_value=time.time() + 7200):
+            buf, searches = resolve(config, [dict(changes[0], topic='topic2')])
+        assert sorted(searches) == ['change:1', 'change:%s' % key2]
+        assert [item[Commit.TOPIC] for item in buf] == ['topic2', '']
+
+        # The refresh flag looks everything up again
+        config['cache']['gerrit_refresh'] = True
+        buf, searches = resolve(config, changes)
+        assert searches == ['change:%s OR change:%s' % (key1, key2)]
+
+
+def test_querier_run_defers_gerrit_queries():
+    """Test run builds records without Gerrit and resolves them in batches"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    config['querier']['commit_fallback'] = True
+    querier = Querier(config)
+
+    commit = {
+        'author': {'email': 'test@example.com', 'name': 'Test User', 'time': 'Mon Jan 01 12:00:00 2023 +0000'},
+        'commit': 'abc123',
+        'committer': {'email': 'test@example.com', 'name': 'Test User', 'time': 'Mon Jan 01 12:00:00 2023 +0000'},
+        'message': 'Test commit'
+    }
+    data = {
+        Label.ADD_REPO: {'test/repo': [{}, {'branch': 'master', 'commit': 'abc123', 'name': 'test/repo'}]}
+    }
+
+    with unittest.mock.patch.object(querier.gitiles, 'commit', return_value=commit):
+        with unittest.mock.patch.object(querier.gerrit, 'query', return_value=[{'_number': 1, 'current_revision': 'abc123'}]) as mock_gerrit_query:
+            with unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+                result = querier.run(data)
+
+    mock_gerrit_query.assert_called_once_with('commit:abc123', 0)
+    assert result[0][Commit.CHANGE] == 'https://android-review.googlesource.com/1'
+    assert querier._deferred is False
+
+
+def _engine_data():
+    def commit(sha):
+        return {
+            'author': {'email': 'test@example.com', 'name': 'Test User', 'time': 'Mon Jan 01 12:00:00 2023 +0000'},
+            'commit': sha,
+            'committer': {'email': 'test@example.com', 'name': 'Test User', 'time': 'Mon Jan 01 12:00:00 2023 +0000'},
+            'message': 'Commit %s\n' % sha
+        }
+
+    commits = {item: commit(item) for item in ['add111', 'rem111', 'upd111', 'upd222', 'upd333', 'walk22']}
+    pages = {
+        ('upd111', 'upd333', None): {'log': [commits['upd333']], 'next': 'upd222'},
+        ('upd111', 'upd333', 'upd222'): {'log': [commits['upd222']]},
+        ('upd333', 'upd111', None): {'log': []}
+    }
+    data = {
+        Label.ADD_REPO: {'repo/add': [{}, {'branch': 'master', 'commit': 'add111', 'name': 'repo/add'}]},
+        Label.REMOVE_REPO: {'repo/remove': [{'branch': 'master', 'commit': 'rem111', 'name': 'repo/remove'}, {}]},
+        Label.UPDATE_REPO: {
+            'repo/update': [{'branch': 'master', 'commit': 'upd111', 'name': 'repo/update'},
+                            {'branch': 'master', 'commit': 'upd333', 'name': 'repo/update'}],
+            'repo/walk': [{'branch': 'master', 'commit': 'walk11', 'name': 'repo/walk'},
+                          {'branch': 'master', 'commit': 'walk22', 'name': 'repo/walk'}]
+        }
+    }
+
+    def query(search, start):
+        return [{'_number': index, 'current_revision': item.replace('commit:', '')}
+                for index, item in enumerate(search.split(' OR ')) if item.replace('commit:', '') != 'upd222']
+
+    return commits, pages, data, query
+
+
+def test_async_querier_matches_querier():
+    """Test the async engine produces exactly the records of Querier.run()"""
+    import pytest
+    pytest.importorskip('aiohttp')
+    from diffmanifests.querier.querier import AsyncQuerier
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    config['querier'] = {'batch': 2, 'commit_fallback': True}
+    commits, pages, data, query = _engine_data()
+    walked = [{Commit.COMMIT: 'walk22', Commit.REPO: 'repo/walk', Commit.CHANGE: '', Commit.HASHTAGS: [], Commit.TOPIC: ''}]
+
+    def mock_range(repo, commit1, commit2, start=None):
+        return None if repo == 'repo/walk' else pages[(commit1, commit2, start)]
+
+    async def mock_arange(repo, commit1, commit2, start=None):
+        return mock_range(repo, commit1, commit2, start)
+
+    async def mock_acommit(repo, commit):
+        return commits.get(commit, None)
+
+    async def mock_aquery(search, start):
+        return query(search, start)
+
+    querier = Querier(config)
+    with unittest.mock.patch.object(querier.gitiles, 'range', side_effect=mock_range), \
+            unittest.mock.patch.object(querier.gitiles, 'commit', side_effect=lambda repo, commit: commits.get(commit, None)), \
+            unittest.mock.patch.object(querier.gerrit, 'query', side_effect=query), \
+            unittest.mock.patch.object(querier, '_walk', side_effect=lambda *_: [dict(item) for item in walked]):
+        expected = querier.run(data)
+
+    querier = AsyncQuerier(config)
+    with unittest.mock.patch.object(querier.agitiles, 'range', side_effect=mock_arange), \
+            unittest.mock.patch.object(querier.agitiles, 'commit', side_effect=mock_acommit), \
+            unittest.mock.patch.object(querier.agerrit, 'query', side_effect=mock_aquery), \
+            unittest.mock.patch.object(querier, '_walk', side_effect=lambda *_: [dict(item) for item in walked]) as mock_walk:
+        result = querier.run(data)
+
+    assert result == expected
+    assert [item[Commit.COMMIT] for item in result] == ['add111', 'rem111', 'upd333', 'upd222', 'walk22']
+    assert result[3][Commit.CHANGE] == ''
+    assert result[4][Commit.CHANGE] != ''
+    mock_walk.assert_called_once()
+
+
+def test_async_querier_diff_with_commit_graph():
+    """Test the async engine walks the commit graph of full SHAs with the async client only"""
+    import asyncio
+
+    import pytest
+    pytest.importorskip('aiohttp')
+    from diffmanifests.querier.querier import AsyncQuerier
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+
+    graph = {}
+    for index, (name, parents) in enumerate([('0', []), ('1', ['0']), ('a', ['1']), ('b', ['1']), ('c', ['b'])]):
+        graph[name * 40] = {'commit': name * 40, 'parents': [item * 40 for item in parents],
+                            'committer': {'time': 'Mon Jan 01 12:0%d:00 2024 +0000' % index}}
+    calls = []
+
+    async def mock_aget(repo, url, endpoint, done):
+        assert endpoint == 'log'
+        commit = url.split('?s=')[1].split('&')[0]
+        calls.append(commit[0])
+        return done(200, {'log': [graph[commit]]})
+
+    def mock_build(repo, branch, commit, label):
+        return [{'commit': commit['commit'][0], 'diff': label}]
+
+    querier = AsyncQuerier(config)
+    with unittest.mock.patch.object(querier.agitiles, '_get', side_effect=mock_aget), \
+            unittest.mock.patch.object(querier.agitiles, 'range') as mock_arange, \
+            unittest.mock.patch.object(querier.gitiles, '_get') as mock_get, \
+            unittest.mock.patch.object(querier, '_build', side_effect=mock_build):
+        result = asyncio.run(querier._adiff('test/repo', {'branch': 'b1', 'commit': 'a' * 40},
+                                            {'branch': 'b2', 'commit': 'c' * 40}))
+
+    assert result == [{'commit': 'c', 'diff': Label.ADD_COMMIT}, {'commit': 'b', 'diff': Label.ADD_COMMIT},
+                      {'commit': 'a', 'diff': Label.REMOVE_COMMIT}]
+    assert sorted(calls) == ['0', '1', 'a', 'b', 'c']
+    mock_arange.assert_not_called()
+    mock_get.assert_not_called()
+
+
+def test_async_querier_close():
+    """Test close() releases the sessions and caches of every client"""
+    import pytest
+    pytest.importorskip('aiohttp')
+    from diffmanifests.querier.querier import AsyncQuerier
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    querier = AsyncQuerier(config)
+    with unittest.mock.patch.object(querier.agerrit, 'close') as mock_agerrit, \
+            unittest.mock.patch.object(querier.agitiles, 'close') as mock_agitiles, \
+            unittest.mock.patch.object(querier.gerrit, 'close', wraps=querier.gerrit.close) as mock_gerrit, \
+            unittest.mock.patch.object(querier.gitiles, 'close', wraps=querier.gitiles.close) as mock_gitiles:
+        querier.close()
+    for item in [mock_agerrit, mock_agitiles, mock_gerrit, mock_gitiles]:
+        item.assert_called_once()
+
+
+def test_async_querier_resolve_change_ids():
+    """Test the async engine looks up changes by Change-Id too"""
+    import asyncio
+
+    import pytest
+    pytest.importorskip('aiohttp')
+    from diffmanifests.querier.querier import AsyncQuerier
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    querier = AsyncQuerier(config)
+
+    key = 'I' + '1' * 40
+    buf = _records(['aaa', 'bbb'])
+    buf[0][Commit.MESSAGE] = 'One\n\nChange-Id: %s' % key
+    buf[1][Commit.MESSAGE] = 'Import upstream'
+
+    async def mock_aquery(search, start):
+        return [{'_number': 1, 'change_id': key, 'current_revision': 'aaa', 'project': 'test/repo'}]
+
+    with unittest.mock.patch.object(querier.agerrit, 'query', side_effect=mock_aquery) as mock_gerrit_query, \
+            unittest.mock.patch.object(querier.gerrit, 'url', return_value='https://android-review.googlesource.com'):
+        asyncio.run(querier._aresolve(buf))
+
+    mock_gerrit_query.assert_called_once_with('change:%s' % key, 0)
+    assert [item[Commit.CHANGE] for item in buf] == ['https://android-review.googlesource.com/1', '']
+
+
+def test_async_querier_isolates_failures():
+    """Test the async engine keeps going when one repo fails"""
+    import pytest
+    pytest.importorskip('aiohttp')
+    from diffmanifests.querier.querier import AsyncQuerier
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    commits, _, data, query = _engine_data()
+    data = {Label.ADD_REPO: data[Label.ADD_REPO], Label.REMOVE_REPO: data[Label.REMOVE_REPO]}
+
+    async def mock_acommit(repo, commit):
+        if repo == 'repo/add':
+            raise requests.exceptions.ConnectionError('connection reset')
+        return commits[commit]
+
+    async def mock_aquery(search, start):
+        return query(search, start)
+
+    querier = AsyncQuerier(config)
+    with unittest.mock.patch.object(querier.agitiles, 'commit', side_effect=mock_acommit), \
+            unittest.mock.patch.object(querier.agerrit, 'query', side_effect=mock_aquery):
+        result = querier.run(data)
+
+    assert [item[Commit.COMMIT] for item in result] == ['rem111']
+
+
+def test_get_commits_with_variants_remembers_spelling():
+    """Test the working ref spelling is remembered and a +refs listing prunes missing ones"""
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+    querier = Querier(config)
+
+    calls = []
+
+    def mock_commits(repo_arg, branch_arg, commit_arg):
+        calls.append(branch_arg)
+        if branch_arg == 'refs/tags/v1.0':
+            return {'log': [{'commit': commit_arg}]}
+        return None
+
+    with unittest.mock.patch.object(querier.gitiles, 'commits', side_effect=mock_commits):
+        with unittest.mock.patch.object(querier.gitiles, 'refs') as mock_refs:
+            mock_refs.return_value = {'refs/heads/master': {'value': 'abc'}, 'refs/tags/v1.0': {'value': 'def'}}
+            assert querier._get_commits_with_variants('test/repo', 'v1.0', 'sha1') is not None
+            assert calls == ['v1.0', 'refs/tags/v1.0']
+
+            calls.clear()
+            assert querier._get_commits_with_variants('test/repo', 'v1.0', 'sha2') is not None
+            assert calls == ['refs/tags/v1.0']
+
+            # Refs unknown to the listing are not probed at all
+            calls.clear()
+            assert querier._get_commits_with_variants('test/repo', 'unknown', 'sha3') is None
+            assert calls == ['unknown']
+            mock_refs.assert_called_with('test/repo')
+
+
+def test_get_commits_with_variants_persists_spelling():
+    """Test the working ref spelling is kept in the cache for the next run"""
+    import tempfile
+
+    config = load(os.path.join(os.path.dirname(__file__), '../../diffmanifests/config/config.json'))
+
+    calls = []
+
+    def mock_commits(repo_arg, branch_arg, commit_arg):
+        calls.append(branch_arg)
+        if branch_arg == 'refs/tags/v1.0':
+            return {'log': [{'commit': commit_arg}]}
+        return None
+
+    with tempfile.TemporaryDirectory() as path:
+        config['cache'] = {'dir': path}
+
+        querier = Querier(config)
+        querier.gitiles.refs = unittest.mock.Mock(return_value=None)
+        with unittest.mock.patch.object(querier.gitiles, 'commits', side_effect=mock_commits):
+            assert querier._get_commits_with_variants('test/repo', 'v1.0', 'sha1') is not None
+        assert calls == ['v1.0', 'refs/heads/v1.0', 'refs/tags/v1.0']
+        querier.gitiles.close()
+
+        calls.clear()
+        querier = Querier(config)
+        querier.gitiles.refs = unittest.mock.Mock(return_value=None)
+        with unittest.mock.patch.object(querier.gitiles, 'commits', side_effect=mock_commits):
+            assert querier._get_commits_with_variants('test/repo', 'v1.0', 'sha2') is not None
+        assert calls == ['refs/tags/v1.0']
+        querier.gitiles.refs.assert_not_called()
+        querier.gitiles.close()
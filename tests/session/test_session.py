@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import http.server
+import socket
+import threading
+import unittest.mock
+
+import pytest
+
+from diffmanifests.metrics.metrics import Metrics
+from diffmanifests.session.session import connect, fetch
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = b")]}'\n[]"
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_connect():
+    session = connect('gerrit', 'admin', 'password', 2, 4, 8)
+    adapter = session.get_adapter('https://android-review.googlesource.com')
+    assert adapter._pool_connections == 4
+    assert adapter._pool_maxsize == 8
+    assert adapter.max_retries.total == 2
+    assert session.auth == ('admin', 'password')
+    session.close()
+
+    session = connect('gerrit', '', '', 0, 10, 10)
+    assert session.auth is None
+    session.close()
+
+
+def test_connect_connections():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d/changes/' % server.server_address[1]
+
+    Metrics.enable()
+    session = connect('gerrit', '', '', 0, 10, 10)
+    for _ in range(5):
+        assert session.get(url).content == b")]}'\n[]"
+    session.close()
+    session = connect('gerrit', '', '', 0, 10, 10)
+    session.get(url)
+    session.close()
+    Metrics.disable()
+    server.shutdown()
+    server.server_close()
+
+    # Requests over one session share its connection
+    assert Metrics.dump()['counters']['gerrit_connections'] == 2
+
+
+def test_fetch():
+    aiohttp = pytest.importorskip('aiohttp')
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d/changes/' % server.server_address[1]
+    # A port nobody listens on refuses every connection
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    closed = 'http://127.0.0.1:%d/changes/' % sock.getsockname()[1]
+    sock.close()
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            reply = await fetch(session, url, params=[('q', 'status:open')], timeout=10)
+            assert reply.status_code == 200
+            assert reply.content == b")]}'\n[]"
+            with unittest.mock.patch.object(session, 'get', wraps=session.get) as mock_get:
+                with pytest.raises(aiohttp.ClientConnectionError):
+                    await fetch(session, closed, timeout=10, retry=2)
+                assert mock_get.call_count == 3
+
+    asyncio.run(run())
+    server.shutdown()
+    server.server_close()
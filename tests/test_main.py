@@ -44,6 +44,57 @@ def test_load_xml():
         os.remove(temp_file)
 
 
+def test_load_xml_shape():
+    """Test XML loading keeps default, remote and project in xmltodict shape"""
+    xml_content = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest>
+    <notice>ignored</notice>
+    <remote name="aosp" fetch=".."/>
+    <default revision="master" remote="aosp"/>
+    <project name="platform/build" path="build/make" revision="abc123">
+        <copyfile src="core/root.mk" dest="Makefile"/>
+        <linkfile src="envsetup.sh" dest="build/envsetup.sh"/>
+    </project>
+    <project name="platform/art" revision="def456" upstream="main"/>
+    <include name="other.xml"/>
+</manifest>
+"""
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.xml', delete=False) as f:
+        f.write(xml_content)
+        f.flush()
+        temp_file = f.name
+
+    try:
+        data = load(temp_file)
+        assert data == {
+            'manifest': {
+                'remote': {'@name': 'aosp', '@fetch': '..'},
+                'default': {'@revision': 'master', '@remote': 'aosp'},
+                'project': [
+                    {'@name': 'platform/build', '@path': 'build/make', '@revision': 'abc123'},
+                    {'@name': 'platform/art', '@revision': 'def456', '@upstream': 'main'}
+                ]
+            }
+        }
+    finally:
+        os.remove(temp_file)
+
+
+def test_load_xml_fixtures():
+    """Test XML loading of the manifest fixtures"""
+    path = os.path.join(os.path.dirname(__file__), 'data')
+
+    data = load(os.path.join(path, 'manifest1-004.xml'))
+    assert data['manifest']['default'] == {'@revision': 'master', '@remote': 'aosp', '@sync-j': '4'}
+    assert data['manifest']['remote']['@name'] == 'aosp'
+    assert len(data['manifest']['project']) == 2
+    assert data['manifest']['project'][0]['@path'] == 'build/soong-main'
+
+    data = load(os.path.join(path, 'manifest1-001.xml'))
+    for item in data['manifest']['project']:
+        assert all(key.startswith('@') for key in item.keys())
+
+
 def test_load_invalid_extension():
     """Test loading a file with invalid extension"""
     with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
@@ -169,6 +220,8 @@ def test_main_success_flow():
     class MockQuerier:
         def __init__(self, *_):
             pass
+        def close(self):
+            pass
         def run(self, buf):
             # Inject a minimal commit object to be printed
             return [
@@ -354,6 +407,8 @@ def test_main_querier_exception():
     class MockQuerier:
         def __init__(self, *_):
             pass
+        def close(self):
+            pass
         def run(self, *_):
             raise QuerierException('Querier error')
 
@@ -387,6 +442,8 @@ def test_main_printer_exception():
     class MockQuerier:
         def __init__(self, *_):
             pass
+        def close(self):
+            pass
         def run(self, buf):
             return [{
                 'author': 'Test <test@example.com>',
@@ -454,3 +511,60 @@ def test_main_output_file_exists():
     finally:
         if os.path.exists(output_file):
             os.remove(output_file)
+
+
+def test_main_metrics_file():
+    """Test main writes JSON and Prometheus metrics even when the run fails"""
+    from diffmanifests.metrics.metrics import Metrics
+
+    with tempfile.TemporaryDirectory() as path:
+        name = os.path.join(path, 'metrics.json')
+        config_file = os.path.join(os.path.dirname(__file__), '../diffmanifests/config/config.json')
+        with unittest.mock.patch('sys.argv', [
+            'diffmanifests',
+            '-c', config_file,
+            '-m', 'nonexistent1.xml',
+            '-n', 'nonexistent2.xml',
+            '-o', 'output.json',
+            '--metrics-file', name
+        ]):
+            result = main()
+        assert result == -2
+        assert Metrics.enabled() is False
+        with open(name, 'r') as f:
+            assert 'load' in json.load(f)['phases']
+        assert os.path.exists(os.path.join(path, 'metrics.prom'))
+
+
+def test_main_querier_close():
+    """Test main closes the querier whether its run succeeds or fails"""
+    from diffmanifests.querier.querier import QuerierException
+
+    config_file = os.path.join(os.path.dirname(__file__), '../diffmanifests/config/config.json')
+    manifest1_file = os.path.join(os.path.dirname(__file__), 'data/manifest1-001.xml')
+    manifest2_file = os.path.join(os.path.dirname(__file__), 'data/manifest2-001.xml')
+
+    class MockDiffer:
+        def __init__(self, *_):
+            pass
+        def run(self, *_):
+            return {'update repo': {'test': [{'commit': 'abc'}, {'commit': 'def'}]}}
+
+    querier = unittest.mock.Mock()
+    querier.run.side_effect = QuerierException('Querier error')
+
+    for engine, name in [('sync', 'Querier'), ('async', 'AsyncQuerier')]:
+        querier.close.reset_mock()
+        with unittest.mock.patch('diffmanifests.main.Differ', MockDiffer), \
+             unittest.mock.patch('diffmanifests.main.%s' % name, return_value=querier), \
+             unittest.mock.patch('sys.argv', [
+                 'diffmanifests',
+                 '-c', config_file,
+                 '-m', manifest1_file,
+                 '-n', manifest2_file,
+                 '-o', 'output.json',
+                 '--engine', engine,
+                 '--no-cache'
+             ]):
+            assert main() == -6
+        querier.close.assert_called_once()